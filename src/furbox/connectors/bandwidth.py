@@ -0,0 +1,140 @@
+""" Module to limit the total bandwidth and number of connections used by all downloads.
+
+A single shared scheduler applies a global bytes per second cap, implemented as a token bucket which is
+consumed by every chunk read, alongside a budget of concurrent connections shared by all downloaders.
+Individual hosts can additionally be limited to a number of requests per second.
+
+Example usage of the bandwidth scheduler: ::
+
+    scheduler.configure(bytes_per_second=(1024 * 1024), max_connections=4)
+    scheduler.limit_host(url, requests_per_second=2)
+
+    with scheduler.connection(url):
+        response = requests.get(url, stream=True, timeout=10)
+        for chunk in scheduler.throttle(response.iter_content(chunk_size=scheduler.CHUNK_SIZE)):
+            f.write(chunk)
+"""
+import logging
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """ Thread safe token bucket, refilled at a constant rate up to a maximum capacity.
+
+    Consuming more tokens than are available puts the bucket into debt, and the caller is blocked until
+    that debt would be repaid. This allows consuming amounts larger than the capacity while still holding
+    the long term average to the configured rate.
+
+    Args:
+        rate (float): Number of tokens added to the bucket per second.
+        capacity (float | None, optional): Maximum number of tokens the bucket can hold. \
+                                           Defaults to None, where one second worth of tokens is used.
+
+    Raises:
+        ValueError: Provided rate was not a positive number.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got '{rate}'")
+
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: float) -> None:
+        """ Remove tokens from the bucket, blocking until the bucket is no longer in debt. """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + ((now - self.last_refill) * self.rate))
+            self.last_refill = now
+
+            self.tokens -= amount
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        # Sleep outside of the lock, such that other threads can queue up their own debt concurrently.
+        if wait_time:
+            time.sleep(wait_time)
+
+
+class BandwidthScheduler:
+    """ Shared scheduler limiting download bandwidth and the number of concurrent connections.
+
+    Args:
+        bytes_per_second (int | None, optional): Global bandwidth cap in bytes per second. \
+                                                 Defaults to None, where bandwidth is unlimited.
+        max_connections (int | None, optional): Maximum number of concurrent connections. \
+                                                Defaults to None, where connections are unlimited.
+    """
+
+    CHUNK_SIZE: int = 1024 * 128
+
+    def __init__(self, bytes_per_second: int | None = None, max_connections: int | None = None) -> None:
+        self.configure(bytes_per_second=bytes_per_second, max_connections=max_connections)
+
+    def configure(self, bytes_per_second: int | None = None, max_connections: int | None = None) -> None:
+        """ Set the bandwidth and connection limits. Should be called before any downloads are started.
+
+        Args:
+            bytes_per_second (int | None, optional): Global bandwidth cap in bytes per second. \
+                                                     Defaults to None, where bandwidth is unlimited.
+            max_connections (int | None, optional): Maximum number of concurrent connections. \
+                                                    Defaults to None, where connections are unlimited.
+        """
+        self.bucket = TokenBucket(rate=bytes_per_second) if bytes_per_second else None
+        self.connections = threading.BoundedSemaphore(max_connections) if max_connections else None
+        self.host_buckets: dict[str, TokenBucket] = {}
+
+        if bytes_per_second or max_connections:
+            logger.info(f"Limiting downloads to {bytes_per_second or 'unlimited'} bytes per second "
+                        f"and {max_connections or 'unlimited'} connections")
+
+    def limit_host(self, url: str, requests_per_second: float) -> None:
+        """ Limit the rate of requests to the host of a URL. Hosts which are already limited are unchanged.
+
+        Args:
+            url (str): URL to limit the host of.
+            requests_per_second (float): Maximum number of requests per second to the host.
+        """
+        # Allow only a single request in a burst, such that requests are evenly spaced.
+        self.host_buckets.setdefault(
+            urlparse(url).netloc, TokenBucket(rate=requests_per_second, capacity=1),
+        )
+
+    @contextmanager
+    def connection(self, url: str | None = None) -> Iterator[None]:
+        """ Context manager holding one connection from the budget, blocking until one is available.
+
+        Args:
+            url (str | None, optional): URL the connection will request, subject to any limit on its host. \
+                                        Defaults to None, where no host limit applies.
+        """
+        if url and (host_bucket := self.host_buckets.get(urlparse(url).netloc)):
+            host_bucket.consume(1)
+
+        if self.connections is None:
+            yield
+            return
+
+        with self.connections:
+            yield
+
+    def throttle(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """ Wrap an iterable of chunks, consuming from the shared token bucket for each chunk read. """
+        for chunk in chunks:
+            if self.bucket:
+                self.bucket.consume(len(chunk))
+
+            yield chunk
+
+
+# Shared scheduler used by every download path, configured from `Config.misc` on startup.
+scheduler = BandwidthScheduler()
@@ -9,11 +9,22 @@ Example usage of Cache: ::
 
     with open(file_path, "r") as f:
         post_data = f.read()
+
+Example usage of HashCache: ::
+
+    with HashCache() as hash_cache:
+        file_hash = hash_file(file_path, hash_cache=hash_cache)
 """
 import logging
 import os
+import sqlite3
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
+from types import TracebackType
+from typing import NamedTuple, Self
 
 logger = logging.getLogger(__name__)
 
@@ -65,3 +76,105 @@ class Cache:
     def resolve_path(self, file_path: str | Path) -> Path:
         """ Resolve a file path relative to the cache directory. """
         return self.cache_dir / file_path
+
+
+class FileStat(NamedTuple):
+    """ Named tuple of the file status fields used to detect when a file on disk has changed. """
+
+    size:     int
+    mtime_ns: int
+    inode:    int
+
+    @classmethod
+    def from_path(cls, file_path: Path) -> Self:
+        """ Read the status of a file on disk. """
+        stat = file_path.stat()
+        return cls(size=stat.st_size, mtime_ns=stat.st_mtime_ns, inode=stat.st_ino)
+
+
+class HashCache:
+    """ Persistent cache of file hash digests, stored in an SQLite database in the cache directory.
+
+    Entries are keyed on file path and hash algorithm, and are only valid while the size, modification time
+    and inode of the file remain unchanged. All entries are loaded into memory when the cache is opened, and
+    new entries are written back when it is closed, such that lookups from worker threads are cheap.
+
+    Args:
+        cache_dir (str | Path | None, optional): Custom directory to use as the base cache location. \
+                                                 Defaults to None, where a default cache location will be used.
+    """
+
+    FILE_NAME: str = "file_hashes.sqlite3"
+
+    def __init__(self, cache_dir: str | Path | None = None) -> None:
+        self.database_path = Cache(cache_dir).resolve_path(self.FILE_NAME)
+        self.lock = threading.Lock()
+
+        self.entries: dict[tuple[str, str], tuple[FileStat, str]] = {}
+        self.updates: dict[tuple[str, str], tuple[FileStat, str]] = {}
+
+        with self._connect() as connection:
+            for path, algorithm, size, mtime_ns, inode, digest in connection.execute(
+                "SELECT path, algorithm, size, mtime_ns, inode, digest FROM file_hashes",
+            ):
+                self.entries[path, algorithm] = (FileStat(size, mtime_ns, inode), digest)
+
+        logger.debug(f"Loaded {len(self.entries)} cached file hashes from '{self.database_path}'")
+
+    def __enter__(self) -> Self:
+        """ Allow the hash cache to be opened in a context manager. """
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None,
+                 exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        """ Write any new entries to disk when exiting a context manager. """
+        self.close()
+
+    def get(self, file_path: Path, hash_algorithm: str, file_stat: FileStat) -> str | None:
+        """ Return the cached digest of a file, or None if no entry exists or the file has changed. """
+        with self.lock:
+            entry = self.entries.get((str(file_path.absolute()), hash_algorithm))
+
+        if entry is None or entry[0] != file_stat:
+            return None
+
+        return entry[1]
+
+    def put(self, file_path: Path, hash_algorithm: str, file_stat: FileStat, digest: str) -> None:
+        """ Store the digest of a file, along with the file status it was calculated for. """
+        key = (str(file_path.absolute()), hash_algorithm)
+        with self.lock:
+            self.entries[key] = self.updates[key] = (file_stat, digest)
+
+    def close(self) -> None:
+        """ Write all new and updated entries to the database. """
+        with self.lock:
+            updates, self.updates = self.updates, {}
+
+        if not updates:
+            return
+
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO file_hashes (path, algorithm, size, mtime_ns, inode, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(*key, *file_stat, digest) for key, (file_stat, digest) in updates.items()],
+            )
+
+        logger.debug(f"Wrote {len(updates)} file hashes to '{self.database_path}'")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """ Open a connection to the database within a transaction, creating the table if required. """
+        connection = sqlite3.connect(self.database_path)
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS file_hashes ("
+                    "path TEXT NOT NULL, algorithm TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, digest TEXT NOT NULL, "
+                    "PRIMARY KEY (path, algorithm))",
+                )
+                yield connection
+        finally:
+            connection.close()
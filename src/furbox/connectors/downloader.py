@@ -1,19 +1,41 @@
 """ Module to download files and helper functions related to download operations. """
 import logging
-import shutil
+import statistics
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
 from pathlib import Path
 from typing import NamedTuple, Self
 
 import backoff
 import requests
+from requests.structures import CaseInsensitiveDict
 
-from furbox.helpers.utils import clean_url, execute_futures
+from furbox.connectors.bandwidth import scheduler
+from furbox.helpers.utils import clean_url, CompletionExecutor, ExecutionReport
+from furbox.utils.events import events
+from furbox.utils.metrics import metrics
+from furbox.utils.profiling import profiler
 from furbox.utils.progress_bar import ProgressBar, ProgressBarStyle
 
 logger = logging.getLogger(__name__)
 
+download_bytes = metrics.counter("furbox_download_bytes_total", "Bytes downloaded")
+download_count = metrics.counter("furbox_downloads_total", "Files downloaded, by outcome")
+download_retries = metrics.counter("furbox_download_retries_total", "Downloads retried after an HTTP error")
+download_seconds = metrics.histogram("furbox_download_seconds", "Time taken to download each file")
+
+# Files larger than this multiple of the median file size are scheduled as large files.
+LARGE_FILE_FACTOR = 4
+
+
+class DownloadResult(NamedTuple):
+    """ Named tuple of the response headers of a finished download, and the number of bytes written to disk. """
+
+    headers: CaseInsensitiveDict[str]
+    size:    int
+
 
 class UrlFileTarget(NamedTuple):
     """ Named tuple pair of a target download URL and the associated destination file name. """
@@ -22,6 +44,7 @@ class UrlFileTarget(NamedTuple):
     file_name:          str
     download_directory: Path
     extension:          str | None
+    size:               int | None = None
 
     @property
     def output_path(self) -> Path:
@@ -30,7 +53,9 @@ class UrlFileTarget(NamedTuple):
         return self.download_directory / file_name_with_extension
 
     @classmethod
-    def create(cls, url: str, file_name: str, download_directory: Path, extension: str | None = None) -> Self:
+    def create(
+        cls, url: str, file_name: str, download_directory: Path, extension: str | None = None, size: int | None = None,
+    ) -> Self:
         """ Parse a URL and file name into a clean URL and file path named tuple.
 
         Args:
@@ -40,6 +65,8 @@ class UrlFileTarget(NamedTuple):
             extension (str | None, optional): \
                 Specify the extension to download the file as. Defaults to None, \
                 where extension is inferred by file preferentially, then URL.
+            size (int | None, optional): Expected size of the file in bytes, used when scheduling downloads. \
+                                         Defaults to None, where the size is unknown.
 
         Returns:
             Self: Created UrlFileTarget instance.
@@ -63,11 +90,13 @@ class UrlFileTarget(NamedTuple):
             file_name=file_name,
             download_directory=Path(download_directory),
             extension=next((ext for ext in extensions if ext), None),
+            size=size,
         )
 
 
 def get_numbered_file_names(
     download_urls: list[str], download_directory: Path, name: str, offset: int = 0, zero_pad: int | None = None,
+    *, sizes: list[int | None] | None = None,
 ) -> list[UrlFileTarget]:
     """ Generate download file targets names numbered incrementally.
 
@@ -78,6 +107,8 @@ def get_numbered_file_names(
         offset (int, optional): Offset to all file numbers. Defaults to 0.
         zero_pad (int | None, optional): Use a fixed length zero padding for file names if provided. \
                                          Defaults to None.
+        sizes (list[int | None] | None, optional): Expected file size in bytes for each URL, or None where \
+                                                   unknown. Defaults to None, where all file sizes are unknown.
 
     Returns:
         list[UrlFileTarget]: List of generated download targets.
@@ -89,11 +120,57 @@ def get_numbered_file_names(
     file_names = [f"{name} {str(num).zfill(zero_len)}" for num in range(offset + 1, offset + num_urls + 1)]
 
     return [
-        UrlFileTarget.create(url=url, file_name=file_name, download_directory=download_directory)
-        for url, file_name in zip(download_urls, file_names, strict=True)
+        UrlFileTarget.create(url=url, file_name=file_name, download_directory=download_directory, size=size)
+        for url, file_name, size in zip(download_urls, file_names, sizes or [None] * num_urls, strict=True)
     ]
 
 
+def schedule_file_targets(file_targets: list[UrlFileTarget], threads: int) -> list[UrlFileTarget]:
+    """ Order file targets such that large files are spread out amongst smaller files.
+
+    Targets keep their original order within each size class, such that the earliest targets (Ex. the first
+    pages of a comic) are preferred. Files much larger than the median are then interleaved at most once per
+    round of worker threads, so they cannot occupy every worker at once and starve the smaller files queued
+    behind them. Targets without a known size are treated as small files.
+
+    Args:
+        file_targets (list[UrlFileTarget]): List of download targets to schedule.
+        threads (int): Number of threads which will be used when downloading.
+
+    Returns:
+        list[UrlFileTarget]: Download targets in the order they should be submitted.
+    """
+    if not (sizes := [target.size for target in file_targets if target.size]):
+        return list(file_targets)
+
+    large_size = statistics.median(sizes) * LARGE_FILE_FACTOR
+    large = deque(target for target in file_targets if target.size and target.size > large_size)
+    small = deque(target for target in file_targets if not (target.size and target.size > large_size))
+
+    # Only allow a large file in the first slot if it was originally first, otherwise start with small files.
+    scheduled: list[UrlFileTarget] = []
+    slots_since_large = threads if large and large[0] is file_targets[0] else 0
+    while small or large:
+        if large and (not small or slots_since_large >= threads):
+            scheduled.append(large.popleft())
+            slots_since_large = 0
+        else:
+            scheduled.append(small.popleft())
+            slots_since_large += 1
+
+    return scheduled
+
+
+@contextmanager
+def _cleanup_on_error(tmp_file_path: Path) -> Iterator[None]:
+    """ Remove a partially downloaded temporary file if an error occurs before it is moved into place. """
+    try:
+        yield
+    except BaseException:
+        tmp_file_path.unlink(missing_ok=True)
+        raise
+
+
 def download_file_progress(url: str, file_path: Path, description: str, leave_progress_bar: bool) -> None:
     """ Download a file from a URL with a progress bar.
 
@@ -103,43 +180,49 @@ def download_file_progress(url: str, file_path: Path, description: str, leave_pr
         description (str): Description to use in progress bar.
         leave_progress_bar (bool): Leave the progress bar display after the download has finished.
     """
-    # Download the file as a stream, such that progress can be accurately displayed.
-    response = requests.get(url, stream=True, timeout=5)
-    response.raise_for_status()
-
     # Create the parent directory if required.
     parent_path = file_path.resolve().parent
     parent_path.mkdir(parents=True, exist_ok=True)
 
-    # Download the file to a temporary file path.
+    # Download the file as a stream to a temporary file path, such that progress can be accurately displayed.
     tmp_file_path = parent_path / f"_{file_path.name}"
-    with (
-        Path(tmp_file_path).open("wb") as f,
-        ProgressBar(
-            description=description,
-            length=int(response.headers.get("content-length", 0)),
-            style=ProgressBarStyle.FILE,
-            persist=leave_progress_bar,
-        ) as progress,
-    ):
-        for chunk in response.iter_content(chunk_size=(1024 * 128)):
-            progress.advance(len(chunk))
-            f.write(chunk)
-
-    # Once downloaded, move the temporarily file to the desired file path.
-    shutil.move(
-        src=tmp_file_path,
-        dst=file_path,
-    )
-
+    with scheduler.connection(url), _cleanup_on_error(tmp_file_path):
+        response = requests.get(url, stream=True, timeout=5)
+        response.raise_for_status()
 
-@backoff.on_exception(backoff.expo, exception=requests.HTTPError, max_tries=3)
-def download_file(url: str, file_path: Path) -> None:
+        with (
+            Path(tmp_file_path).open("wb") as f,
+            ProgressBar(
+                description=description,
+                length=int(response.headers.get("content-length", 0)),
+                style=ProgressBarStyle.FILE,
+                persist=leave_progress_bar,
+            ) as progress,
+        ):
+            size = 0
+            for chunk in scheduler.throttle(response.iter_content(chunk_size=scheduler.CHUNK_SIZE)):
+                size += len(chunk)
+                progress.advance(len(chunk))
+                f.write(chunk)
+
+        download_bytes.inc(size)
+
+    # Once downloaded, atomically move the temporary file to the desired file path.
+    tmp_file_path.replace(file_path)
+
+
+@backoff.on_exception(backoff.expo, exception=requests.HTTPError, max_tries=3,
+                      on_backoff=lambda _: download_retries.inc())
+def download_file(url: str, file_path: Path) -> DownloadResult:
     """ Download a single file to disk.
 
     Args:
         url (str): URL to download the file from.
         file_path (Path): File path to save the downloaded file to.
+
+    Returns:
+        DownloadResult: Response headers of the download, such as the ETag and Content-Length, and the number \
+                        of bytes downloaded, which is known even if the response had no Content-Length.
     """
     # Create the parent directory if required.
     parent_path = file_path.resolve().parent
@@ -151,34 +234,107 @@ def download_file(url: str, file_path: Path) -> None:
             if not backup_path.exists():
                 logger.warning(f"File '{file_path}' already exists, moving it to '{backup_path}'")
                 file_path.rename(backup_path)
+                break
 
-    # Download the file to a temporary file path.
+    # Download the file as a stream to a temporary file path, subject to the shared bandwidth limits.
     tmp_file_path = file_path.resolve().parent / f"_{file_path.name}"
-    with Path(tmp_file_path).open("wb") as f:
-        response = requests.get(url, timeout=10)
+    with scheduler.connection(url), _cleanup_on_error(tmp_file_path), download_seconds.time():
+        response = requests.get(url, stream=True, timeout=10)
         response.raise_for_status()
-        f.write(response.content)
 
-    # Once downloaded, move the temporarily file to the desired file path.
-    tmp_file_path.rename(file_path)
+        size = 0
+        with Path(tmp_file_path).open("wb") as f:
+            for chunk in scheduler.throttle(response.iter_content(chunk_size=scheduler.CHUNK_SIZE)):
+                size += len(chunk)
+                f.write(chunk)
+
+        download_bytes.inc(size)
+
+    # Once downloaded, atomically move the temporary file to the desired file path.
+    tmp_file_path.replace(file_path)
 
+    return DownloadResult(headers=response.headers, size=size)
 
-def download_files(file_targets: list[UrlFileTarget], description: str, threads: int = 8) -> None:
-    """ Download a list of file targets.
+
+def download_target(target: UrlFileTarget) -> DownloadResult:
+    """ Download a single file target to its output path, returning the response headers and bytes downloaded. """
+    return download_file(url=target.url, file_path=target.output_path)
+
+
+def download_files(
+    file_targets: list[UrlFileTarget], description: str, threads: int = 8,
+) -> ExecutionReport[UrlFileTarget, DownloadResult]:
+    """ Download a list of file targets, scheduled such that large files are spread out amongst smaller files.
+
+    Each file is atomically moved into place as soon as its own download finishes. A failed download is
+    logged and reported, without interrupting the remaining downloads.
 
     Args:
         file_targets (list[UrlFileTarget]): List of download targets, pairing download URLs with file names.
         description (str): Description to use in progress bar.
         threads (int): Number of threads to use when downloading. Defaults to 8.
+
+    Returns:
+        ExecutionReport[UrlFileTarget, DownloadResult]: \
+            Report of completed, failed and cancelled downloads, with the response headers and size of each download.
     """
-    with (
-        ProgressBar(description, length=len(file_targets)) as progress,
-        ThreadPoolExecutor(max_workers=threads) as executor,
-    ):
-        execute_futures(
-            futures=[
-                executor.submit(download_file, url=target.url, file_path=target.output_path)
-                for target in file_targets
-            ],
-            progress_bar=progress,
-        )
+    return download_file_batches([file_targets], description=description, threads=threads)
+
+
+def download_file_batches(
+    target_batches: Iterable[list[UrlFileTarget]], description: str, threads: int = 8,
+) -> ExecutionReport[UrlFileTarget, DownloadResult]:
+    """ Download batches of file targets, starting on each batch as soon as it is produced.
+
+    Batches are consumed lazily, such that downloads can start while later batches are still being produced,
+    for example from each page of a search. Each batch is scheduled as in `download_files`, and the progress
+    bar grows as batches arrive.
+
+    Args:
+        target_batches (Iterable[list[UrlFileTarget]]): Batches of download targets, which may be produced lazily.
+        description (str): Description to use in progress bar.
+        threads (int): Number of threads to use when downloading. Defaults to 8.
+
+    Returns:
+        ExecutionReport[UrlFileTarget, DownloadResult]: \
+            Report of completed, failed and cancelled downloads, with the response headers and size of each download.
+    """
+    with profiler.span("download files"), ProgressBar(description, length=0) as progress:
+        def iter_file_targets() -> Iterator[UrlFileTarget]:
+            """ Yield the file targets of each batch as soon as it is produced. """
+            total_targets = 0
+            for batch in target_batches:
+                total_targets += len(batch)
+                progress.set_length(total_targets)
+                yield from schedule_file_targets(batch, threads)
+
+        executor = CompletionExecutor(download_target, threads=threads, max_outstanding=threads * 2,
+                                      progress_bar=progress)
+        report = executor.run(iter_file_targets())
+
+    for failure in report.failures:
+        logger.error(f"Failed to download '{failure.item.url}' to '{failure.item.output_path}': {failure.exception}")
+
+    record_downloads(report, description)
+    return report
+
+
+def record_downloads(report: ExecutionReport[UrlFileTarget, DownloadResult], description: str) -> None:
+    """ Count the outcomes of a finished set of downloads, and emit them as a `downloads` event.
+
+    Args:
+        report (ExecutionReport[UrlFileTarget, DownloadResult]): Report of the finished downloads.
+        description (str): Description of the downloads, as used in their progress bar.
+    """
+    download_count.inc(len(report.results), outcome="succeeded")
+    download_count.inc(len(report.failures), outcome="failed")
+    download_count.inc(len(report.cancelled), outcome="cancelled")
+
+    events.emit(
+        "downloads",
+        description=description,
+        succeeded=len(report.results),
+        failed=len(report.failures),
+        cancelled=len(report.cancelled),
+        bytes=sum(result.size for _, result in report.results),
+    )
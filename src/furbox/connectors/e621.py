@@ -1,8 +1,10 @@
 """ Module to interact with the e621 API and download from database dumps. """
 import csv
 import gzip
+import itertools
 import logging
 from base64 import b64encode
+from collections.abc import Iterator
 from enum import Enum
 from pathlib import Path
 from time import sleep
@@ -14,10 +16,23 @@ from furbox.connectors.cache import Cache
 from furbox.connectors.downloader import download_file_progress
 from furbox.helpers.utils import Constants
 from furbox.models.e621 import Pool, Tag
+from furbox.utils.metrics import metrics
 from furbox.utils.progress_bar import ProgressBar
 
 logger = logging.getLogger(__name__)
 
+api_request_count = metrics.counter("furbox_e621_requests_total", "Requests made to the e621 API")
+api_request_seconds = metrics.histogram("furbox_e621_request_seconds", "Latency of requests to the e621 API")
+api_delay_seconds = metrics.counter(
+    "furbox_e621_delay_seconds_total", "Time spent waiting between requests to the e621 API",
+)
+database_bytes = metrics.counter("furbox_e621_database_bytes_total", "Size of e621 database dumps downloaded")
+database_rows = metrics.counter("furbox_e621_database_rows_total", "Rows parsed from e621 database dumps")
+database_parse_seconds = metrics.histogram(
+    "furbox_e621_database_parse_seconds", "Time taken to parse e621 database dumps",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600),
+)
+
 
 class E621Connector:
     """ Connector class to interact with the e621 API.
@@ -33,14 +48,18 @@ class E621Connector:
     Args:
         username (str): e621 username.
         api_key (str): e621 API key generated for the given value of `username`.
-        backend_url (BackendUrl, optional): Base URL to use for all requests. \
-                                            Valid options defined in `E621Connector.BackendUrl`. \
-                                            Defaults to `E621Connector.BackendUrl.E621`.
+        backend_url (BackendUrl | str, optional): Base URL to use for all requests. Standard options defined \
+                                                  in `E621Connector.BackendUrl`, or any other URL serving \
+                                                  the same API, such as a local mirror or test server. \
+                                                  Defaults to `E621Connector.BackendUrl.E621`.
     """
 
     API_DELAY:           float = 1
     PAGE_LIMIT:          int = 320
     MAX_PAGE:            int = 750
+    # Requests answered with these statuses are retried, as e621 uses them when rate limiting or under load.
+    RETRY_STATUSES:      tuple[int, ...] = (429, 502, 503)
+    MAX_RETRIES:         int = 3
 
     leave_progress_bars: bool = True
 
@@ -50,7 +69,7 @@ class E621Connector:
         E621 = "https://e621.net"
         E926 = "https://e926.net"
 
-    def __init__(self, username: str, api_key: str, backend_url: BackendUrl = BackendUrl.E621) -> None:
+    def __init__(self, username: str, api_key: str, backend_url: BackendUrl | str = BackendUrl.E621) -> None:
         self.session = requests.session()
         b64_basic_auth = b64encode(f"{username}:{api_key}".encode("ascii")).decode("ascii")
         self.session.headers.update({
@@ -58,7 +77,43 @@ class E621Connector:
             "Authorization": f"Basic {b64_basic_auth}",
         })
 
-        self.base_url = backend_url.value
+        base_url = backend_url.value if isinstance(backend_url, E621Connector.BackendUrl) else backend_url
+        self.base_url = base_url.rstrip("/")
+
+    def _get(self, endpoint: str, url: str, **kwargs: Any) -> requests.Response:
+        """ Make a GET request to the API, recording its latency and status code.
+
+        Requests which are rate limited or hit an unavailable server are retried after the delay requested by
+        the server, or otherwise after an exponentially increasing delay. The final response is returned as is.
+
+        Args:
+            endpoint (str): Name of the endpoint requested, used to label metrics.
+            url (str): URL to request.
+            **kwargs (Any): Additional arguments for the request, such as query parameters.
+
+        Returns:
+            requests.Response: Response of the request.
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            with api_request_seconds.time(endpoint=endpoint):
+                response = self.session.get(url, **kwargs)
+
+            api_request_count.inc(endpoint=endpoint, status=response.status_code)
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.MAX_RETRIES:
+                break
+
+            retry_after = response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else self.API_DELAY * 2 ** attempt
+            logger.warning(f"Request to '{url}' returned {response.status_code}, retrying in {delay:g} seconds")
+            sleep(delay)
+            api_delay_seconds.inc(delay)
+
+        return response
+
+    def _delay(self) -> None:
+        """ Wait between requests, to respect the API rate limit. """
+        sleep(self.API_DELAY)
+        api_delay_seconds.inc(self.API_DELAY)
 
     def get_posts(self, search: str, offset: int | None = None,
                   limit: int | None = None, desc: str | None = None) -> list[dict[str, Any]]:
@@ -76,8 +131,21 @@ class E621Connector:
         Returns:
             list[dict[str, Any]]: Post JSON data matching the search query.
         """
+        return list(itertools.chain.from_iterable(self.iter_posts(search, offset, limit, desc)))
+
+    def iter_posts(self, search: str, offset: int | None = None,
+                   limit: int | None = None, desc: str | None = None) -> Iterator[list[dict[str, Any]]]:
+        """ Get e621 posts matching a search query, yielding each page of posts as soon as it is received.
+
+        Pages are requested lazily, subject to the API rate limit, such that posts can be processed while
+        later pages are still being fetched. Arguments are as for `get_posts`.
+
+        Yields:
+            list[dict[str, Any]]: Post JSON data of each page, excluding posts outside the offset and limit.
+        """
         # For substantial offsets, skip straight to the page where results start
-        page = 1
+        page: int | str = 1
+        offset = offset or 0
         if offset:
             page += offset // self.PAGE_LIMIT
             offset = offset % self.PAGE_LIMIT
@@ -93,40 +161,48 @@ class E621Connector:
                 limit += offset
 
         progress = ProgressBar(f"Fetching posts - {desc or search}", persist=self.leave_progress_bars)
-        posts = []
-        while True:
-            # Setting page to "b{post_id}" will show posts before the given ID. This is done for accurate
-            # pagination, as posts will move between pages if any are created or deleted between requests
-            page = f"b{posts[-1]['id']}" if posts else page
-
-            # Request each page of posts through the API.
-            response = self.session.get(
-                url=f"{self.base_url}/posts.json",
-                params={
-                    "v2": "true",  # NOTE: May be removed beyond Dec 2026 as this becomes default behaviour.
-                    "mode": "extended",
-                    "limit": self.PAGE_LIMIT,
-                    "tags": search,
-                    "page": page,
-                },
-            )
-
-            response_posts = response.json()
-            posts.extend(response_posts)
-            progress.advance(len(response_posts))
-
-            # Break if a partial response is received, as it must be the final page
-            if len(response_posts) < self.PAGE_LIMIT:
-                break
-
-            # Break if a limit was provided and the number of posts exceeds it
-            if limit and len(posts) >= limit:
-                break
-
-            sleep(self.API_DELAY)
-
-        progress.close()
-        return posts[offset:limit]
+        fetched = 0
+        try:
+            while True:
+                # Request each page of posts through the API.
+                response = self._get(
+                    "posts",
+                    url=f"{self.base_url}/posts.json",
+                    params={
+                        "v2": "true",  # NOTE: May be removed beyond Dec 2026 as this becomes default behaviour.
+                        "mode": "extended",
+                        "limit": self.PAGE_LIMIT,
+                        "tags": search,
+                        "page": page,
+                    },
+                )
+
+                response.raise_for_status()
+                response_posts = response.json()
+                progress.advance(len(response_posts))
+
+                # Yield only the posts of the page which fall within the offset and limit.
+                page_start = fetched
+                fetched += len(response_posts)
+                if page_posts := response_posts[max(offset - page_start, 0):limit - page_start if limit else None]:
+                    yield page_posts
+
+                # Break if a partial response is received, as it must be the final page
+                if len(response_posts) < self.PAGE_LIMIT:
+                    break
+
+                # Break if a limit was provided and the number of posts exceeds it
+                if limit and fetched >= limit:
+                    break
+
+                # Setting page to "b{post_id}" will show posts before the given ID. This is done for accurate
+                # pagination, as posts will move between pages if any are created or deleted between requests
+                page = f"b{response_posts[-1]['id']}"
+
+                self._delay()
+
+        finally:
+            progress.close()
 
     def get_pool(self, pool_id: int | str) -> dict[str, Any]:
         """ Get an e621 pool by ID.
@@ -138,13 +214,41 @@ class E621Connector:
             dict[str, Any]: Pool JSON data.
         """
         search_url = f"{self.base_url}/pools/{pool_id!s}.json"
-        response = self.session.get(search_url)
+        response = self._get("pool", search_url)
         response.raise_for_status()
 
-        sleep(self.API_DELAY)
+        self._delay()
 
         return response.json()
 
+    def get_pools(self, pool_ids: list[int]) -> list[dict[str, Any]]:
+        """ Get multiple e621 pools by ID, fetching up to a full page of pools per request.
+
+        Args:
+            pool_ids (list[int]): Pool ID numbers.
+
+        Returns:
+            list[dict[str, Any]]: Pool JSON data for each pool found. Pools which do not exist are omitted.
+        """
+        pools = []
+        for start in range(0, len(pool_ids), self.PAGE_LIMIT):
+            response = self._get(
+                "pools",
+                url=f"{self.base_url}/pools.json",
+                params={
+                    "search[id]": ",".join(str(pool_id) for pool_id in pool_ids[start:start + self.PAGE_LIMIT]),
+                    "limit": self.PAGE_LIMIT,
+                },
+            )
+            response.raise_for_status()
+            pools.extend(response.json())
+
+            # Wait before requesting the next chunk of pools, if any remain
+            if start + self.PAGE_LIMIT < len(pool_ids):
+                self._delay()
+
+        return pools
+
     def get_tag(self, tag_name: str, tag_category: Tag.Category | None) -> dict[str, Any] | None:
         """ Get information on a given tag. Does not perform partial searching, fully matches a tag or returns nothing.
 
@@ -156,7 +260,8 @@ class E621Connector:
         Returns:
             dict[str, Any] | None: Tag JSON data, or None if no tag was found.
         """
-        response = self.session.get(
+        response = self._get(
+            "tags",
             f"{self.base_url}/tags.json",
             params={
                 "search[name_matches]": tag_name,
@@ -166,7 +271,7 @@ class E621Connector:
         )
         response.raise_for_status()
 
-        sleep(self.API_DELAY)
+        self._delay()
 
         return next(iter(response.json()), None)
 
@@ -181,6 +286,10 @@ class E621DbConnector:
         cache_dir (str | Path | None, optional): \
             Cache directory to use when reading and writing database dumps. \
             Defaults to None, where a default cache location will be used.
+        base_url (str, optional): Base URL to fetch database dumps from. Defaults to `E621DbConnector.BASE_URL`.
+        keep_parsed (bool, optional): Keep every parsed database dump in memory, such that later calls only \
+                                      parse a dump again once it has been replaced. Intended for long running \
+                                      processes. Defaults to False, where dumps are parsed on every call.
     """
 
     BASE_URL: str = "https://e621.net"
@@ -194,9 +303,16 @@ class E621DbConnector:
         post = "posts"
         pool = "pools"
 
-    def __init__(self, cache_dir: str | Path | None = None) -> None:
+    def __init__(
+        self, cache_dir: str | Path | None = None, keep_parsed: bool = False, *, base_url: str = BASE_URL,
+    ) -> None:
         self.session = requests.session()
+        self.base_url = base_url.rstrip("/")
         self.cache = Cache(cache_dir)
+        self.keep_parsed = keep_parsed
+
+        # Parsed database dumps keyed on file path, paired with the modification time of the parsed file.
+        self._parsed: dict[Path, tuple[float, list[Pool]]] = {}
 
     def _get_database(self, database_name: str) -> Path:
         """ Download a database dump if no valid cached file exists.
@@ -210,7 +326,7 @@ class E621DbConnector:
         """
         file_path = self.cache.resolve_path(f"{database_name}.gz")
         if not self.cache.check(file_path):
-            response = self.session.get(f"{self.BASE_URL}/db_export/")
+            response = self.session.get(f"{self.base_url}/db_export/")
             response.raise_for_status()
 
             all_database_indexes = response.text.splitlines()
@@ -218,11 +334,12 @@ class E621DbConnector:
             latest_database_name = latest_database.split('"')[1]
 
             download_file_progress(
-                url=f"{self.BASE_URL}/db_export/{latest_database_name}",
+                url=f"{self.base_url}/db_export/{latest_database_name}",
                 file_path=file_path,
                 description=f"Fetching database {latest_database_name}",
                 leave_progress_bar=True,
             )
+            database_bytes.inc(file_path.stat().st_size, database=database_name)
 
         return file_path
 
@@ -240,19 +357,39 @@ class E621DbConnector:
         Returns:
             list[Pool]: List of dataclass objects parsed from the database.
         """
+        if self.keep_parsed:
+            modified_time = file_path.stat().st_mtime
+            parsed = self._parsed.get(file_path)
+            if parsed is None or parsed[0] != modified_time:
+                parsed = self._parsed[file_path] = (modified_time, self._read_database(file_path, data_model))
+
+            return [entry for entry in parsed[1] if not filter_condition or filter_condition(entry)]
+
+        return self._read_database(file_path, data_model, filter_condition)
+
+    def _read_database(self, file_path: Path, data_model: type[Pool],
+                       filter_condition: Callable[[Pool], bool] | None = None) -> list[Pool]:
+        """ Read every row of a database file, keeping the dataclass objects which match a filter condition. """
         database_entries = []
-        with gzip.open(file_path, "rt") as f:
+        rows = 0
+        with database_parse_seconds.time(model=data_model.__name__), gzip.open(file_path, "rt") as f:
             # Specifically when parsing the "posts" database, using the default CSV field size will throw
             # an error. The default size is 2^17, and increasing this to 2^20 allows the CSV to be parsed
             csv.field_size_limit(int(pow(2, 20)))
 
             for row in csv.DictReader(f):
+                rows += 1
                 entry = data_model.from_database(row)
                 if not filter_condition or filter_condition(entry):
                     database_entries.append(entry)
 
+        database_rows.inc(rows, model=data_model.__name__)
         return database_entries
 
+    def get_posts_file(self) -> Path:
+        """ Get the path of the latest posts database dump, downloading it if no valid cached file exists. """
+        return self._get_database(self.DatabaseType.post.value)
+
     def get_pools(self, filter_condition: Callable[[Pool], bool] | None = None) -> list[Pool]:
         """ Get pool dataclass objects from a database dump.
 
@@ -0,0 +1,249 @@
+""" Module to track changes to library directories, allowing scans to only revisit changed paths.
+
+A long running watcher (see the `watch` runner) appends the path of every changed entry within the library
+directories to a change journal in the cache directory. Scans record the journal position they were taken at
+alongside a snapshot of each directory, such that later scans only need to re-read the entries which changed
+since. If the journal is missing, or the watcher which wrote it is no longer running, a full scan is made.
+
+Example usage of LibraryScanner: ::
+
+    scanner = LibraryScanner()
+    for file_path, file_stat in scanner.scan(Path("path/to/directory")).items():
+        print(file_path, file_stat.size)
+"""
+import hashlib
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import NamedTuple
+
+from furbox.connectors.cache import Cache, FileStat
+
+logger = logging.getLogger(__name__)
+
+
+class JournalCursor(NamedTuple):
+    """ Named tuple of a position within a change journal, valid only for the same journal epoch. """
+
+    epoch:  str
+    offset: int
+
+
+class ChangeJournal:
+    """ Append-only journal of changed paths, written by a single watcher process.
+
+    The first line of the journal is a header identifying the epoch and process ID of the watcher which
+    owns it. Every following line is the absolute path of a changed entry. Starting a new epoch invalidates
+    all cursors from previous epochs, which forces a full scan the next time each directory is scanned.
+
+    Args:
+        cache_dir (str | Path | None, optional): Custom directory to use as the base cache location. \
+                                                 Defaults to None, where a default cache location will be used.
+    """
+
+    FILE_NAME: str = "change_journal.log"
+    TAIL_SIZE: int = 1024 * 64
+
+    def __init__(self, cache_dir: str | Path | None = None) -> None:
+        self.file_path = Cache(cache_dir).resolve_path(self.FILE_NAME)
+        self.epoch: str | None = None
+
+        # Changes read from the journal so far, paired with the byte offset each entry starts at.
+        self._read_epoch: str | None = None
+        self._read_offset = 0
+        self._changes: list[tuple[int, Path]] = []
+
+    def start(self) -> None:
+        """ Start a new journal epoch owned by the current process, discarding any previous journal. """
+        self.epoch = str(uuid.uuid4())
+        with self.file_path.open("w", encoding="utf-8") as f:
+            f.write(json.dumps({"epoch": self.epoch, "pid": os.getpid()}) + "\n")
+
+        logger.info(f"Started change journal epoch '{self.epoch}' at '{self.file_path}'")
+
+    def record(self, paths: list[Path]) -> None:
+        """ Append changed paths to the journal. """
+        with self.file_path.open("a", encoding="utf-8") as f:
+            f.writelines(f"{path}\n" for path in paths)
+
+    def stop(self) -> None:
+        """ Remove the journal, such that no scan can rely on it once the watcher is no longer running. """
+        self.file_path.unlink(missing_ok=True)
+        self.epoch = None
+
+    def cursor(self) -> JournalCursor | None:
+        """ Get the current end of the journal, or None if there is no journal owned by a running watcher. """
+        try:
+            with self.file_path.open("rb") as f:
+                header = json.loads(f.readline())
+
+                # Only consider complete entries, as the watcher may be part way through writing the last one.
+                size = f.seek(0, os.SEEK_END)
+                f.seek(max(0, size - self.TAIL_SIZE))
+                tail = f.read()
+                offset = size - len(tail) + tail.rfind(b"\n") + 1
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if not _process_running(header["pid"]):
+            logger.info(f"Ignoring change journal from watcher process {header['pid']}, which is no longer running")
+            return None
+
+        return JournalCursor(epoch=header["epoch"], offset=offset)
+
+    def changes(self, directory: Path, start: JournalCursor, end: JournalCursor) -> set[str] | None:
+        """ Get the names of entries within a directory which changed between two journal cursors.
+
+        Args:
+            directory (Path): Resolved directory path to get the changed entries of.
+            start (JournalCursor): Cursor of the previous scan of the directory.
+            end (JournalCursor): Cursor of the current scan of the directory.
+
+        Returns:
+            set[str] | None: Names of changed entries in the directory, or None if the directory must be \
+                             fully scanned, such as when the cursors are from different epochs.
+        """
+        if start.epoch != end.epoch or start.offset > end.offset or not self._read_changes(end):
+            return None
+
+        changed_names = set()
+        for offset, path in self._changes:
+            if not start.offset <= offset < end.offset:
+                continue
+
+            # If the directory itself was changed, such as being moved or deleted, it must be fully scanned.
+            if path == directory:
+                return None
+
+            if path.parent == directory:
+                changed_names.add(path.name)
+
+        return changed_names
+
+    def _read_changes(self, end: JournalCursor) -> bool:
+        """ Read any journal entries not yet cached, up to a cursor. Returns False if the epoch has changed. """
+        if self._read_epoch != end.epoch:
+            self._read_epoch, self._read_offset, self._changes = end.epoch, 0, []
+
+        if self._read_offset >= end.offset:
+            return True
+
+        try:
+            with self.file_path.open("rb") as f:
+                header_line = f.readline()
+                if json.loads(header_line)["epoch"] != end.epoch:
+                    return False
+
+                offset = f.seek(max(self._read_offset, len(header_line)))
+                for line in f:
+                    if offset >= end.offset:
+                        break
+
+                    self._changes.append((offset, Path(os.fsdecode(line.rstrip(b"\n")))))
+                    offset += len(line)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        self._read_offset = offset
+        return True
+
+
+class LibraryScanner:
+    """ Scan library directories for files, using the change journal to avoid re-reading unchanged entries.
+
+    Snapshots of each scanned directory are stored in the cache directory. Only the top level files of a
+    directory are considered, matching how library directories are laid out.
+
+    Args:
+        cache_dir (str | Path | None, optional): Custom directory to use as the base cache location. \
+                                                 Defaults to None, where a default cache location will be used.
+    """
+
+    SNAPSHOT_DIR: str = "scans"
+
+    def __init__(self, cache_dir: str | Path | None = None) -> None:
+        self.cache = Cache(cache_dir)
+        self.journal = ChangeJournal(cache_dir)
+
+    def scan(self, directory: Path) -> dict[Path, FileStat]:
+        """ Get the status of every file within a directory.
+
+        Args:
+            directory (Path): Directory to scan. Treated as empty if it does not exist.
+
+        Returns:
+            dict[Path, FileStat]: Status of each file in the directory, keyed on file path.
+        """
+        directory = directory.resolve()
+        if not directory.is_dir():
+            return {}
+
+        # Read the journal position before scanning, such that changes made during the scan are never missed.
+        cursor = self.journal.cursor()
+        snapshot_path = self._snapshot_path(directory)
+        previous_cursor, files = self._load_snapshot(snapshot_path)
+
+        changed_names = None
+        if cursor and previous_cursor:
+            changed_names = self.journal.changes(directory, previous_cursor, cursor)
+
+        if changed_names is None:
+            logger.debug(f"Performing full scan of '{directory}'")
+            files = {f: FileStat.from_path(f) for f in directory.iterdir() if f.is_file()}
+        else:
+            logger.debug(f"Rescanning {len(changed_names)} changed entries in '{directory}'")
+            for name in changed_names:
+                file_path = directory / name
+                if file_path.is_file():
+                    files[file_path] = FileStat.from_path(file_path)
+                else:
+                    files.pop(file_path, None)
+
+        self._save_snapshot(snapshot_path, directory, cursor, files)
+        return files
+
+    def _snapshot_path(self, directory: Path) -> Path:
+        """ Resolve the snapshot path in the cache directory for a library directory. """
+        directory_hash = hashlib.sha1(os.fsencode(directory)).hexdigest()  # noqa: S324
+        return self.cache.resolve_path(Path(self.SNAPSHOT_DIR) / f"{directory_hash}.json")
+
+    @staticmethod
+    def _load_snapshot(snapshot_path: Path) -> tuple[JournalCursor | None, dict[Path, FileStat]]:
+        """ Load a directory snapshot, returning no cursor and no files if it does not exist or is invalid. """
+        try:
+            data = json.loads(snapshot_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, {}
+
+        cursor = JournalCursor(*data["cursor"]) if data["cursor"] else None
+        directory = Path(data["directory"])
+        return cursor, {directory / name: FileStat(*stat) for name, stat in data["files"].items()}
+
+    @staticmethod
+    def _save_snapshot(
+        snapshot_path: Path, directory: Path, cursor: JournalCursor | None, files: dict[Path, FileStat],
+    ) -> None:
+        """ Save a directory snapshot, along with the journal cursor it is valid from. """
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_snapshot_path = snapshot_path.with_name(f"_{snapshot_path.name}")
+        tmp_snapshot_path.write_text(json.dumps({
+            "cursor": cursor,
+            "directory": str(directory),
+            "files": {file_path.name: file_stat for file_path, file_stat in files.items()},
+        }), encoding="utf-8")
+        tmp_snapshot_path.replace(snapshot_path)
+
+
+def _process_running(pid: int) -> bool:
+    """ Return True if a process with the given ID is running. """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
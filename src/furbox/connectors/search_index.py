@@ -0,0 +1,508 @@
+""" Offline search over the e621 posts database dump, resolving search queries without the e621 API.
+
+An index is built once from each posts dump, and kept in the cache directory alongside the dump. Posts are stored
+as rows in ascending post ID order, with each numeric field held in its own column. Each tag maps to a posting
+list of the rows tagged with it, delta encoded as varints, such that tags on millions of posts stay compact.
+
+Queries are resolved by intersecting the posting lists of required tags from the shortest list up, before
+subtracting excluded tags and filtering the remaining rows on their columns. Queries on specific tags then only
+touch the rows which could match, while queries on metatags alone scan their columns.
+
+Supported search syntax, as a subset of the e621 search syntax: ::
+
+    tag             Posts with the tag.
+    -tag            Posts without the tag, or without a metatag match when applied to a metatag.
+    ~tag            Posts with any of the tags prefixed by `~`.
+    rating:s        Posts of a rating, either `s`, `q` or `e`, or the full rating name.
+    score:>100      Posts with a score compared by `>`, `>=`, `<` or `<=`, exactly equal, or in a range `10..20`.
+    favcount:..50   Posts with a favourite count compared as for `score:`.
+    id:1000..2000   Posts with an ID compared as for `score:`, or in a comma separated list of IDs.
+    order:score     Order by `id`, `score` or `favcount`, suffixed by `_asc` or `_desc` to set the direction.
+
+Example usage of SearchIndex: ::
+
+    search_index = SearchIndex.load_or_build(E621DbConnector())
+    for post in search_index.search("canine -feline rating:s order:score", limit=10):
+        print(post.post_id, post.url)
+"""
+import bisect
+import csv
+import gzip
+import json
+import logging
+import re
+from array import array
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any, NamedTuple, Self
+
+from furbox.connectors.e621 import E621DbConnector
+from furbox.models.e621 import source_url_from_hash
+
+logger = logging.getLogger(__name__)
+
+RATINGS = {"s": "safe", "q": "questionable", "e": "explicit"}
+
+# Orders accepted by `order:`, as the column to sort on and whether to sort in descending order.
+ORDERS = {
+    "id": ("id", False), "id_asc": ("id", False), "id_desc": ("id", True),
+    "score": ("score", True), "score_asc": ("score", False), "score_desc": ("score", True),
+    "favcount": ("fav_count", True), "favcount_asc": ("fav_count", False), "favcount_desc": ("fav_count", True),
+}
+DEFAULT_ORDER = ("id", True)
+
+# Metatags accepted by e621 which cannot be resolved from the index, which are rejected rather than searched for as
+# tags that no post has.
+UNSUPPORTED_METATAGS = frozenset({
+    # Users, pools and sets, which are not part of the posts dump.
+    "user", "fav", "favoritedby", "voted", "votedup", "voteddown", "upvote", "downvote", "approver", "commenter",
+    "comm", "noter", "noteupdater", "deletedby", "flagger", "delreason", "pool", "inpool", "ordpool", "set", "ordset",
+    # Fields of the posts dump which are not indexed.
+    "md5", "type", "width", "height", "mpixels", "ratio", "filesize", "filetype", "duration", "status", "date", "age",
+    "source", "hassource", "description", "hasdescription", "note", "parent", "child", "ischild", "isparent",
+    "locked", "ratinglocked", "notelocked", "statuslocked", "pending_replacements", "artverified", "comment_count",
+    "tagcount", "gentags", "arttags", "chartags", "copytags", "spectags", "invtags", "lortags", "metatags",
+    "randseed", "limit",
+})
+
+_COMPARISON = re.compile(r"(?P<operator>[<>]=?)?(?P<number>-?\d+)")
+_RANGE = re.compile(r"(?P<low>-?\d+)?\.\.(?P<high>-?\d+)?")
+
+
+class ColumnFilter(NamedTuple):
+    """ Named tuple of a condition on a numeric column, as an inclusive range or a set of values. """
+
+    column:  str
+    low:     int | None = None
+    high:    int | None = None
+    values:  frozenset[int] | None = None
+    negated: bool = False
+
+    def matches(self, value: int) -> bool:
+        """ Check if a column value satisfies the condition. """
+        if self.values is not None:
+            return (value in self.values) != self.negated
+
+        return (
+            (self.low is None or value >= self.low) and (self.high is None or value <= self.high)
+        ) != self.negated
+
+
+class SearchQuery(NamedTuple):
+    """ Named tuple of the terms of a parsed search query. """
+
+    required: list[str]
+    excluded: list[str]
+    # Tags prefixed by `~`, of which posts must have at least one.
+    any_of:   list[str]
+    filters:  list[ColumnFilter]
+    order:    tuple[str, bool] = DEFAULT_ORDER
+
+
+def parse_range(column: str, value: str, *, negated: bool = False) -> ColumnFilter:
+    """ Parse the value of a numeric metatag into a column filter.
+
+    Args:
+        column (str): Column the metatag filters on.
+        value (str): Value of the metatag. Ex. `>10`, `<=5`, `10..20`, `..20` or `10`.
+        negated (bool, optional): Match posts which do not satisfy the comparison. Defaults to False.
+
+    Raises:
+        ValueError: Value is not a valid comparison.
+
+    Returns:
+        ColumnFilter: Filter matching the comparison.
+    """
+    if match := _RANGE.fullmatch(value):
+        low, high = (int(bound) if bound else None for bound in match.group("low", "high"))
+        return ColumnFilter(column, low=low, high=high, negated=negated)
+
+    if not (match := _COMPARISON.fullmatch(value)):
+        msg = f"Invalid comparison '{value}'"
+        raise ValueError(msg)
+
+    number = int(match["number"])
+    low, high = {
+        ">": (number + 1, None),
+        ">=": (number, None),
+        "<": (None, number - 1),
+        "<=": (None, number),
+        None: (number, number),
+    }[match["operator"]]
+    return ColumnFilter(column, low=low, high=high, negated=negated)
+
+
+def parse_query(query: str) -> SearchQuery:
+    """ Parse a search query into its tags, metatag filters and order.
+
+    Args:
+        query (str): Search query, in the e621 search syntax supported by the search index.
+
+    Raises:
+        ValueError: Query contains an invalid or unsupported metatag.
+
+    Returns:
+        SearchQuery: Parsed search query.
+    """
+    parsed = SearchQuery(required=[], excluded=[], any_of=[], filters=[])
+    order = DEFAULT_ORDER
+    for term in query.lower().split():
+        negated = term.startswith("-") and len(term) > 1
+        name, _, value = term.removeprefix("-").partition(":") if negated else term.partition(":")
+        if value and name.removeprefix("~") in UNSUPPORTED_METATAGS:
+            msg = f"Metatag '{name.removeprefix('~')}:' cannot be searched offline"
+            raise ValueError(msg)
+
+        match name:
+            case "rating" if value:
+                if (rating := value[:1]) not in RATINGS or value not in (rating, RATINGS[rating]):
+                    msg = f"Invalid rating '{value}', expected one of: {', '.join(RATINGS)}"
+                    raise ValueError(msg)
+                parsed.filters.append(ColumnFilter("rating", low=ord(rating), high=ord(rating), negated=negated))
+            case "score" | "favcount" if value:
+                parsed.filters.append(parse_range("score" if name == "score" else "fav_count", value, negated=negated))
+            case "id" if "," in value:
+                try:
+                    post_ids = frozenset(int(post_id) for post_id in value.split(","))
+                except ValueError:
+                    msg = f"Invalid list of post IDs '{value}'"
+                    raise ValueError(msg) from None
+                parsed.filters.append(ColumnFilter("id", values=post_ids, negated=negated))
+            case "id" if value:
+                parsed.filters.append(parse_range("id", value, negated=negated))
+            case "order" if value:
+                if value not in ORDERS:
+                    msg = f"Invalid order '{value}', expected one of: {', '.join(ORDERS)}"
+                    raise ValueError(msg)
+                order = ORDERS[value]
+            case _ if negated:
+                parsed.excluded.append(term[1:])
+            case _ if term.startswith("~") and len(term) > 1:
+                parsed.any_of.append(term[1:])
+            case _:
+                parsed.required.append(term)
+
+    return parsed._replace(order=order)
+
+
+def encode_postings(rows: Iterable[int]) -> bytes:
+    """ Encode ascending row numbers as the differences between each row, written as little endian varints. """
+    encoded = bytearray()
+    previous = 0
+    for row in rows:
+        delta = row - previous
+        previous = row
+        while delta >= 0x80:
+            encoded.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        encoded.append(delta)
+
+    return bytes(encoded)
+
+
+def decode_postings(encoded: bytes) -> list[int]:
+    """ Decode row numbers encoded by `encode_postings`. """
+    rows = []
+    row = delta = shift = 0
+    for byte in encoded:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+
+        row += delta
+        rows.append(row)
+        delta = shift = 0
+
+    return rows
+
+
+class IndexedPost(NamedTuple):
+    """ Named tuple of the fields of a post held by the search index. """
+
+    post_id:   int
+    md5:       str
+    ext:       str
+    size:      int
+    score:     int
+    fav_count: int
+    rating:    str
+
+    @property
+    def url(self) -> str:
+        """ Full quality source url of the post. """
+        return source_url_from_hash(self.md5, self.ext)
+
+
+class SearchIndex:
+    """ Inverted index of tags to posts, with the numeric fields of each post held in columns.
+
+    Args:
+        columns (dict[str, array]): Numeric columns, each with one value per row in ascending post ID order.
+        md5s (bytes): MD5 hash of each row, as 16 bytes per row.
+        extensions (list[str]): File extensions, indexed by the values of the `ext` column.
+        tags (list[str]): Names of every tag, indexed by tag ID.
+        offsets (array): Byte offset of the posting list of each tag ID within the postings, followed by the \
+                         total length of the postings.
+        postings (bytes): Posting lists of every tag, as encoded by `encode_postings`.
+    """
+
+    FILE_NAME: str = "posts_search_index.bin"
+    VERSION: int = 1
+
+    # Types of each numeric column, as array type codes.
+    COLUMNS: dict[str, str] = {"id": "I", "score": "i", "fav_count": "I", "size": "Q", "rating": "B", "ext": "B"}
+
+    def __init__(
+        self, columns: dict[str, array], md5s: bytes, *, extensions: list[str], tags: list[str], offsets: array,
+        postings: bytes,
+    ) -> None:
+        self.columns = columns
+        self.md5s = md5s
+        self.extensions = extensions
+        self.tags = tags
+        self.offsets = offsets
+        self.postings = postings
+        self.tag_ids = {tag: tag_id for tag_id, tag in enumerate(tags)}
+
+    def __len__(self) -> int:
+        """ Number of posts in the index. """
+        return len(self.columns["id"])
+
+    @classmethod
+    def build(cls, file_path: Path) -> Self:
+        """ Build an index from a posts database dump, excluding deleted posts as e621 searches do by default.
+
+        Args:
+            file_path (Path): Path to the gzipped posts database dump.
+
+        Returns:
+            Self: Index of every post in the dump.
+        """
+        columns = {name: array(type_code) for name, type_code in cls.COLUMNS.items()}
+        md5s = bytearray()
+        extensions: dict[str, int] = {}
+        # Rows of each tag, in the order posts appear within the dump.
+        tag_rows: defaultdict[str, array] = defaultdict(lambda: array("I"))
+
+        with gzip.open(file_path, "rt", encoding="utf-8", newline="") as f:
+            # As for `E621DbConnector`, the tag strings of some posts exceed the default CSV field size.
+            csv.field_size_limit(int(pow(2, 20)))
+            reader = csv.reader(f)
+            header = {name: index for index, name in enumerate(next(reader))}
+            (post_id, md5, rating, tag_string, locked_tags, fav_count, file_ext, file_size, score, is_deleted) = (
+                header[name] for name in (
+                    "id", "md5", "rating", "tag_string", "locked_tags", "fav_count", "file_ext", "file_size", "score",
+                    "is_deleted",
+                )
+            )
+
+            for row_number, row in enumerate(filter(lambda row: row[is_deleted] != "t", reader)):
+                columns["id"].append(int(row[post_id]))
+                columns["score"].append(int(row[score]))
+                columns["fav_count"].append(int(row[fav_count]))
+                columns["size"].append(int(row[file_size] or 0))
+                columns["rating"].append(ord(row[rating][:1] or "e"))
+                columns["ext"].append(extensions.setdefault(row[file_ext], len(extensions)))
+                md5s += bytes.fromhex(row[md5]) if row[md5] else bytes(16)
+
+                tags = row[tag_string].split()
+                for tag in {*tags, *row[locked_tags].split()} if row[locked_tags] else tags:
+                    tag_rows[tag].append(row_number)
+
+        # Dumps are ordered by post ID, however reorder rows if not such that row order always matches post IDs.
+        post_ids = columns["id"]
+        if any(post_ids[row] > post_ids[row + 1] for row in range(len(post_ids) - 1)):
+            logger.info("Posts dump is not ordered by post ID, reordering rows")
+            order = sorted(range(len(post_ids)), key=post_ids.__getitem__)
+            new_rows = array("I", bytes(4 * len(order)))
+            for new_row, row in enumerate(order):
+                new_rows[row] = new_row
+
+            columns = {name: array(column.typecode, map(column.__getitem__, order)) for name, column in columns.items()}
+            md5s = bytearray().join(md5s[row * 16:row * 16 + 16] for row in order)
+            for tag, rows in tag_rows.items():
+                tag_rows[tag] = array("I", sorted(new_rows[row] for row in rows))
+
+        tags = sorted(tag_rows)
+        offsets = array("Q", [0])
+        postings = bytearray()
+        for tag in tags:
+            postings += encode_postings(tag_rows.pop(tag))
+            offsets.append(len(postings))
+
+        return cls(
+            columns, bytes(md5s), extensions=list(extensions), tags=tags, offsets=offsets, postings=bytes(postings),
+        )
+
+    def save(self, file_path: Path, source: dict[str, Any]) -> None:
+        """ Save the index, as a JSON header line followed by each binary section.
+
+        Args:
+            file_path (Path): Path to save the index to.
+            source (dict[str, Any]): Details of the posts dump the index was built from, to check it against \
+                                     when loading the index.
+        """
+        sections = [*self.columns.values(), self.offsets, self.md5s, self.postings]
+        header = {
+            "version": self.VERSION,
+            "source": source,
+            "extensions": self.extensions,
+            "tags": self.tags,
+            "lengths": [len(section) * getattr(section, "itemsize", 1) for section in sections],
+        }
+
+        # Write to a temporary file first, such that an interrupted save never leaves a partial index behind.
+        tmp_path = file_path.with_name(f"_{file_path.name}")
+        with tmp_path.open("wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for section in sections:
+                f.write(section)
+        tmp_path.replace(file_path)
+
+    @classmethod
+    def load(cls, file_path: Path, source: dict[str, Any] | None = None) -> Self | None:
+        """ Load a saved index.
+
+        Args:
+            file_path (Path): Path the index was saved to.
+            source (dict[str, Any] | None, optional): \
+                Details of the posts dump the index must have been built from. \
+                Defaults to None, where any saved index is loaded.
+
+        Returns:
+            Self | None: Loaded index, or None if there is no index saved for the current version and source.
+        """
+        try:
+            with file_path.open("rb") as f:
+                header = json.loads(f.readline())
+                if header.get("version") != cls.VERSION or (source is not None and header.get("source") != source):
+                    return None
+                sections = [f.read(length) for length in header["lengths"]]
+        except (OSError, ValueError):
+            return None
+
+        columns = {}
+        for (name, type_code), section in zip(cls.COLUMNS.items(), sections, strict=False):
+            columns[name] = array(type_code)
+            columns[name].frombytes(section)
+
+        offsets = array("Q")
+        offsets.frombytes(sections[len(cls.COLUMNS)])
+        md5s, postings = sections[len(cls.COLUMNS) + 1:]
+        return cls(
+            columns, md5s, extensions=header["extensions"], tags=header["tags"], offsets=offsets, postings=postings,
+        )
+
+    @classmethod
+    def load_or_build(cls, db_connector: E621DbConnector) -> Self:
+        """ Load the index of the latest posts dump, building it first if the dump has changed since it was built.
+
+        Args:
+            db_connector (E621DbConnector): Connector to fetch the posts dump with, within whose cache directory \
+                                            the index is kept.
+
+        Returns:
+            Self: Index of the latest posts dump.
+        """
+        dump_path = db_connector.get_posts_file()
+        dump_stat = dump_path.stat()
+        source = {"name": dump_path.name, "size": dump_stat.st_size, "mtime_ns": dump_stat.st_mtime_ns}
+
+        index_path = db_connector.cache.resolve_path(cls.FILE_NAME)
+        if (search_index := cls.load(index_path, source)) is not None:
+            return search_index
+
+        logger.info(f"Building search index of '{dump_path}'")
+        search_index = cls.build(dump_path)
+        search_index.save(index_path, source)
+        return search_index
+
+    def tag_rows(self, tag: str) -> list[int]:
+        """ Get the rows of every post with a tag, in ascending order. """
+        if (tag_id := self.tag_ids.get(tag)) is None:
+            return []
+
+        return decode_postings(self.postings[self.offsets[tag_id]:self.offsets[tag_id + 1]])
+
+    def posting_size(self, tag: str) -> int:
+        """ Get the encoded size of the posting list of a tag, which grows with the number of posts it is on. """
+        if (tag_id := self.tag_ids.get(tag)) is None:
+            return 0
+
+        return self.offsets[tag_id + 1] - self.offsets[tag_id]
+
+    def post(self, row: int) -> IndexedPost:
+        """ Get the post stored in a row. """
+        return IndexedPost(
+            post_id=self.columns["id"][row],
+            md5=self.md5s[row * 16:row * 16 + 16].hex(),
+            ext=self.extensions[self.columns["ext"][row]],
+            size=self.columns["size"][row],
+            score=self.columns["score"][row],
+            fav_count=self.columns["fav_count"][row],
+            rating=chr(self.columns["rating"][row]),
+        )
+
+    def search(self, query: str, offset: int | None = None, limit: int | None = None) -> list[IndexedPost]:
+        """ Get the posts matching a search query, newest first unless ordered otherwise by the query.
+
+        Args:
+            query (str): Search query, in the syntax described by the module docstring.
+            offset (int | None, optional): Number of posts to skip. Defaults to None, where no posts are skipped.
+            limit (int | None, optional): Maximum number of posts to return. Defaults to None, where all posts \
+                                          are returned.
+
+        Raises:
+            ValueError: Query contains an invalid or unsupported metatag.
+
+        Returns:
+            list[IndexedPost]: Posts matching the query.
+        """
+        parsed = parse_query(query)
+        post_ids = self.columns["id"]
+
+        # Narrow the rows to search to any range of post IDs required, as rows are ordered by post ID.
+        start, stop = 0, len(post_ids)
+        for column_filter in parsed.filters:
+            if column_filter.column == "id" and not column_filter.negated and column_filter.values is None:
+                if column_filter.low is not None:
+                    start = max(start, bisect.bisect_left(post_ids, column_filter.low))
+                if column_filter.high is not None:
+                    stop = min(stop, bisect.bisect_right(post_ids, column_filter.high))
+
+        # Intersect required tags from the least used, such that each intersection only shrinks the candidates.
+        rows: list[int] | range = range(start, max(start, stop))
+        if parsed.required:
+            required = sorted(parsed.required, key=self.posting_size)
+            candidates = {row for row in self.tag_rows(required[0]) if start <= row < stop}
+            for tag in required[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(self.tag_rows(tag))
+            rows = sorted(candidates)
+
+        if parsed.any_of:
+            any_of = set().union(*map(self.tag_rows, parsed.any_of))
+            rows = [row for row in rows if row in any_of]
+
+        for tag in parsed.excluded:
+            if self.posting_size(tag):
+                excluded = set(self.tag_rows(tag))
+                rows = [row for row in rows if row not in excluded]
+
+        for column_filter in parsed.filters:
+            column = self.columns[column_filter.column]
+            rows = [row for row in rows if column_filter.matches(column[row])]
+
+        # Sort on the order column, where ties keep the descending post ID order e621 falls back to.
+        column_name, descending = parsed.order
+        rows = list(reversed(rows))
+        if column_name != "id":
+            rows.sort(key=self.columns[column_name].__getitem__, reverse=descending)
+        elif not descending:
+            rows.reverse()
+
+        start = offset or 0
+        return [self.post(row) for row in rows[start:start + limit if limit is not None else None]]
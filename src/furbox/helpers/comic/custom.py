@@ -1,152 +1,396 @@
-# type: ignore noqa: PGH003
 """ Module to provide functionality for comic updates on custom web comics.
 
-TODO - Not currently used in any capacity.
+Pages of a comic are crawled from its latest page back to the newest page downloaded by the previous
+update, which is persisted as a cursor in the comic directory. Pages are found by following backlinks one
+at a time, or fetched concurrently if the comic defines an archive page listing every page. Image checks and
+downloads are made concurrently, and every request is subject to a per-host rate limit. Parsing instructions
+are compiled once per comic for the fastest available parser backend.
+
+Example usage of custom comic downloading: ::
+
+    custom_comic = CustomComic(
+        name="Example Comic",
+        url="https://example.com/comic",
+        images=[CustomComic.Instruction(html_type="img", attrs={"id": "comic"}, index=None)],
+        backlink=[CustomComic.Instruction(html_type="a", attrs={"rel": "prev"})],
+    )
+
+    custom_comic_update(custom_comic=custom_comic, comic_path=Path("path/to/comics"))
 """
-import os
+from http import HTTPStatus
 from pathlib import Path
+from typing import Any, cast
+from urllib.parse import urljoin
 
 import requests
-from bs4 import BeautifulSoup
-from bs4.element import Tag
-from fluffless.models.base_model import BaseModel
 from fluffless.utils import logging
 
-from furbox.connectors.downloader import download_files, get_numbered_file_names
-from furbox.helpers.utils import clean_url, Constants, hash_file, md5_from_url
+from furbox.connectors.bandwidth import scheduler
+from furbox.connectors.downloader import download_files, get_numbered_file_names, UrlFileTarget
+from furbox.helpers.comic.parser import get_parser, Selector
+from furbox.helpers.utils import clean_url, CompletionExecutor, Constants, hash_file, md5_from_url
+from furbox.models.comic import CustomComic, CustomComicState
 from furbox.utils.progress_bar import ProgressBar
 
 logger = logging.getLogger(__name__)
 
+# Number of pages to find between saving the crawl state, when following backlinks.
+CHECKPOINT_PAGES = 20
+
 
-class CustomComic(BaseModel):
-    """ Dataclass representation of a custom web comic. """
+def image_unchanged(url: str, record: CustomComicState.ImageRecord, session: requests.Session) -> bool:
+    """ Check if a previously downloaded image is unchanged, downloading its contents only as a last resort.
 
-    class Instruction(BaseModel):
-        """ Single instruction to apply on a BeautifulSoup to extract data. """
+    Args:
+        url (str): URL of the image to check.
+        record (CustomComicState.ImageRecord): Validators recorded when the image was downloaded.
+        session (requests.Session): Session to make requests with.
 
-        html_type: str | None = None
-        text:      str | None = None
-        attrs:     dict[str, str] = {}
-        index:     int | None = 0
+    Returns:
+        bool: True if the image matches the recorded validators.
+    """
+    # A conditional request will return "304 Not Modified" without a body if the ETag still matches.
+    with scheduler.connection(url):
+        response = session.head(
+            url, headers={"If-None-Match": record.etag} if record.etag else {}, allow_redirects=True, timeout=5,
+        )
 
-    name: str | None = None
-    url:  str | None = None
+    if response.status_code == HTTPStatus.NOT_MODIFIED:
+        return True
 
-    # Local directory to download files to, relative to the base comics directory
-    dir_name: str | os.PathLike | None = None
-    # Update the local files if True, only check for new items without downloading if False
-    update:   bool = True
+    response.raise_for_status()
+    if record.etag and response.headers.get("ETag") == record.etag:
+        return True
 
-    # List of instructions to extract a link to the latest page,
-    # images on a page, and the previous page respectively
-    latest:   list[Instruction] = []
-    images:   list[Instruction] = []
-    backlink: list[Instruction] = []
+    # A differing length is enough to know the image has changed.
+    content_length = response.headers.get("Content-Length")
+    if content_length and record.content_length and int(content_length) != record.content_length:
+        return False
 
+    # Only hash the image contents if the validators are missing or inconclusive.
+    return record.md5 is not None and md5_from_url(url, session) == record.md5
 
-def custom_comic_update(custom_comic: CustomComic, comic_path: Path) -> None:
-    """ Check for new pages and download new items for a web comic.
+
+def image_matches_file(url: str, file_path: Path, file_hash: str, session: requests.Session) -> bool:
+    """ Check if an image matches a local file, downloading its contents only if the sizes match.
 
     Args:
-        custom_comic (CustomComic): Dataclass with local archive information and parsing instructions.
-        comic_path (Path): Base directory for comic archives.
+        url (str): URL of the image to check.
+        file_path (Path): Local file to compare the image to.
+        file_hash (str): MD5 hash of the local file.
+        session (requests.Session): Session to make requests with.
+
+    Returns:
+        bool: True if the image matches the local file.
     """
-    def extract_from_soup(soup: BeautifulSoup, instructions: list[CustomComic.Instruction]) -> Tag | list[Tag]:
-        """ Extract a single tag, or a set of tags from a BeautifulSoup object.
+    with scheduler.connection(url):
+        response = session.head(url, allow_redirects=True, timeout=5)
+
+    content_length = response.headers.get("Content-Length")
+    if response.ok and content_length and int(content_length) != file_path.stat().st_size:
+        return False
+
+    return md5_from_url(url, session) == file_hash
+
+
+class ComicCrawler:
+    """ Crawl engine finding the pages and images of a custom web comic which have not yet been downloaded.
+
+    Args:
+        custom_comic (CustomComic): Comic definition with parsing instructions.
+        state (CustomComicState): Persisted state of the comic, updated as the crawl progresses.
+        local_comic_dir (Path): Local comic directory.
+        threads (int, optional): Maximum number of concurrent requests. Defaults to 8.
+        persist (bool, optional): Save crawl progress to the comic directory. Defaults to True.
+    """
+
+    def __init__(
+        self, custom_comic: CustomComic, state: CustomComicState, local_comic_dir: Path, threads: int = 8,
+        persist: bool = True,
+    ) -> None:
+        self.custom_comic = custom_comic
+        self.state = state
+        self.local_comic_dir = local_comic_dir
+        self.threads = threads
+        self.persist = persist
+
+        # Set up a session object with a standard browser user agent, shared by all worker threads.
+        self.session = requests.session()
+        self.session.headers.update({"User-Agent": Constants.GENERIC_USER_AGENT})
+
+        # Compile parsing instructions once, to be run against every page crawled.
+        self.parser = get_parser()
+        self.latest_selector = self.parser.compile(custom_comic.latest)
+        self.image_selector = self.parser.compile(custom_comic.images)
+        self.backlink_selector = self.parser.compile(custom_comic.backlink)
+        self.archive_selector = self.parser.compile(custom_comic.archive)
+
+        # Without a cursor or recorded images, fall back to matching images against the last local file.
+        self.last_file: Path | None = None
+        self._last_file_hash: str | None = None
+        if state.last_page_url is None and not state.images and (local_files := self.local_files()):
+            self.last_file = local_files[-1]
+
+    def local_files(self) -> list[Path]:
+        """ Get the downloaded files of the comic, in page order. """
+        if not self.local_comic_dir.is_dir():
+            return []
+
+        return sorted(f for f in self.local_comic_dir.iterdir() if f.is_file() and not f.name.startswith((".", "_")))
+
+    def fetch_page(self, url: str) -> Any:
+        """ Fetch and parse a page, subject to the rate limit of its host. """
+        scheduler.limit_host(url, requests_per_second=self.custom_comic.rate_limit)
+        with scheduler.connection(url):
+            response = self.session.get(url, timeout=10)
+
+        response.raise_for_status()
+        return self.parser.parse(response.text)
+
+    @staticmethod
+    def extract_links(document: Any, page_url: str, selector: Selector) -> list[str]:
+        """ Extract absolute link targets from a page, returning no links if the selector does not match. """
+        return [urljoin(page_url, href) for element in selector.select(document) if (href := element.get("href"))]
+
+    def save_state(self) -> None:
+        """ Save the comic state, if crawl progress is being persisted. """
+        if self.persist:
+            self.state.save(self.local_comic_dir)
+
+    def fetch_image_urls(self, page_url: str) -> list[str]:
+        """ Fetch a page, and extract the URLs of every image on it. """
+        return self.extract_image_urls(self.fetch_page(page_url), page_url)
+
+    def extract_image_urls(self, document: Any, page_url: str) -> list[str]:
+        """ Extract the URLs of every image on a page, limiting the rate of requests to their hosts. """
+        image_urls = [
+            clean_url(urljoin(page_url, src)) for element in self.image_selector.select(document)
+            if (src := element.get("src"))
+        ]
+        for image_url in image_urls:
+            scheduler.limit_host(image_url, requests_per_second=self.custom_comic.rate_limit)
+
+        return image_urls
+
+    def latest_page_url(self) -> str:
+        """ Find the URL of the latest page of the comic. """
+        if not self.custom_comic.latest:
+            return self.custom_comic.url
+
+        document = self.fetch_page(self.custom_comic.url)
+        if not (links := self.extract_links(document, self.custom_comic.url, self.latest_selector)):
+            raise ValueError(f"Could not find the latest page of {self.custom_comic.name} at '{self.custom_comic.url}'")
+
+        return links[0]
+
+    def is_downloaded(self, url: str) -> bool:
+        """ Check if an image has already been downloaded, using the cheapest available check. """
+        if record := self.state.images.get(url):
+            if image_unchanged(url, record, self.session):
+                return True
+
+            # Forget the record of a changed image, such that it is downloaded again.
+            self.state.images.pop(url, None)
+            return False
 
-        Args:
-            soup (BeautifulSoup): BeautifulSoup object to find tags from.
-            instructions (list[CustomComic.Instruction]): \
-                List of instructions to perform on the input soup to extract tags.
+        if self.last_file is None:
+            return False
+
+        self._last_file_hash = self._last_file_hash or hash_file(self.last_file)
+        return image_matches_file(url, self.last_file, self._last_file_hash, self.session)
+
+    def new_images(self, image_urls: list[str]) -> list[str] | None:
+        """ Check the images of a page concurrently, returning the new images if any were already downloaded.
 
         Returns:
-            Tag | list[Tag]: Tag or list of tags extracted from the input soup.
+            list[str] | None: Images which have not been downloaded, or None if none have been downloaded.
+
+        Raises:
+            RuntimeError: If any image could not be checked, as the crawl cannot tell whether to stop at the page.
         """
-        tags = soup
-        for instruction in instructions:
-            tags = tags.find_all(instruction.html_type, attrs=instruction.attrs)
+        executor = CompletionExecutor(self.is_downloaded, threads=self.threads)
+        report = executor.run(image_urls)
+        if report.failures:
+            failure = report.failures[0]
+            raise RuntimeError(f"Could not check {len(report.failures)} images, such as '{failure.item}'") \
+                from failure.exception
 
-            # If text was provided, search for the text in the tag list
-            if text := instruction.text:
-                tags = [tag for tag in tags if text in tag.text]
+        downloaded = dict(report.results)
+        if not any(downloaded.values()):
+            return None
 
-            # If an index was provided, return the tag matching it
-            if instruction.index is not None:
-                tags = tags[instruction.index]
+        return [url for url in image_urls if not downloaded.get(url)]
 
-        return tags
+    def add_page(self, crawl: CustomComicState.Crawl, page_url: str, image_urls: list[str]) -> bool:
+        """ Add a page to a crawl, returning True if it is the last page which needs to be crawled.
 
-    # Set up a session object with a standard browser user agent, and fetch the initial page
-    session = requests.session()
-    session.headers = {"User-Agent": Constants.USER_AGENT}
-    page = custom_comic.url
+        The crawl stops at the cursor, or when there is no cursor, at a page containing an image matching the
+        last local file. Only the images of the last page which have not already been downloaded are added, or
+        every image of the cursor page if none of them match, as they have all changed since they were downloaded.
+        """
+        at_cursor = page_url == self.state.last_page_url
+        if at_cursor or self.last_file is not None:
+            new_image_urls = self.new_images(image_urls)
+            if at_cursor or new_image_urls is not None:
+                crawl.pages.append(CustomComicState.Crawl.Page(
+                    url=page_url, image_urls=image_urls if new_image_urls is None else new_image_urls,
+                ))
+                return True
 
-    # If custom instructions to get to the latest page were provided, extract using them
-    if custom_comic.latest:
-        response = session.get(custom_comic.url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        page = extract_from_soup(soup, custom_comic.latest)["href"]
+        crawl.pages.append(CustomComicState.Crawl.Page(url=page_url, image_urls=image_urls))
+        return False
 
-    local_comic_dir = Path(comic_path) / (custom_comic.dir_name or custom_comic.name)
-    if not local_comic_dir.exists():
-        logger.print(f"Folder '{local_comic_dir}' does not exist, creating it")
-        local_comic_dir.mkdir(parents=True, exist_ok=True)
+    def crawl(self) -> CustomComicState.Crawl:
+        """ Find every page newer than the cursor, resuming a previously interrupted crawl if there is one.
 
-    # Find the alphabetical last file in the directory if it exists
-    # Use this files hash as the stopping point when searching backwards through pages,
-    # and use it's associated number as a file naming offset when writing pages to disk
-    target_hash = None
-    file_name_offset = 0
-    if local_files := [f for f in local_comic_dir.iterdir() if f.is_file()]:
-        last_file = local_files[-1]
-        target_hash = hash_file(last_file)
-        try:
-            file_name_offset = int(last_file.stem.split(" ")[-1])
-        except Exception:
-            logger.exception(f"File '{last_file}' must follow the format 'series_name page_number.ext'")
-
-    images = []
-    progress = ProgressBar(f"Searching pages - {custom_comic.name}")
-    while True:
-        response = session.get(page)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
+        Returns:
+            CustomComicState.Crawl: Finished crawl, with every new page found.
+        """
+        if (crawl := self.state.crawl) is None:
+            latest_page_url = self.latest_page_url()
+            crawl = self.state.crawl = CustomComicState.Crawl(
+                latest_page_url=latest_page_url, next_page_url=latest_page_url,
+            )
+        else:
+            logger.info(f"Resuming crawl of {self.custom_comic.name} from '{crawl.next_page_url}'")
+
+        if crawl.next_page_url is None:
+            return crawl
 
-        image_urls = [tag["src"] for tag in extract_from_soup(soup, custom_comic.images)]
-        image_urls = [clean_url(url) for url in image_urls]
+        if self.custom_comic.archive_url:
+            self._crawl_archive(crawl)
+        else:
+            self._crawl_backlinks(crawl)
 
-        # If any of the image hashes match the local file, all new pages have been found
-        if target_hash in [md5_from_url(url, session) for url in image_urls]:
-            break
+        return crawl
 
-        images = image_urls + images
-        progress.advance(len(image_urls))
+    def _crawl_backlinks(self, crawl: CustomComicState.Crawl) -> None:
+        """ Find new pages by following backlinks from the latest page, one page at a time. """
+        with ProgressBar(f"Searching pages - {self.custom_comic.name}") as progress:
+            while (page_url := crawl.next_page_url) is not None:
+                document = self.fetch_page(page_url)
+                image_urls = self.extract_image_urls(document, page_url)
+                if self.add_page(crawl, page_url, image_urls):
+                    crawl.next_page_url = None
+                    break
 
-        # Find the backlink to the previous page if it exists
-        try:
-            page = extract_from_soup(soup, custom_comic.backlink)["href"]
-        except Exception:  # noqa: BLE001
-            break
+                progress.advance(len(image_urls))
 
-    progress.close()
+                # Follow the backlink to the previous page if it exists, guarding against the first page linking
+                # back to itself.
+                backlinks = self.extract_links(document, page_url, self.backlink_selector)
+                crawl.next_page_url = backlinks[0] if backlinks and backlinks[0] != page_url else None
 
-    if not images:
+                if len(crawl.pages) % CHECKPOINT_PAGES == 0:
+                    self.save_state()
+
+    def _crawl_archive(self, crawl: CustomComicState.Crawl) -> None:
+        """ Find new pages from the archive page, fetching them all concurrently. """
+        archive_url = cast(str, self.custom_comic.archive_url)
+        page_urls = self.extract_links(self.fetch_page(archive_url), archive_url, self.archive_selector)
+        if not self.custom_comic.archive_newest_first:
+            page_urls.reverse()
+
+        # Only fetch pages newer than the cursor, along with the cursor itself to check for changed images.
+        if self.state.last_page_url in page_urls:
+            page_urls = page_urls[:page_urls.index(self.state.last_page_url) + 1]
+
+        with ProgressBar(f"Searching pages - {self.custom_comic.name}", length=len(page_urls)) as progress:
+            executor = CompletionExecutor(self.fetch_image_urls, threads=self.threads, progress_bar=progress)
+            report = executor.run(page_urls)
+
+        if report.failures:
+            failure = report.failures[0]
+            raise RuntimeError(f"Could not fetch {len(report.failures)} pages, such as '{failure.item}'") \
+                from failure.exception
+
+        image_urls = dict(report.results)
+        for page_url in page_urls:
+            if self.add_page(crawl, page_url, image_urls[page_url]):
+                break
+
+        crawl.next_page_url = None
+
+
+def custom_comic_update(custom_comic: CustomComic, comic_path: Path, dry_run: bool = False, threads: int = 8) -> None:
+    """ Check for new pages and download new items for a web comic.
+
+    The crawl and its assigned file names are saved to the comic directory as they progress, such that an
+    interrupted update resumes where it stopped. Once every new image is downloaded, the latest page becomes
+    the cursor that the next update stops at.
+
+    Args:
+        custom_comic (CustomComic): Comic definition with local archive information and parsing instructions.
+        comic_path (Path): Base directory for comic archives.
+        dry_run (bool, optional): Only report new pages, without modifying files. Defaults to False.
+        threads (int, optional): Maximum number of concurrent requests. Defaults to 8.
+    """
+    local_comic_dir = comic_path / (custom_comic.dir_name or custom_comic.name)
+    state = CustomComicState.load(local_comic_dir)
+
+    # Only persist crawl progress if files will be modified, such that a dry run leaves no trace.
+    persist = custom_comic.update and not dry_run
+    if persist:
+        local_comic_dir.mkdir(parents=True, exist_ok=True)
+
+    crawler = ComicCrawler(
+        custom_comic=custom_comic, state=state, local_comic_dir=local_comic_dir, threads=threads, persist=persist,
+    )
+    crawl = crawler.crawl()
+
+    # Images are downloaded in page order, oldest first, skipping any downloaded before an interruption.
+    image_urls = list(dict.fromkeys(url for page in reversed(crawl.pages) for url in page.image_urls))
+    new_image_urls = [url for url in image_urls if url not in state.images]
+
+    if not new_image_urls:
         logger.print(f"[green]{custom_comic.name} is up to date[/]")
+        state.last_page_url, state.crawl = crawl.latest_page_url, None
+        crawler.save_state()
         return
 
-    logger.print(f"{custom_comic.name} has {len(images)} new pages")
-    download_files(
-        url_name_pairs=list(zip(
-            images,
-            get_numbered_file_names(
+    logger.print(f"{custom_comic.name} has {len(new_image_urls)} new pages")
+    if not persist:
+        return
+
+    # Assign file names once every new page is known, such that they are stable if the update is interrupted.
+    if not crawl.file_names:
+        local_files = crawler.local_files()
+        file_name_offset = 0
+        if local_files:
+            try:
+                file_name_offset = int(local_files[-1].stem.split(" ")[-1])
+            except ValueError:
+                logger.exception(f"File '{local_files[-1]}' must follow the format 'series_name page_number.ext'")
+
+        crawl.file_names = {
+            target.url: target.output_path.name for target in get_numbered_file_names(
+                download_urls=image_urls,
+                download_directory=local_comic_dir,
                 name=custom_comic.name,
-                length=len(images),
                 offset=file_name_offset,
                 zero_pad=4,
-            ), strict=True,
-        )),
-        download_dir=local_comic_dir,
+            )
+        }
+        state.save(local_comic_dir)
+
+    report = download_files(
+        file_targets=[
+            UrlFileTarget(url=url, file_name=crawl.file_names[url], download_directory=local_comic_dir, extension=None)
+            for url in new_image_urls
+        ],
         description=f"Downloading {custom_comic.name}",
+        threads=threads,
     )
+
+    # Record validators for each downloaded image, such that future updates can check them cheaply.
+    for target, (headers, _) in report.results:
+        state.images[target.url] = CustomComicState.ImageRecord(
+            etag=headers.get("ETag"),
+            content_length=int(headers["Content-Length"]) if "Content-Length" in headers else None,
+            md5=hash_file(target.output_path),
+        )
+
+    if report.succeeded:
+        state.last_page_url, state.crawl = crawl.latest_page_url, None
+
+    state.save(local_comic_dir)
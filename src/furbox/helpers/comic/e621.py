@@ -12,107 +12,502 @@ Example usage of e621 comic downloading: ::
 
     e621_comics_update(config=config, e621_comics=pools)
 """
-from typing import cast
+import queue
+import threading
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import cast, NamedTuple
 
 from fluffless.utils import logging
 
-from furbox.connectors.downloader import download_files, get_numbered_file_names
+from furbox.connectors.cache import HashCache
+from furbox.connectors.downloader import download_target, record_downloads, schedule_file_targets, UrlFileTarget
 from furbox.connectors.e621 import E621Connector, E621DbConnector
-from furbox.models.comic import E621Comic
+from furbox.connectors.journal import LibraryScanner
+from furbox.helpers.comic.storage import ComicStorage
+from furbox.helpers.utils import CompletionExecutor
+from furbox.models.comic import E621Comic, PoolManifest, PoolWatermarks
 from furbox.models.config import Config
 from furbox.models.e621 import Pool, Post
+from furbox.utils.events import events
+from furbox.utils.profiling import profiler
 from furbox.utils.progress_bar import ProgressBar
 
 logger = logging.getLogger(__name__)
 
 
+class ComicUpdate(NamedTuple):
+    """ Named tuple of the resolved update for a single comic, and messages to report once it is finished. """
+
+    comic:           E621Comic
+    name:            str
+    messages:        list[str]
+    file_targets:    list[UrlFileTarget]
+    # Local comic storage and its manifest, to record downloaded posts in once all downloads finish.
+    storage:         ComicStorage | None = None
+    manifest:        PoolManifest | None = None
+    pending_entries: dict[UrlFileTarget, PoolManifest.Entry] | None = None
+    # The comic will be fully in sync with its pool once all file targets are downloaded.
+    synced:          bool = False
+
+
+class PoolUpdatePlan(NamedTuple):
+    """ Named tuple of the file operations required to bring a local comic directory in line with its pool. """
+
+    # Manifest once all renames and removals are complete, not including any posts still to be downloaded.
+    manifest:  PoolManifest
+    # Pairs of current and updated file names, for posts which have moved position in the pool.
+    renames:   list[tuple[str, str]]
+    # File names of posts which are no longer part of the pool, or have been replaced upstream.
+    removals:  list[str]
+    # Posts to download, paired with the file name (without extension) to download them to.
+    downloads: list[tuple[Post, str]]
+
+
+def bootstrap_manifest(pool: Pool, posts: list[Post], page_hashes: dict[str, str]) -> PoolManifest:
+    """ Create a manifest for a comic without one, by matching local pages to posts by hash.
+
+    Posts in the pool before the last matched post which have no matching local page are assumed to have
+    been deliberately excluded, matching the behaviour of the legacy `local_offset` setting.
+
+    Args:
+        pool (Pool): Pool information for the comic.
+        posts (list[Post]): Posts in the pool which are available from e621.
+        page_hashes (dict[str, str]): MD5 hash of every local page, keyed on file name.
+
+    Returns:
+        PoolManifest: Manifest of the posts already stored locally.
+    """
+    posts_by_md5 = {post.file_info.md5: post for post in posts}
+
+    matched: dict[int, PoolManifest.Entry] = {}
+    zero_pad = 2
+    for file_name, file_hash in sorted(page_hashes.items()):
+        if post := posts_by_md5.get(file_hash):
+            matched[post.post_id] = PoolManifest.Entry(post_id=post.post_id, md5=file_hash, file_name=file_name)
+
+            # Keep the existing zero padding of page numbers, such that existing pages are not renamed.
+            if (page_number := Path(file_name).stem.rsplit(" ", maxsplit=1)[-1]).isdigit():
+                zero_pad = max(zero_pad, len(page_number))
+
+    positions = {post_id: position for position, post_id in enumerate(pool.post_ids)}
+    last_position = max((positions[post_id] for post_id in matched), default=-1)
+
+    return PoolManifest(
+        pool_id=pool.pool_id,
+        zero_pad=zero_pad,
+        entries=[matched[post_id] for post_id in pool.post_ids if post_id in matched],
+        excluded_post_ids=[post_id for post_id in pool.post_ids[:last_position + 1] if post_id not in matched],
+    )
+
+
+def plan_pool_update(manifest: PoolManifest, pool: Pool, posts: list[Post], comic_name: str) -> PoolUpdatePlan:
+    """ Diff a pool against the local manifest, to find exactly which posts to download, rename or remove.
+
+    Args:
+        manifest (PoolManifest): Manifest of the posts stored locally.
+        pool (Pool): Pool information for the comic.
+        posts (list[Post]): Posts in the pool which are available from e621.
+        comic_name (str): Base name for all files.
+
+    Returns:
+        PoolUpdatePlan: File operations to perform, and the resulting manifest.
+    """
+    available_posts = {post.post_id: post for post in posts}
+    stored_entries = {entry.post_id: entry for entry in manifest.entries}
+    pool_ids = set(pool.post_ids)
+    excluded_ids = [post_id for post_id in manifest.excluded_post_ids if post_id in pool_ids]
+    excluded_id_set = set(excluded_ids)
+
+    # Posts stored locally are kept even if they are no longer available from e621, such as deleted posts.
+    wanted_ids = [
+        post_id for post_id in pool.post_ids
+        if post_id not in excluded_id_set and (post_id in available_posts or post_id in stored_entries)
+    ]
+    zero_pad = max(manifest.zero_pad, len(str(len(wanted_ids))))
+
+    entries: list[PoolManifest.Entry] = []
+    renames: list[tuple[str, str]] = []
+    removals: list[str] = []
+    downloads: list[tuple[Post, str]] = []
+    for page_number, post_id in enumerate(wanted_ids, start=1):
+        file_stem = f"{comic_name} {str(page_number).zfill(zero_pad)}"
+        entry = stored_entries.pop(post_id, None)
+        post = available_posts.get(post_id)
+
+        if entry and (post is None or entry.md5 == post.file_info.md5):
+            file_name = file_stem + Path(entry.file_name).suffix
+            if entry.file_name != file_name:
+                renames.append((entry.file_name, file_name))
+
+            entries.append(PoolManifest.Entry(post_id=post_id, md5=entry.md5, file_name=file_name))
+            continue
+
+        # If the post was replaced upstream, move the outdated local file aside before downloading it again.
+        if entry:
+            removals.append(entry.file_name)
+
+        downloads.append((cast(Post, post), file_stem))
+
+    # Any remaining stored posts are no longer part of the pool.
+    removals += [entry.file_name for entry in stored_entries.values()]
+
+    return PoolUpdatePlan(
+        manifest=PoolManifest(
+            pool_id=pool.pool_id,
+            zero_pad=zero_pad,
+            entries=entries,
+            excluded_post_ids=excluded_ids,
+            unavailable_post_ids=[post_id for post_id in pool.post_ids if post_id not in available_posts],
+        ),
+        renames=renames,
+        removals=removals,
+        downloads=downloads,
+    )
+
+
+def get_pools(
+    e621_connector: E621Connector, pool_ids: list[int], db_connector: E621DbConnector | None,
+) -> dict[int, Pool]:
+    """ Get pool information for a set of pools, preferring a database dump and otherwise fetching in bulk.
+
+    Args:
+        e621_connector (E621Connector): E621 connector to fetch pools with.
+        pool_ids (list[int]): Pool ID numbers to get.
+        db_connector (E621DbConnector | None): Connector to source pools from a database dump with, only \
+                                               fetching pools missing from it from the API. If None, all \
+                                               pools are fetched from the API.
+
+    Returns:
+        dict[int, Pool]: Pools keyed on pool ID. Pools which could not be found are omitted.
+    """
+    pools: dict[int, Pool] = {}
+    if db_connector is not None:
+        wanted_ids = set(pool_ids)
+        pools = {
+            pool.pool_id: pool for pool in
+            db_connector.get_pools(filter_condition=lambda pool: pool.pool_id in wanted_ids)
+        }
+
+    # Fetch any pools not present in the database dump, such as pools created since it was exported.
+    if missing_ids := [pool_id for pool_id in pool_ids if pool_id not in pools]:
+        pools |= {
+            (pool := Pool.from_api(pool_data)).pool_id: pool
+            for pool_data in e621_connector.get_pools(missing_ids)
+        }
+
+    return pools
+
+
+def resolve_comic_update(
+    comic: E621Comic, pool: Pool, e621_connector: E621Connector, storage: ComicStorage, hash_cache: HashCache,
+    *, dry_run: bool, quality: Callable[[Post], Post.Quality] | None = None,
+) -> ComicUpdate:
+    """ Compare a comic with its pool on e621, and determine the files which need to be downloaded.
+
+    If the comic has a manifest, it is diffed against the pool by post ID, such that reordered, inserted and
+    removed posts are handled exactly. Otherwise, local pages are counted as before, and a manifest is created
+    from the hashes of the local pages once the comic is next updated.
+
+    Args:
+        comic (E621Comic): Local comic definition to resolve.
+        pool (Pool): Pool information for the comic.
+        e621_connector (E621Connector): E621 connector to fetch post information with.
+        storage (ComicStorage): Local storage of the comic.
+        hash_cache (HashCache): Cache of hashes to reuse when creating a manifest.
+        dry_run (bool): Only report new pages, without resolving files to download.
+        quality (Callable[[Post], Post.Quality] | None, optional): Get the quality tier to download each post at. \
+                                                                   Defaults to None, where original files are \
+                                                                   downloaded.
+
+    Returns:
+        ComicUpdate: Resolved update, with any file targets to download.
+    """
+    comic_name = comic.name or pool.name
+    manifest = storage.load_manifest()
+
+    if manifest is not None:
+        if manifest.is_current(pool.post_ids):
+            return ComicUpdate(comic, comic_name, [f"[green]{comic_name} is up to date[/]"], [], storage=storage,
+                               synced=True)
+
+        known_ids = {entry.post_id for entry in manifest.entries}
+        known_ids |= set(manifest.excluded_post_ids) | set(manifest.unavailable_post_ids)
+        new_page_count = len(set(pool.post_ids) - known_ids)
+        messages = [f"{comic_name} has {new_page_count} new pages" if new_page_count else
+                    f"{comic_name} has been reordered on e621"]
+    else:
+        # Count the number of local pages present, and offset it by the provided local file offset.
+        local_num_posts = len(storage.page_names())
+        offset_local_num_posts = local_num_posts + comic.local_offset
+
+        # Calculate the difference between local posts and server posts.
+        page_num_diff = pool.post_count - comic.server_deleted - offset_local_num_posts
+
+        # Report if the comic is ahead or matching the server count.
+        if page_num_diff < 0:
+            message = f"[blue]{comic_name} is ahead of e621 by {-page_num_diff} pages[/]"
+            return ComicUpdate(comic, comic_name, [message], [])
+        if page_num_diff == 0:
+            return ComicUpdate(comic, comic_name, [f"[green]{comic_name} is up to date[/]"], [], storage=storage,
+                               synced=True)
+
+        messages = [f"{comic_name} has {page_num_diff} new pages"]
+
+    if not comic.update or dry_run:
+        return ComicUpdate(comic, comic_name, messages, [])
+
+    # Fetch all posts from the pool through the API
+    post_data = e621_connector.get_posts(
+        search=f"pool:{comic.pool_id}",
+        offset=None,
+        limit=None,
+        desc=comic_name,
+    )
+    posts = [Post.from_api(post) for post in post_data]
+
+    if manifest is None:
+        manifest = bootstrap_manifest(pool=pool, posts=posts, page_hashes=storage.hash_pages(hash_cache))
+        messages.append(f"Created a manifest for {comic_name} from {len(manifest.entries)} local pages")
+
+    # Pages deleted locally are treated as not stored, such that they are downloaded again.
+    page_names = set(storage.page_names())
+    manifest.entries = [entry for entry in manifest.entries if entry.file_name in page_names]
+
+    plan = plan_pool_update(manifest=manifest, pool=pool, posts=posts, comic_name=comic_name)
+    if plan.renames or plan.removals:
+        messages.append(f"Renamed {len(plan.renames)} and moved aside {len(plan.removals)} pages of {comic_name}")
+
+    storage.apply_plan(renames=plan.renames, removals=plan.removals)
+
+    # Save the manifest before downloading, such that completed renames are recorded even if downloads fail.
+    storage.save_manifest(plan.manifest)
+
+    pending_entries = {}
+    for post, file_stem in plan.downloads:
+        selected_file = post.select_file(quality(post) if quality else Post.Quality.ORIGINAL)
+        target = UrlFileTarget.create(
+            url=selected_file.url,
+            file_name=file_stem,
+            download_directory=storage.download_directory,
+            extension=selected_file.ext,
+            size=selected_file.size,
+        )
+        pending_entries[target] = PoolManifest.Entry(
+            post_id=post.post_id, md5=post.file_info.md5, file_name=target.output_path.name,
+        )
+
+    return ComicUpdate(
+        comic=comic,
+        name=comic_name,
+        messages=messages,
+        file_targets=list(pending_entries),
+        storage=storage,
+        manifest=plan.manifest,
+        pending_entries=pending_entries,
+        synced=True,
+    )
+
+
 def update_e621_comics(
-    config: Config, e621_comics: list[E621Comic], use_db: bool = False, dry_run: bool = True,
+    config: Config, e621_comics: list[E621Comic], use_db: bool = False, dry_run: bool = True, threads: int = 8,
+    *, full: bool = False, e621_connector: E621Connector | None = None, db_connector: E621DbConnector | None = None,
+    quality: Post.Quality | None = None,
 ) -> None:
-    """ Update e621 comics defined by comic definition file. """
+    """ Update e621 comics defined by comic definition file.
+
+    Comic metadata is resolved one comic at a time in a background thread, subject to the API rate limit,
+    while downloads for every resolved comic are fed into a shared pool of worker threads. Output for each
+    comic is reported in name order, once all of its downloads have finished.
+
+    The `updated_at` and `post_count` of each pool are recorded once its comic is fully in sync, and pools
+    where both are unchanged on later runs are skipped without reading the comic directory or listing posts,
+    unless `full` is set.
+
+    Connectors may be provided by long running processes, to reuse their connections and parsed database
+    dumps between updates. Otherwise new connectors are created for the update.
+
+    New pages are downloaded at the quality tier set for their comic, or otherwise for the comic path and rating
+    of each post in config, falling back to `quality` if given and then the default quality tier in config.
+    """
     if config.e621 is None:
         logger.info("Config was not provided for e621, not updating")
         return
 
+    e621_config = config.e621
+
     config.comics = cast(Config.Comics, config.comics)
+    base_path = config.comics.base_path
+    storage_type = config.comics.storage
 
     # Sort parsed data by pool name, and update comics in this order.
     local_comics = sorted(e621_comics, key=lambda comic: comic.name or "")
 
-    e621_connector = E621Connector(
+    e621_connector = e621_connector or E621Connector(
         username=config.e621.username,
         api_key=config.e621.api_key,
     )
-
-    # If a database connector was provided, fetch pool info using a database dump.
     if use_db:
-        db_connector = E621DbConnector(config.misc.cache_dir or None)
-        db_pools = {
-            pool.pool_id: pool for pool in
-            db_connector.get_pools(
-                filter_condition=lambda pool: pool.pool_id in [local_comic.pool_id for local_comic in local_comics],
-            )
-        }
+        db_connector = db_connector or E621DbConnector(config.misc.cache_dir or None)
 
-    # Start a progress bar, and iterate through each pool
-    with ProgressBar("Updating e621 pools", length=len(e621_comics)) as progress:
-        for comic in e621_comics:
-            pool = db_pools.get(comic.pool_id, Pool.from_api(e621_connector.get_pool(comic.pool_id)))
-            comic_name = comic.name or pool.name
-            local_pool_dir = config.comics.base_path / (comic.dir_name or comic_name)
+    # Fetch pool info for every comic up front, from a database dump if requested, otherwise in bulk.
+    with profiler.span("fetch pools"):
+        pools = get_pools(
+            e621_connector=e621_connector,
+            pool_ids=[comic.pool_id for comic in local_comics],
+            db_connector=db_connector if use_db else None,
+        )
 
-            # Count the number of local files present, and offset it by the provided local file offset.
-            local_num_posts = len([f for f in local_pool_dir.iterdir() if f.is_file()])
-            offset_local_num_posts = local_num_posts + comic.local_offset
+    # Count local files incrementally if a watcher is journalling changes to the comic directories.
+    scanner = LibraryScanner(config.misc.cache_dir or None)
+    watermarks = PoolWatermarks.load(base_path)
+    watermarks_changed = False
 
-            # Calculate the difference between local posts and server posts.
-            page_num_diff = pool.post_count - comic.server_deleted - offset_local_num_posts
+    # Resolve updates in the background, terminated by None once every comic has been resolved.
+    resolved_updates: queue.Queue[ComicUpdate | None] = queue.Queue()
 
-            # Report if the comic is ahead or matching the server count.
-            if page_num_diff < 0:
-                logger.print(f"[blue]{comic.name} is ahead of e621 by {-page_num_diff} pages[/]")
-                progress.advance()
-                continue
-            if page_num_diff == 0:
-                logger.print(f"[green]{comic.name} is up to date[/]")
-                progress.advance()
-                continue
+    def resolve_updates() -> None:
+        """ Resolve the update for each comic in name order, reporting failures without stopping. """
+        try:
+            for comic in local_comics:
+                name = comic.name or str(comic.pool_id)
+                if (pool := pools.get(comic.pool_id)) is None:
+                    message = f"[red]Pool {comic.pool_id} for {name} was not found on e621[/]"
+                    resolved_updates.put(ComicUpdate(comic, name, [message], []))
+                    continue
 
-            logger.print(f"{comic.name} has {page_num_diff} new pages")
-            if not comic.update:
-                progress.advance()
-                continue
+                name = comic.name or pool.name
+                try:
+                    # Skip pools which are unchanged since the comic was last in sync, without any further requests.
+                    storage = ComicStorage.create(storage_type, base_path, comic.dir_name or name, scanner=scanner)
+                    if not full and watermarks.is_unchanged(
+                        pool.pool_id, pool.updated_at, pool.post_count, storage.name,
+                    ):
+                        message = f"[green]{name} is up to date[/]"
+                        resolved_updates.put(ComicUpdate(comic, name, [message], [], storage=storage, synced=True))
+                        continue
+
+                    comic_path = base_path / storage.name
+
+                    def page_quality(
+                        post: Post, comic: E621Comic = comic, comic_path: Path = comic_path,
+                    ) -> Post.Quality:
+                        """ Get the quality tier to download a page at, from the most specific setting for it. """
+                        return comic.quality or e621_config.quality_for(comic_path, post.rating, default=quality)
 
-            if dry_run:
+                    with profiler.span("resolve comic"):
+                        update = resolve_comic_update(
+                            comic=comic,
+                            pool=pool,
+                            e621_connector=e621_connector,
+                            storage=storage,
+                            hash_cache=hash_cache,
+                            dry_run=dry_run,
+                            quality=page_quality,
+                        )
+                    resolved_updates.put(update)
+                except Exception as e:  # noqa: BLE001
+                    resolved_updates.put(ComicUpdate(comic, name, [f"[red]Could not update {name}: {e}[/]"], []))
+        finally:
+            resolved_updates.put(None)
+
+    # Track the number of downloads remaining for each comic, such that finished comics are reported in order.
+    updates: list[ComicUpdate] = []
+    remaining: list[int] = []
+    failures: list[int] = []
+    target_owners: dict[UrlFileTarget, int] = {}
+    next_report = 0
+
+    with (
+        HashCache(config.misc.cache_dir or None) as hash_cache,
+        ProgressBar("Updating e621 pools", length=len(local_comics)) as progress,
+        ProgressBar("Downloading comic pages", length=0) as download_progress,
+    ):
+        def report_finished() -> None:
+            """ Report every finished comic which is next in name order. """
+            nonlocal next_report, watermarks_changed
+            while next_report < len(updates) and remaining[next_report] == 0:
+                update = updates[next_report]
+                if update.synced and update.storage is not None and not failures[next_report] and not dry_run:
+                    pool = pools[update.comic.pool_id]
+                    watermark = PoolWatermarks.Watermark(
+                        updated_at=pool.updated_at,
+                        post_count=pool.post_count,
+                        dir_name=update.storage.name,
+                    )
+                    watermarks_changed |= watermarks.pools.get(pool.pool_id) != watermark
+                    watermarks.pools[pool.pool_id] = watermark
+
+                if update.manifest is not None and update.storage is not None and not dry_run:
+                    update.manifest.entries.sort(key=lambda entry: entry.file_name)
+                    update.storage.save_manifest(update.manifest)
+
+                for message in update.messages:
+                    logger.print(message)
+                if failures[next_report]:
+                    logger.print(f"[red]{failures[next_report]} pages of {update.name} failed to download[/]")
+
+                events.emit(
+                    "comic",
+                    name=update.name,
+                    pages=len(update.file_targets),
+                    failed=failures[next_report],
+                    dry_run=dry_run,
+                )
                 progress.advance()
-                continue
-
-            # Fetch all posts from the pool through the API
-            post_data = e621_connector.get_posts(
-                search=f"pool:{comic.pool_id}",
-                offset=None,
-                limit=None,
-                desc=comic.name,
-            )
-            posts = [Post.from_api(post) for post in post_data]
-
-            # Enforce the order of posts with respect to the pool info data. This will filter
-            # out removed posts, and handle posts where pool order does not match upload time
-            posts.sort(key=lambda post: pool.post_ids.index(post.post_id))
-
-            # Remove the URLs which correspond to files already downloaded
-            download_urls = [post.file_info.url for post in posts][offset_local_num_posts:]
-
-            # Generate download URLs and associated file name pairs.
-            file_targets = get_numbered_file_names(
-                download_urls=download_urls,
-                download_directory=local_pool_dir,
-                name=comic_name,
-            )
-
-            download_files(
-                file_targets=file_targets,
-                description=f"Downloading {comic_name}",
-            )
-
-            progress.advance()
+                next_report += 1
+
+        def iter_file_targets() -> Iterator[UrlFileTarget]:
+            """ Yield the file targets of each comic as soon as its update is resolved. """
+            total_targets = 0
+            while (update := resolved_updates.get()) is not None:
+                index = len(updates)
+                updates.append(update)
+                remaining.append(len(update.file_targets))
+                failures.append(0)
+
+                for target in update.file_targets:
+                    target_owners[target] = index
+
+                total_targets += len(update.file_targets)
+                download_progress.set_length(total_targets)
+
+                report_finished()
+                yield from schedule_file_targets(update.file_targets, threads)
+
+        resolver = threading.Thread(target=resolve_updates, name="comic-resolver", daemon=True)
+        resolver.start()
+
+        executor = CompletionExecutor(download_target, threads=threads, max_outstanding=threads * 2,
+                                      progress_bar=download_progress)
+        with profiler.span("download pages"):
+            for outcome in executor.outcomes(iter_file_targets()):
+                index = target_owners[outcome.item]
+                update = updates[index]
+                remaining[index] -= 1
+
+                exception = outcome.exception
+                if exception is None and update.pending_entries and (entry := update.pending_entries.get(outcome.item)):
+                    # Move the downloaded page into storage, such as appending it to an archive.
+                    try:
+                        cast(ComicStorage, update.storage).add_page(outcome.item.output_path, entry)
+                        cast(PoolManifest, update.manifest).entries.append(entry)
+                    except Exception as e:  # noqa: BLE001
+                        exception = e
+
+                if exception is not None:
+                    failures[index] += 1
+                    logger.error(
+                        f"Failed to download '{outcome.item.url}' to '{outcome.item.output_path}': {exception}",
+                    )
+
+                report_finished()
+
+        resolver.join()
+        report_finished()
+
+        # Pages are downloaded through the executor directly, so they can be stored as each finishes.
+        record_downloads(executor.report, description="Downloading comic pages")
+
+    if watermarks_changed:
+        watermarks.save(base_path)
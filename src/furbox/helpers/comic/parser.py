@@ -0,0 +1,208 @@
+""" Module to extract elements from comic pages, by compiling `CustomComic.Instruction` lists for a parser backend.
+
+Instructions are compiled once per comic into a selector, then run against every page crawled. If lxml is
+installed, instructions are compiled into a single XPath expression evaluated by libxml2, otherwise they are
+run as a chain of BeautifulSoup `find_all` calls over the pure Python `html.parser`.
+
+Example usage of the parser: ::
+
+    parser = get_parser()
+    selector = parser.compile(custom_comic.images)
+
+    document = parser.parse(response.text)
+    image_urls = [element.get("src") for element in selector.select(document)]
+"""
+import importlib
+from types import ModuleType
+from typing import Any, Protocol, TYPE_CHECKING
+
+from bs4 import BeautifulSoup, Tag
+
+from furbox.models.comic import CustomComic
+
+# lxml is an optional dependency, imported by name such that type checkers do not require it to be installed.
+etree: ModuleType | None
+lxml_html: ModuleType | None
+try:
+    etree = importlib.import_module("lxml.etree")
+    lxml_html = importlib.import_module("lxml.html")
+except ImportError:
+    etree = lxml_html = None
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+class Element(Protocol):
+    """ Element extracted from a page, as either a BeautifulSoup tag or an lxml element. """
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """ Get an attribute of the element. """
+
+
+class Selector(Protocol):
+    """ Compiled list of instructions, which can be run against any number of parsed pages. """
+
+    def select(self, document: Any) -> list[Element]:
+        """ Select elements from a parsed page. Returns no elements if the instructions do not match. """
+
+
+class HtmlParser(Protocol):
+    """ Parser backend, which parses pages and compiles instructions into selectors for them. """
+
+    name: str
+
+    def parse(self, text: str) -> Any:
+        """ Parse the text of a page into a document. """
+
+    def compile(self, instructions: list[CustomComic.Instruction]) -> Selector:
+        """ Compile a list of instructions into a selector. """
+
+
+class SoupSelector:
+    """ Selector running instructions as a chain of BeautifulSoup `find_all` calls. """
+
+    def __init__(self, instructions: list[CustomComic.Instruction]) -> None:
+        self.instructions = instructions
+
+    def select(self, document: BeautifulSoup) -> list[Element]:
+        """ Select elements from a parsed page. Returns no elements if the instructions do not match. """
+        tags: list[Tag] = [document]
+        for instruction in self.instructions:
+            # Attributes are copied into a new dict, as bs4 expects a dict of any value it can match against.
+            tags = [
+                tag for parent in tags
+                for tag in parent.find_all(instruction.html_type, attrs={**instruction.attrs})
+                if isinstance(tag, Tag)
+            ]
+
+            # If text was provided, search for the text in the tag list
+            if text := instruction.text:
+                tags = [tag for tag in tags if text in tag.text]
+
+            # If an index was provided, narrow down to the tag matching it
+            if instruction.index is not None:
+                try:
+                    tags = [tags[instruction.index]]
+                except IndexError:
+                    return []
+
+        return list[Element](tags)
+
+
+class SoupParser:
+    """ Parser backend using BeautifulSoup with the pure Python `html.parser`. Always available. """
+
+    name: str = "beautifulsoup"
+
+    def parse(self, text: str) -> BeautifulSoup:
+        """ Parse the text of a page into a document. """
+        return BeautifulSoup(text, "html.parser")
+
+    def compile(self, instructions: list[CustomComic.Instruction]) -> SoupSelector:
+        """ Compile a list of instructions into a selector. """
+        return SoupSelector(instructions)
+
+
+class XPathSelector:
+    """ Selector evaluating instructions compiled into a single XPath expression. """
+
+    def __init__(self, instructions: list[CustomComic.Instruction]) -> None:
+        if etree is None:
+            raise ValueError("The lxml parser backend requires the optional 'lxml' dependency")
+
+        self.expression = instructions_to_xpath(instructions)
+        self.xpath: Callable[[Any], list[Element]] = etree.XPath(self.expression)
+
+    def select(self, document: Any) -> list[Element]:
+        """ Select elements from a parsed page. Returns no elements if the instructions do not match. """
+        return self.xpath(document)
+
+
+class LxmlParser:
+    """ Parser backend using lxml, which parses and selects in C. Requires the optional `lxml` dependency. """
+
+    name: str = "lxml"
+
+    def parse(self, text: str) -> Any:
+        """ Parse the text of a page into a document. """
+        if lxml_html is None:
+            raise ValueError("The lxml parser backend requires the optional 'lxml' dependency")
+
+        return lxml_html.document_fromstring(text)
+
+    def compile(self, instructions: list[CustomComic.Instruction]) -> XPathSelector:
+        """ Compile a list of instructions into a selector. """
+        return XPathSelector(instructions)
+
+
+def xpath_literal(value: str) -> str:
+    """ Quote a string as an XPath 1.0 literal, which has no escape sequences. """
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+
+    parts = value.split('"')
+    return "concat(" + ", '\"', ".join(f'"{part}"' for part in parts) + ")"
+
+
+def instructions_to_xpath(instructions: list[CustomComic.Instruction]) -> str:
+    """ Compile a list of instructions into an XPath expression, matching the semantics of `find_all`.
+
+    Each instruction selects matching descendants of the previous selection. Attributes match exactly,
+    except `class` which also matches any single class of an element, text matches a substring of all text
+    within an element, and an index selects a single element from all matches, counting from the end if
+    negative.
+
+    Args:
+        instructions (list[CustomComic.Instruction]): List of instructions to compile.
+
+    Returns:
+        str: XPath expression selecting the same elements as the instructions.
+    """
+    expression = "."
+    for instruction in instructions:
+        predicates = []
+        for key, value in instruction.attrs.items():
+            literal = xpath_literal(value)
+            if key == "class":
+                spaced = xpath_literal(f" {value} ")
+                predicates.append(
+                    f"[@class={literal} or contains(concat(' ', normalize-space(@class), ' '), {spaced})]",
+                )
+            else:
+                predicates.append(f"[@{key}={literal}]")
+
+        if instruction.text:
+            predicates.append(f"[contains(string(.), {xpath_literal(instruction.text)})]")
+
+        expression = f"{expression}/descendant::{instruction.html_type or '*'}{''.join(predicates)}"
+
+        if instruction.index is not None:
+            position = instruction.index + 1 if instruction.index >= 0 else f"last() - {-instruction.index - 1}"
+            expression = f"({expression})[{position}]"
+
+    return expression
+
+
+def get_parser(backend: str | None = None) -> HtmlParser:
+    """ Get a parser backend, preferring lxml if it is installed.
+
+    Args:
+        backend (str | None, optional): Name of the backend to use, either "lxml" or "beautifulsoup". \
+                                        Defaults to None, where the fastest available backend is used.
+
+    Raises:
+        ValueError: Requested backend is unknown, or is not installed.
+
+    Returns:
+        HtmlParser: Parser backend.
+    """
+    if backend in {None, LxmlParser.name} and lxml_html is not None:
+        return LxmlParser()
+
+    if backend in {None, SoupParser.name}:
+        return SoupParser()
+
+    raise ValueError(f"HTML parser backend '{backend}' is unknown or not installed")
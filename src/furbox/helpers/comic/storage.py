@@ -0,0 +1,363 @@
+""" Module to store the pages of a comic, either as a directory of files or as a single CBZ archive.
+
+CBZ archives are uncompressed zip files, such that downloaded pages are appended without recompression. The
+manifest of a CBZ comic is kept within the archive itself, with each entry's post recorded in its entry
+comment and the remaining manifest fields in the archive comment. Reading the manifest therefore only reads
+the central directory at the end of the archive, rather than listing or reading any pages.
+
+Example usage of comic storage: ::
+
+    storage = ComicStorage.create(Config.Comics.Storage.CBZ, base_path=Path("path/to/comics"), dir_name="Comic")
+    manifest = storage.load_manifest()
+
+    storage.add_page(downloaded_file_path, PoolManifest.Entry(post_id=1, md5="...", file_name="Comic 01.png"))
+    storage.save_manifest(manifest)
+"""
+import hashlib
+import json
+import shutil
+import struct
+import uuid
+import zipfile
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from contextlib import contextmanager, ExitStack
+from pathlib import Path
+
+from fluffless.utils import logging
+
+from furbox.connectors.cache import HashCache
+from furbox.connectors.journal import LibraryScanner
+from furbox.helpers.utils import hash_file
+from furbox.models.comic import PoolManifest
+from furbox.models.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Size of chunks to copy pages in, when moving them into or between archives.
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def is_page_name(name: str) -> bool:
+    """ Check if a file name is a comic page, rather than a hidden or temporary file. """
+    return not name.startswith((".", "_"))
+
+
+class ComicStorage(ABC):
+    """ Storage for the pages of a single comic, and the manifest of the posts they correspond to. """
+
+    @staticmethod
+    def create(
+        storage_type: Config.Comics.Storage, base_path: Path, dir_name: str, scanner: LibraryScanner | None = None,
+    ) -> "ComicStorage":
+        """ Create the storage for a comic.
+
+        Args:
+            storage_type (Config.Comics.Storage): Type of storage to use.
+            base_path (Path): Base directory for comic archives.
+            dir_name (str): Name of the comic directory, or archive without its extension.
+            scanner (LibraryScanner | None, optional): Scanner to list directory storage with. \
+                                                       Defaults to None, where directories are listed directly.
+
+        Returns:
+            ComicStorage: Storage for the comic.
+        """
+        if storage_type == Config.Comics.Storage.CBZ:
+            return CbzStorage(base_path / f"{dir_name}.cbz")
+
+        return DirectoryStorage(base_path / dir_name, scanner=scanner)
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """ Name of the comic directory or archive. """
+
+    @property
+    @abstractmethod
+    def download_directory(self) -> Path:
+        """ Directory to download pages to, before they are added to the storage. """
+
+    @abstractmethod
+    def load_manifest(self) -> PoolManifest | None:
+        """ Load the manifest of the comic, or None if it does not have one. """
+
+    @abstractmethod
+    def save_manifest(self, manifest: PoolManifest) -> None:
+        """ Save the manifest of the comic. Entries must correspond to pages already in the storage. """
+
+    @abstractmethod
+    def page_names(self) -> list[str]:
+        """ Get the file names of every page stored, in page order. """
+
+    @abstractmethod
+    def hash_pages(self, hash_cache: HashCache | None = None) -> dict[str, str]:
+        """ Get the MD5 hash of every page stored, keyed on file name. """
+
+    @abstractmethod
+    def apply_plan(self, renames: list[tuple[str, str]], removals: list[str]) -> None:
+        """ Rename and remove pages. Removed pages are moved aside, not deleted. """
+
+    @abstractmethod
+    def add_page(self, file_path: Path, entry: PoolManifest.Entry) -> None:
+        """ Add a page downloaded to the download directory to the storage, as the file name of its entry.
+
+        Pages are only guaranteed to be kept once the manifest is next saved.
+        """
+
+
+class DirectoryStorage(ComicStorage):
+    """ Storage of a comic as a directory of files, with the manifest kept in a hidden file.
+
+    Args:
+        directory (Path): Comic directory.
+        scanner (LibraryScanner | None, optional): Scanner to list the directory with. \
+                                                   Defaults to None, where the directory is listed directly.
+    """
+
+    def __init__(self, directory: Path, scanner: LibraryScanner | None = None) -> None:
+        self.directory = directory
+        self.scanner = scanner
+
+    @property
+    def name(self) -> str:
+        """ Name of the comic directory. """
+        return self.directory.name
+
+    @property
+    def download_directory(self) -> Path:
+        """ Directory to download pages to, which is the comic directory itself. """
+        return self.directory
+
+    def load_manifest(self) -> PoolManifest | None:
+        """ Load the manifest of the comic, or None if it does not have one. """
+        return PoolManifest.load(self.directory)
+
+    def save_manifest(self, manifest: PoolManifest) -> None:
+        """ Save the manifest of the comic. Entries must correspond to pages already in the storage. """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest.save(self.directory)
+
+    def page_names(self) -> list[str]:
+        """ Get the file names of every page stored, in page order. """
+        if self.scanner:
+            file_paths = list(self.scanner.scan(self.directory))
+        else:
+            file_paths = [f for f in self.directory.iterdir() if f.is_file()] if self.directory.is_dir() else []
+
+        return sorted(f.name for f in file_paths if is_page_name(f.name))
+
+    def hash_pages(self, hash_cache: HashCache | None = None) -> dict[str, str]:
+        """ Get the MD5 hash of every page stored, keyed on file name. """
+        return {name: hash_file(self.directory / name, hash_cache=hash_cache) for name in self.page_names()}
+
+    def apply_plan(self, renames: list[tuple[str, str]], removals: list[str]) -> None:
+        """ Rename and remove pages. Removed pages are moved aside, not deleted. """
+        for file_name in removals:
+            logger.info(f"Moving '{self.directory.name}/{file_name}' aside, as it is no longer part of the pool")
+            (self.directory / file_name).rename(self.directory / f"_removed-{file_name}")
+
+        # Rename in two phases through temporary names, such that pages can swap positions without overwriting files.
+        tmp_renames = []
+        for file_name, updated_name in renames:
+            tmp_file_path = self.directory / f"_renaming-{uuid.uuid4()}"
+            (self.directory / file_name).rename(tmp_file_path)
+            tmp_renames.append((tmp_file_path, updated_name))
+
+        for tmp_file_path, updated_name in tmp_renames:
+            tmp_file_path.rename(self.directory / updated_name)
+
+    def add_page(self, file_path: Path, entry: PoolManifest.Entry) -> None:
+        """ Pages are downloaded directly into the comic directory, so are already in place. """
+
+
+class CbzStorage(ComicStorage):
+    """ Storage of a comic as a single uncompressed CBZ archive, with the manifest kept in the archive.
+
+    Appending to an archive overwrites its central directory, so the original central directory is journalled
+    beforehand. If an append is interrupted, the archive is restored from the journal the next time it is used.
+    Pages added during an update are appended to a single open archive, whose central directory is only written
+    once the manifest is saved, rather than once per page.
+
+    Args:
+        archive_path (Path): Path of the CBZ archive.
+    """
+
+    # Archive comments are limited to the maximum value of an unsigned 16 bit integer.
+    MAX_COMMENT_SIZE: int = 0xFFFF
+    JOURNAL_HEADER = struct.Struct("<q")
+
+    def __init__(self, archive_path: Path) -> None:
+        self.archive_path = archive_path
+        self.journal_path = archive_path.with_name(f"_{archive_path.name}.journal")
+        self.staging_directory = archive_path.with_name(f"_{archive_path.stem}.parts")
+        # Archive open for appending pages, until the manifest is next saved.
+        self._pending: ExitStack | None = None
+        self._archive: zipfile.ZipFile | None = None
+        self._recover()
+
+    @property
+    def name(self) -> str:
+        """ File name of the archive. """
+        return self.archive_path.name
+
+    @property
+    def download_directory(self) -> Path:
+        """ Directory to download pages to, which are moved into the archive once downloaded. """
+        return self.staging_directory
+
+    def load_manifest(self) -> PoolManifest | None:
+        """ Load the manifest of the comic from the central directory of the archive. """
+        if not self.archive_path.exists():
+            return None
+
+        with zipfile.ZipFile(self.archive_path) as archive:
+            if not archive.comment:
+                return None
+
+            manifest = PoolManifest.model_validate_json(archive.comment)
+            manifest.entries = sorted(
+                (
+                    PoolManifest.Entry(file_name=info.filename, **json.loads(info.comment))
+                    for info in archive.infolist() if info.comment
+                ),
+                key=lambda entry: entry.file_name,
+            )
+
+        return manifest
+
+    def save_manifest(self, manifest: PoolManifest) -> None:
+        """ Save the manifest of the comic to the archive comment. Entries are recorded as pages are added. """
+        comment = manifest.model_dump_json(exclude={"entries"}).encode()
+        if len(comment) > self.MAX_COMMENT_SIZE:
+            raise ValueError(f"Manifest for '{self.archive_path}' is too large for an archive comment")
+
+        self._open_archive().comment = comment
+
+        # Closing the archive writes its central directory once, including every page added since it was opened.
+        pending, self._pending, self._archive = self._pending, None, None
+        if pending is not None:
+            pending.close()
+
+        # Remove the staging directory once every download has been moved into the archive.
+        if self.staging_directory.exists() and not any(self.staging_directory.iterdir()):
+            self.staging_directory.rmdir()
+
+    def page_names(self) -> list[str]:
+        """ Get the file names of every page stored, in page order. """
+        if not self.archive_path.exists():
+            return []
+
+        with zipfile.ZipFile(self.archive_path) as archive:
+            return sorted(
+                info.filename for info in archive.infolist() if not info.is_dir() and is_page_name(info.filename)
+            )
+
+    def hash_pages(self, hash_cache: HashCache | None = None) -> dict[str, str]:  # noqa: ARG002
+        """ Get the MD5 hash of every page stored, keyed on file name. Hashes are not cached for archives. """
+        page_hashes: dict[str, str] = {}
+        if not self.archive_path.exists():
+            return page_hashes
+
+        with zipfile.ZipFile(self.archive_path) as archive:
+            for name in self.page_names():
+                md5 = hashlib.md5()  # noqa: S324
+                with archive.open(name) as f:
+                    while chunk := f.read(COPY_CHUNK_SIZE):
+                        md5.update(chunk)
+
+                page_hashes[name] = md5.hexdigest()
+
+        return page_hashes
+
+    def apply_plan(self, renames: list[tuple[str, str]], removals: list[str]) -> None:
+        """ Rename and remove pages by rewriting the archive. Removed pages are extracted next to the archive. """
+        if not renames and not removals:
+            return
+
+        renamed = dict(renames)
+        removed = set(removals)
+        removed_directory = self.archive_path.with_name(f"_removed-{self.archive_path.stem}")
+        tmp_archive_path = self.archive_path.with_name(f"_{self.archive_path.name}")
+
+        with (
+            zipfile.ZipFile(self.archive_path) as archive,
+            zipfile.ZipFile(tmp_archive_path, "w", compression=zipfile.ZIP_STORED) as tmp_archive,
+        ):
+            tmp_archive.comment = archive.comment
+            for info in archive.infolist():
+                if info.filename in removed:
+                    logger.info(f"Moving '{self.archive_path.name}/{info.filename}' aside to '{removed_directory}', "
+                                f"as it is no longer part of the pool")
+                    removed_directory.mkdir(parents=True, exist_ok=True)
+                    with archive.open(info) as src, (removed_directory / Path(info.filename).name).open("wb") as dst:
+                        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+                    continue
+
+                renamed_info = zipfile.ZipInfo(renamed.get(info.filename, info.filename), date_time=info.date_time)
+                renamed_info.compress_type = info.compress_type
+                renamed_info.comment = info.comment
+                with archive.open(info) as src, tmp_archive.open(renamed_info, "w") as dst:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+        tmp_archive_path.replace(self.archive_path)
+
+    def add_page(self, file_path: Path, entry: PoolManifest.Entry) -> None:
+        """ Stream a downloaded page into the archive without compression, then remove the downloaded file.
+
+        The page is only recorded in the central directory of the archive once the manifest is next saved.
+        """
+        info = zipfile.ZipInfo.from_file(file_path, arcname=entry.file_name)
+        info.compress_type = zipfile.ZIP_STORED
+        info.comment = json.dumps({"post_id": entry.post_id, "md5": entry.md5}).encode()
+
+        with file_path.open("rb") as src, self._open_archive().open(info, "w") as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+        file_path.unlink()
+
+    def _open_archive(self) -> zipfile.ZipFile:
+        """ Get the archive open for appending, opening it if it is not yet open. """
+        if self._archive is None:
+            self._pending = ExitStack()
+            self._archive = self._pending.enter_context(self._append())
+
+        return self._archive
+
+    @contextmanager
+    def _append(self) -> Iterator[zipfile.ZipFile]:
+        """ Open the archive for appending, journalling its central directory such that it can be restored. """
+        start_dir, central_directory = -1, b""
+        if self.archive_path.exists():
+            with zipfile.ZipFile(self.archive_path) as archive:
+                start_dir = archive.start_dir
+
+            with self.archive_path.open("rb") as f:
+                f.seek(start_dir)
+                central_directory = f.read()
+
+        self.journal_path.write_bytes(self.JOURNAL_HEADER.pack(start_dir) + central_directory)
+
+        with zipfile.ZipFile(self.archive_path, "a", compression=zipfile.ZIP_STORED) as archive:
+            yield archive
+
+        self.journal_path.unlink()
+
+    def _recover(self) -> None:
+        """ Restore the archive from the journal, if a previous append was interrupted. """
+        if not self.journal_path.exists():
+            return
+
+        journal = self.journal_path.read_bytes()
+        (start_dir,) = self.JOURNAL_HEADER.unpack_from(journal)
+        logger.warning(f"Restoring '{self.archive_path}' after an interrupted update")
+
+        # A negative offset records that the archive did not exist before the append.
+        if start_dir < 0:
+            self.archive_path.unlink(missing_ok=True)
+        else:
+            with self.archive_path.open("r+b") as f:
+                f.seek(start_dir)
+                f.write(journal[self.JOURNAL_HEADER.size:])
+                f.truncate()
+
+        self.journal_path.unlink()
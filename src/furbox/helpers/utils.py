@@ -1,13 +1,23 @@
 """ Miscellaneous utility helper functions and constant definitions. """
 import hashlib
-from concurrent.futures import Future
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import cast, NamedTuple
 from urllib.parse import urljoin, urlparse
 
 import requests
 
+from furbox.connectors.bandwidth import scheduler
+from furbox.connectors.cache import FileStat, HashCache
+from furbox.utils.metrics import metrics
 from furbox.utils.progress_bar import ProgressBar
 
+hash_bytes = metrics.counter("furbox_hash_bytes_total", "Bytes of files hashed on disk")
+hash_seconds = metrics.histogram("furbox_hash_seconds", "Time taken to hash each file on disk")
+hash_cache_lookups = metrics.counter("furbox_hash_cache_lookups_total", "Lookups of file digests in the hash cache")
+
 
 class Constants:
     """ Definitions of constant values. """
@@ -16,18 +26,181 @@ class Constants:
     GENERIC_USER_AGENT: str = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:152.0) Gecko/20100101 Firefox/152.0"
 
 
-def execute_futures[T](futures: list[Future[T]], progress_bar: ProgressBar | None = None) -> list[T]:
-    """ Execute and return a list of futures, incrementing a progress bar if one was provided. """
-    def result_and_advance(future: Future[T], progress_bar: ProgressBar) -> T:
-        """ Wrap a future to get the result and increment a progress bar. """
-        result = future.result()
-        progress_bar.advance()
-        return result
+class TaskFailure[T](NamedTuple):
+    """ Named tuple pair of the input item for a failed task and the exception it raised. """
+
+    item:      T
+    exception: BaseException
+
+
+class TaskOutcome[T, R](NamedTuple):
+    """ Named tuple of the input item for a finished task, with either its result or the exception it raised. """
+
+    item:      T
+    result:    R | None
+    exception: BaseException | None
+
+
+class ExecutionReport[T, R]:
+    """ Structured report of the outcome of executing a batch of tasks.
+
+    Attributes:
+        results (list[tuple[T, R]]): Input items paired with their results, in completion order.
+        failures (list[TaskFailure[T]]): Input items paired with the exception their task raised.
+        cancelled (list[T]): Input items which were submitted, but cancelled before they started.
+    """
+
+    def __init__(self) -> None:
+        self.results:   list[tuple[T, R]] = []
+        self.failures:  list[TaskFailure[T]] = []
+        self.cancelled: list[T] = []
+
+    @property
+    def succeeded(self) -> bool:
+        """ True if every submitted task completed without raising an exception or being cancelled. """
+        return not self.failures and not self.cancelled
+
+
+class CompletionExecutor[T, R]:
+    """ Apply a function to many items with a thread pool, yielding results in the order they complete.
 
-    return [
-        result_and_advance(future, progress_bar) if progress_bar else future.result()
-        for future in futures
-    ]
+    Exceptions raised by a task are collected into an `ExecutionReport` rather than aborting the batch. The
+    number of submitted but unfinished tasks can be bounded, such that large or lazily generated inputs are
+    only consumed as workers become free. Remaining work can be cancelled from any thread with `cancel`, and
+    is cancelled automatically if iteration over the results stops early.
+
+    Example usage of CompletionExecutor: ::
+
+        executor = CompletionExecutor(hash_file, threads=8, progress_bar=progress)
+        for file_path, file_hash in executor.imap(files):
+            ...
+
+        for failure in executor.report.failures:
+            logger.warning(f"Could not hash '{failure.item}': {failure.exception}")
+
+    Args:
+        function (Callable[[T], R]): Function to apply to each input item.
+        threads (int, optional): Number of worker threads to use. Defaults to 8.
+        max_outstanding (int | None, optional): Maximum number of submitted tasks which have not yet finished. \
+                                                Defaults to None, where all items are submitted immediately.
+        progress_bar (ProgressBar | None, optional): Progress bar to advance as each task finishes. \
+                                                     Defaults to None.
+    """
+
+    # Interval in seconds to wake up and check for cancellation while waiting on running tasks.
+    POLL_INTERVAL: float = 0.5
+
+    def __init__(
+        self, function: Callable[[T], R], threads: int = 8, max_outstanding: int | None = None,
+        progress_bar: ProgressBar | None = None,
+    ) -> None:
+        self.function = function
+        self.threads = threads
+        self.max_outstanding = max_outstanding
+        self.progress_bar = progress_bar
+        self.report: ExecutionReport[T, R] = ExecutionReport()
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        """ True if cancellation of the remaining work has been requested. """
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """ Stop submitting new items and cancel any tasks which have not yet started. """
+        self._cancel_event.set()
+
+    def imap(self, items: Iterable[T]) -> Iterator[tuple[T, R]]:
+        """ Apply the function to all items, yielding each item and its result as soon as it completes.
+
+        Args:
+            items (Iterable[T]): Input items to apply the function to. Consumed lazily if outstanding tasks \
+                                 are bounded.
+
+        Yields:
+            tuple[T, R]: Input item paired with its result, for each task which completed successfully.
+        """
+        for outcome in self.outcomes(items):
+            if outcome.exception is None:
+                yield outcome.item, cast(R, outcome.result)
+
+    def outcomes(self, items: Iterable[T]) -> Iterator[TaskOutcome[T, R]]:
+        """ Apply the function to all items, yielding the outcome of each task as soon as it finishes.
+
+        Args:
+            items (Iterable[T]): Input items to apply the function to. Consumed lazily if outstanding tasks \
+                                 are bounded.
+
+        Yields:
+            TaskOutcome[T, R]: Outcome of each task which was not cancelled, whether it succeeded or failed.
+        """
+        item_iterator = iter(items)
+        items_exhausted = False
+        pending: dict[Future[R], T] = {}
+
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            while True:
+                # Top up submitted tasks until the input is exhausted, or the outstanding limit is reached.
+                while not (items_exhausted or self.cancelled) and (
+                    self.max_outstanding is None or len(pending) < self.max_outstanding
+                ):
+                    try:
+                        item = next(item_iterator)
+                    except StopIteration:
+                        items_exhausted = True
+                        break
+
+                    pending[executor.submit(self.function, item)] = item
+
+                if not pending:
+                    break
+
+                # Cancel all tasks which have not started, and let the running tasks finish.
+                if self.cancelled:
+                    for future in pending:
+                        future.cancel()
+
+                done, _ = wait(pending, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    if future.cancelled():
+                        self.report.cancelled.append(item)
+                        continue
+
+                    if self.progress_bar:
+                        self.progress_bar.advance()
+
+                    if (exception := future.exception()) is not None:
+                        self.report.failures.append(TaskFailure(item=item, exception=exception))
+                        yield TaskOutcome(item=item, result=None, exception=exception)
+                        continue
+
+                    result = future.result()
+                    self.report.results.append((item, result))
+                    yield TaskOutcome(item=item, result=result, exception=None)
+
+        finally:
+            # Reached if iteration stopped early or raised, cancelling any work which has not yet started.
+            for future, item in pending.items():
+                if future.cancel():
+                    self.report.cancelled.append(item)
+
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def run(self, items: Iterable[T]) -> ExecutionReport[T, R]:
+        """ Apply the function to all items, and return the report once every task has finished.
+
+        Args:
+            items (Iterable[T]): Input items to apply the function to.
+
+        Returns:
+            ExecutionReport[T, R]: Report of all results, failures and cancelled items.
+        """
+        for _ in self.outcomes(items):
+            pass
+
+        return self.report
 
 
 def clean_url(url: str) -> str:
@@ -38,22 +211,45 @@ def clean_url(url: str) -> str:
 def md5_from_url(url: str, session: requests.Session) -> str:
     """ Calculate the MD5 hash for a file from a URL. """
     md5 = hashlib.md5()  # noqa: S324
-    response = session.get(url, stream=True, timeout=5)
-    for chunk in response.iter_content(chunk_size=(1024 * 1024)):
-        md5.update(chunk)
+    with scheduler.connection(url):
+        response = session.get(url, stream=True, timeout=5)
+        for chunk in scheduler.throttle(response.iter_content(chunk_size=scheduler.CHUNK_SIZE)):
+            md5.update(chunk)
 
     return md5.hexdigest()
 
 
-def hash_file(file_path: Path, hash_algorithm: str = "md5") -> str:
+def hash_file(file_path: Path, hash_algorithm: str = "md5", hash_cache: HashCache | None = None) -> str:
     """ Calculate the hash digest for a file on disk.
 
     Args:
         file_path (Path): File to calculate hash for.
         hash_algorithm (str, optional): Hashing algorithm to use. Defaults to "md5".
+        hash_cache (HashCache | None, optional): Cache to reuse digests from for unchanged files. \
+                                                 Defaults to None, where the file is always hashed.
 
     Returns:
         str: Hash digest of the input file.
     """
-    with file_path.open("rb") as f:
-        return hashlib.file_digest(f, hash_algorithm).hexdigest()
+    if hash_cache is None:
+        return _hash_file(file_path, hash_algorithm)
+
+    file_stat = FileStat.from_path(file_path)
+    if digest := hash_cache.get(file_path, hash_algorithm, file_stat):
+        hash_cache_lookups.inc(result="hit")
+        return digest
+
+    hash_cache_lookups.inc(result="miss")
+    digest = _hash_file(file_path, hash_algorithm)
+
+    hash_cache.put(file_path, hash_algorithm, file_stat, digest)
+    return digest
+
+
+def _hash_file(file_path: Path, hash_algorithm: str) -> str:
+    """ Calculate the hash digest for a file on disk, recording the throughput of hashing. """
+    with hash_seconds.time(algorithm=hash_algorithm), file_path.open("rb") as f:
+        digest = hashlib.file_digest(f, hash_algorithm).hexdigest()
+        hash_bytes.inc(f.tell(), algorithm=hash_algorithm)
+
+    return digest
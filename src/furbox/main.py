@@ -1,12 +1,19 @@
 """ Runner entrypoint for Furbox. """
+import argparse
+import logging as std_logging
 import os
 import sys
 from pathlib import Path
 
 from fluffless.utils import cli, logging
+from fluffless.utils.console import console
 
 from furbox import runners
+from furbox.connectors.bandwidth import scheduler
 from furbox.models.config import Config
+from furbox.utils.events import EventLogHandler, events
+from furbox.utils.metrics import metrics
+from furbox.utils.profiling import Profiler, profiler
 
 logger = logging.getLogger(__name__)
 
@@ -41,20 +48,131 @@ def get_config_path() -> Path:
     raise FileNotFoundError("No valid config file found")
 
 
+def add_global_arguments(parser: argparse.ArgumentParser) -> None:
+    """ Add arguments shared by every runner, which are parsed before the runner is selected. """
+    parser.add_argument("--headless", action="store_true",
+                        help="Emit JSON lines progress events instead of progress bars, "
+                             "which is the default when stdout is not a terminal.")
+    parser.add_argument("--events-file", type=Path, metavar="PATH",
+                        help="Append JSON lines progress events to a file, instead of stdout.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time each stage of the runner, and write the results at exit.")
+    parser.add_argument("--profile-mode", type=Profiler.Mode, default=Profiler.Mode.SPANS,
+                        choices=list(Profiler.Mode), metavar="{" + ",".join(Profiler.Mode) + "}",
+                        help="Profile with cProfile (main thread only) or by sampling every thread, alongside the "
+                             "timed stages. Implies --profile when given.")
+    parser.add_argument("--profile-output", type=Path, default=Path("furbox-profile"), metavar="PATH",
+                        help="Path to write profiling results to, with an extension added for each file.")
+
+
+def setup_events(headless: bool, events_file: Path | None) -> None:
+    """ Enable the event stream for headless runs, such as under cron or systemd.
+
+    Args:
+        headless (bool): If True, emit events even if stdout is a terminal.
+        events_file (Path | None): File to append events to. Defaults to stdout, in which case all \
+                                   console output is moved to stderr to keep stdout machine readable.
+    """
+    if not (headless or events_file or not sys.stdout.isatty()):
+        return
+
+    if events_file is not None:
+        events.configure(events_file.open("a", encoding="utf-8"))
+    else:
+        console.file = sys.stderr
+        events.configure(sys.stdout)
+
+    # Warnings and errors are also emitted as events, so failures are visible to whatever consumes the stream.
+    handler = EventLogHandler(level=std_logging.WARNING)
+    std_logging.getLogger("furbox").addHandler(handler)
+
+
+def report_profile(output: Path) -> None:
+    """ Print the time spent in each profiled stage, and write the profiling results to disk. """
+    logger.print(f"Profiled stages of the run, taking {profiler.elapsed:.2f}s in total:")
+    for stage in profiler.breakdown():
+        name = stage["stage"].rsplit(" > ", 1)[-1]
+        percent = f" ({stage['percent']:.1f}%)" if stage["percent"] is not None else ""
+        indent = "  " * (stage["depth"] + 1)
+        logger.print(f"{indent}{name}: {stage['seconds']:.2f}s{percent} over {stage['count']} calls")
+
+    for file_path in profiler.write(output):
+        logger.print(f"Wrote profiling results to '{file_path}'")
+
+
+def parse_args(argv: list[str]) -> tuple[argparse.Namespace, argparse.Namespace]:
+    """ Parse global arguments, then import the selected runner and parse the remaining arguments for it.
+
+    Args:
+        argv (list[str]): Command line arguments, excluding the program name.
+
+    Returns:
+        tuple[argparse.Namespace, argparse.Namespace]: Global arguments, and arguments for the selected runner.
+    """
+    # Global arguments are parsed first, such that they may be given before or after the runner name.
+    global_parser = argparse.ArgumentParser(add_help=False)
+    add_global_arguments(global_parser)
+    global_args, remaining_args = global_parser.parse_known_args(argv)
+
+    # Only the selected runner is imported, the rest are only registered for help output.
+    runners.import_runners(remaining_args)
+    add_global_arguments(cli.ROOT_PARSER)
+
+    return global_args, cli.parse_args(remaining_args)
+
+
+def run_runner(args: argparse.Namespace, config: Config) -> int | None:
+    """ Run the selected runner, or print help if no runner was selected.
+
+    Args:
+        args (argparse.Namespace): Arguments for the selected runner.
+        config (Config): Application config.
+
+    Returns:
+        int | None: Exit code returned by the runner, or None if it succeeded.
+    """
+    # The runner is called directly rather than through `cli.run`, which discards the exit code.
+    if args._entry_func:
+        return args._entry_func(args, config)
+
+    cli.ROOT_PARSER.print_help()
+    return None
+
+
 def main() -> None:
     """ Entrypoint runner. """
-    cli.import_package_modules(runners)
-    args = cli.parse_args()
+    global_args, args = parse_args(sys.argv[1:])
 
     logging.setup_logger(
         verbosity=args.verbose,
         modules=["furbox"],
     )
+    setup_events(global_args.headless, global_args.events_file)
 
     # Load config from the provided config file.
     config = Config.load_from_yaml(get_config_path())
 
-    exit_code = cli.run(args, config)
+    # Apply the global bandwidth and connection limits to all downloads.
+    scheduler.configure(
+        bytes_per_second=config.misc.bandwidth_limit,
+        max_connections=config.misc.max_connections,
+    )
+
+    if global_args.profile or global_args.profile_mode != Profiler.Mode.SPANS:
+        profiler.start(global_args.profile_mode)
+
+    try:
+        runner_name = args._entry_func.__name__.replace("_", "-") if args._entry_func else "help"
+        with profiler.span(runner_name):
+            exit_code = run_runner(args, config)
+    finally:
+        if config.misc.metrics_file:
+            metrics.write(Path(config.misc.metrics_file).expanduser())
+
+        if profiler.enabled:
+            profiler.stop()
+            report_profile(global_args.profile_output)
+
     if exit_code is not None:
         sys.exit(exit_code)
 
@@ -1,6 +1,12 @@
 """ Model definitions for comics. """
+from datetime import datetime
+from pathlib import Path
+from typing import ClassVar, Self
+
 from fluffless.models.base_model import BaseModel
 
+from furbox.models.e621 import Post
+
 
 class E621Comic(BaseModel):
     """ Local comic database model for an e621 pool. """
@@ -10,16 +16,193 @@ class E621Comic(BaseModel):
     # Name of the folder to download to, will default to the name of the pool in E621 if unset.
     name:           str | None = None
     # Number of posts which are not expected to be downloaded (Ex. Deliberately excluded pages).
+    # Only used for comics without a local manifest, which tracks excluded pages itself.
     local_offset:   int = 0
     # Number of posts which have been deleted on server side, and should be skipped over.
+    # Only used for comics without a local manifest, which tracks unavailable posts itself.
     server_deleted: int = 0
     # Local directory to download files to, relative to the base comics directory.
     dir_name:       str | None = None
     # Update the local files if True, only check for new items without downloading if False.
     update:         bool = True
+    # Quality tier to download new pages at, overriding all other quality tier settings. Existing pages are kept.
+    quality:        Post.Quality | None = None
+
+
+class PoolManifest(BaseModel):
+    """ Manifest of the posts stored locally for an e621 pool, kept within the comic directory. """
+
+    class Entry(BaseModel):
+        """ Local file associated with a single post in the pool. """
+
+        post_id:   int
+        md5:       str
+        file_name: str
+
+    FILE_NAME: ClassVar[str] = ".furbox-manifest.json"
+
+    pool_id:              int
+    # Number of digits page numbers are zero padded to in file names.
+    zero_pad:             int = 2
+    # Posts stored locally, in pool order.
+    entries:              list[Entry] = []
+    # Posts in the pool which are deliberately not stored locally.
+    excluded_post_ids:    list[int] = []
+    # Posts in the pool which were not available from e621 at the last update, such as deleted posts.
+    unavailable_post_ids: list[int] = []
+
+    @classmethod
+    def load(cls, comic_dir: Path) -> Self | None:
+        """ Load the manifest stored in a comic directory, or None if it does not exist. """
+        manifest_path = comic_dir / cls.FILE_NAME
+        if not manifest_path.exists():
+            return None
+
+        return cls.model_validate_json(manifest_path.read_text(encoding="utf-8"))
+
+    def save(self, comic_dir: Path) -> None:
+        """ Save the manifest to a comic directory. """
+        tmp_manifest_path = comic_dir / f"_{self.FILE_NAME}"
+        tmp_manifest_path.write_text(self.model_dump_json(indent=4), encoding="utf-8")
+        tmp_manifest_path.replace(comic_dir / self.FILE_NAME)
+
+    def is_current(self, post_ids: list[int]) -> bool:
+        """ Check if the manifest accounts for every post in a pool, in the same order. """
+        stored_ids = [entry.post_id for entry in self.entries]
+        known_ids = {*stored_ids, *self.excluded_post_ids, *self.unavailable_post_ids}
+        stored_id_set = set(stored_ids)
+
+        pool_order = [post_id for post_id in post_ids if post_id in stored_id_set]
+        return known_ids == set(post_ids) and stored_ids == pool_order
+
+
+class PoolWatermarks(BaseModel):
+    """ Pool metadata from the last successful update of each comic, kept within the comics base directory. """
+
+    class Watermark(BaseModel):
+        """ Pool metadata at the point a comic was last fully in sync with its pool. """
+
+        updated_at: datetime
+        post_count: int
+        # Local directory or archive name of the comic, such that moving a comic forces it to be checked again.
+        dir_name:   str
+
+    FILE_NAME: ClassVar[str] = ".furbox-watermarks.json"
+
+    pools: dict[int, Watermark] = {}
+
+    @classmethod
+    def load(cls, base_path: Path) -> Self:
+        """ Load the watermarks stored in the comics base directory, or no watermarks if none exist. """
+        watermarks_path = base_path / cls.FILE_NAME
+        if not watermarks_path.exists():
+            return cls()
+
+        return cls.model_validate_json(watermarks_path.read_text(encoding="utf-8"))
+
+    def save(self, base_path: Path) -> None:
+        """ Save the watermarks to the comics base directory. """
+        base_path.mkdir(parents=True, exist_ok=True)
+        tmp_watermarks_path = base_path / f"_{self.FILE_NAME}"
+        tmp_watermarks_path.write_text(self.model_dump_json(indent=4), encoding="utf-8")
+        tmp_watermarks_path.replace(base_path / self.FILE_NAME)
+
+    def is_unchanged(self, pool_id: int, updated_at: datetime, post_count: int, dir_name: str) -> bool:
+        """ Check if a pool is unchanged since the comic was last fully in sync with it. """
+        watermark = self.pools.get(pool_id)
+        return watermark == self.Watermark(updated_at=updated_at, post_count=post_count, dir_name=dir_name)
+
+
+class CustomComic(BaseModel):
+    """ Local comic database model for a custom web comic, crawled with a set of HTML parsing instructions. """
+
+    class Instruction(BaseModel):
+        """ Single instruction to apply on a BeautifulSoup to extract data. """
+
+        html_type: str | None = None
+        text:      str | None = None
+        attrs:     dict[str, str] = {}
+        index:     int | None = 0
+
+    name:     str
+    url:      str
+    # Local directory to download files to, relative to the base comics directory.
+    dir_name: str | None = None
+    # Update the local files if True, only check for new items without downloading if False.
+    update:   bool = True
+
+    # List of instructions to extract a link to the latest page,
+    # images on a page, and the previous page respectively.
+    latest:   list[Instruction] = []
+    images:   list[Instruction] = []
+    backlink: list[Instruction] = []
+
+    # Optional page listing links to every page of the comic, and instructions to extract those links.
+    # If provided, pages are found from the archive and fetched concurrently, instead of following backlinks.
+    archive_url:          str | None = None
+    archive:              list[Instruction] = []
+    # Links in the archive are listed from newest to oldest if True, and oldest to newest if False.
+    archive_newest_first: bool = False
+
+    # Maximum number of requests per second to each host the comic is fetched from.
+    rate_limit: float = 2.0
+
+
+class CustomComicState(BaseModel):
+    """ Persisted state of a custom web comic, used to resume crawls and cheaply detect new pages. """
+
+    class ImageRecord(BaseModel):
+        """ Validators recorded for a downloaded image, to check if it has changed without downloading it. """
+
+        etag:           str | None = None
+        content_length: int | None = None
+        md5:            str | None = None
+
+    class Crawl(BaseModel):
+        """ Crawl in progress, persisted such that an interrupted crawl resumes where it stopped. """
+
+        class Page(BaseModel):
+            """ Page found during a crawl, with the URLs of its new images. """
+
+            url:        str
+            image_urls: list[str]
+
+        # Latest page of the comic when the crawl started.
+        latest_page_url: str
+        # Next page to fetch when following backlinks, or None once every new page has been found.
+        next_page_url:   str | None
+        # Pages found so far, from newest to oldest.
+        pages:           list[Page] = []
+        # File names assigned to each new image, once every new page has been found.
+        file_names:      dict[str, str] = {}
+
+    FILE_NAME: ClassVar[str] = ".furbox-state.json"
+
+    # URL of the newest page downloaded, acting as the cursor to stop crawling at.
+    last_page_url: str | None = None
+    # Records for each downloaded image, keyed on the image URL.
+    images:        dict[str, ImageRecord] = {}
+    # Crawl in progress, if the last update did not finish.
+    crawl:         Crawl | None = None
+
+    @classmethod
+    def load(cls, comic_dir: Path) -> Self:
+        """ Load the state stored in a comic directory, or an empty state if none exists. """
+        state_path = comic_dir / cls.FILE_NAME
+        if not state_path.exists():
+            return cls()
+
+        return cls.model_validate_json(state_path.read_text(encoding="utf-8"))
+
+    def save(self, comic_dir: Path) -> None:
+        """ Save the state to a comic directory. """
+        tmp_state_path = comic_dir / f"_{self.FILE_NAME}"
+        tmp_state_path.write_text(self.model_dump_json(indent=4), encoding="utf-8")
+        tmp_state_path.replace(comic_dir / self.FILE_NAME)
 
 
 class Comics(BaseModel):
     """ Top level config object for the comics database file. """
 
-    e621: list[E621Comic] = []
+    e621:   list[E621Comic] = []
+    custom: list[CustomComic] = []
@@ -5,10 +5,14 @@ Example usage of Config: ::
     config = Config.load_from_yaml("path/to/config.yaml")
     api_key = config.e621.api_key
 """
+from enum import StrEnum
 from pathlib import Path
 
 from fluffless.models.base_model import BaseModel
 from fluffless.utils import logging
+from pydantic import PositiveInt
+
+from furbox.models.e621 import Post
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +23,40 @@ class Config(BaseModel):
     class Comics(BaseModel):
         """ Comics config definitions. """
 
+        class Storage(StrEnum):
+            """ Supported formats to store the pages of each comic in. """
+
+            DIRECTORY = "directory"
+            CBZ = "cbz"
+
         base_path:     Path
         database_file: str
+        # Store each comic as a directory of pages, or as a single uncompressed CBZ archive.
+        storage:       Storage = Storage.DIRECTORY
+
+    class Daemon(BaseModel):
+        """ Daemon config definitions. """
+
+        class Schedule(BaseModel):
+            """ Runner to run periodically within the daemon. """
+
+            class Runner(StrEnum):
+                """ Runners which may be scheduled. """
+
+                FAV_SYNC = "fav-sync"
+                COMICS_UPDATE = "comics-update"
+
+            runner:   Runner
+            # Minutes between the start of each run.
+            interval: PositiveInt
+            # Name to trigger the schedule by through the control socket. Defaults to the runner name.
+            name:     str | None = None
+            # Command line arguments for the runner, such as `["e621", "--use-db"]` for `comics-update`.
+            args:     list[str] = []
+
+        # Path of the control socket. Defaults to `daemon.sock` in the cache directory.
+        socket_path: str | None = None
+        schedules:   list[Schedule] = []
 
     class E621(BaseModel):
         """ E621 config definitions. """
@@ -32,15 +68,57 @@ class Config(BaseModel):
             questionable: Path
             explicit:     Path
 
-        username:  str
-        api_key:   str
-        fav_paths: FavPaths | None = None
+        class RatingQualities(BaseModel):
+            """ Quality tiers to download posts of each rating at, overriding the default quality tier. """
+
+            safe:         Post.Quality | None = None
+            questionable: Post.Quality | None = None
+            explicit:     Post.Quality | None = None
+
+        username:            str
+        api_key:             str
+        fav_paths:           FavPaths | None = None
+        # Quality tier to download posts at unless overridden, which runners may replace with `--quality`.
+        quality:             Post.Quality = Post.Quality.ORIGINAL
+        rating_qualities:    RatingQualities = RatingQualities()
+        # Quality tiers to download posts to each directory at, overriding quality tiers by rating.
+        directory_qualities: dict[Path, Post.Quality] = {}
+
+        def quality_for(
+            self, directory: Path, rating: Post.Rating, default: Post.Quality | None = None,
+        ) -> Post.Quality:
+            """ Get the quality tier to download a post to a directory at, from the most specific setting for it.
+
+            Args:
+                directory (Path): Directory the post is downloaded to.
+                rating (Post.Rating): Rating of the post.
+                default (Post.Quality | None, optional): Quality tier to use where not overridden, such as from \
+                                                         the command line. Defaults to None, where the `quality` \
+                                                         setting is used.
+
+            Returns:
+                Post.Quality: Quality tier to download the post at.
+            """
+            resolved_directory = directory.expanduser().resolve()
+            for path, quality in self.directory_qualities.items():
+                if path.expanduser().resolve() == resolved_directory:
+                    return quality
+
+            return getattr(self.rating_qualities, Post.Rating(rating).name.lower()) or default or self.quality
 
     class Misc(BaseModel):
         """ Miscellaneous config definitions. """
 
-        cache_dir: str | None = None
+        cache_dir:       str | None = None
+        # Global download bandwidth cap in bytes per second, shared by all downloads. Unlimited if unset.
+        bandwidth_limit: int | None = None
+        # Maximum number of concurrent download connections across all downloads. Unlimited if unset.
+        max_connections: int | None = None
+        # File to write a summary of run metrics to at exit. Written in the Prometheus textfile format if the
+        # file has a `.prom` extension, otherwise as JSON. No metrics are written if unset.
+        metrics_file:    str | None = None
 
     comics: Comics | None = None
+    daemon: Daemon = Daemon()
     e621:   E621 | None = None
     misc:   Misc = Misc()
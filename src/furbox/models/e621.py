@@ -3,7 +3,7 @@ import itertools
 from copy import deepcopy
 from datetime import datetime
 from enum import IntEnum, StrEnum
-from typing import Any, Self
+from typing import Any, NamedTuple, Self
 
 from fluffless.models.base_model import BaseModel
 from fluffless.utils import logging
@@ -19,6 +19,9 @@ META_ARTISTS = (
     "unknown_artist",
 )
 
+# Extensions of animated and video posts, whose samples and previews are only still images of a single frame.
+ANIMATED_EXTENSIONS = ("gif", "webm", "mp4", "swf")
+
 
 def source_url_from_hash(md5_hash: str, extension: str) -> str:
     """ Get a post source url from an MD5 hash.
@@ -45,6 +48,22 @@ class Post(BaseModel):
         QUESTIONABLE = "q"
         EXPLICIT = "e"
 
+    class Quality(StrEnum):
+        """ Quality tier to download a post at, from the original file down to a small preview image. """
+
+        ORIGINAL = "original"
+        SAMPLE = "sample"
+        PREVIEW = "preview"
+
+    class SelectedFile(NamedTuple):
+        """ Named tuple of the file to download for a post at a quality tier. """
+
+        quality: "Post.Quality"
+        url:     str
+        ext:     str
+        # Size in bytes, only known for original files.
+        size:    int | None
+
     class FileInfo(BaseModel):
         """ File information associated with a post. """
 
@@ -55,6 +74,14 @@ class Post(BaseModel):
         md5:    str
         url:    str
 
+    class ScaledFile(BaseModel):
+        """ Scaled down copy of a post file, as provided for samples and previews. """
+
+        width:  int
+        height: int
+        # Unset if the file is unavailable, such as for deleted posts.
+        url:    str | None = None
+
     class Flags(BaseModel):
         """ Post status flags. """
 
@@ -121,6 +148,9 @@ class Post(BaseModel):
     sources:       list[str] = []
     pools:         list[int] = []
     file_info:     FileInfo
+    # Sample and preview files, only known for posts from the API. Posts without a sample have no sample file.
+    sample:        ScaledFile | None = None
+    preview:       ScaledFile | None = None
     flags:         Flags
     relationships: Relationships
     score:         Score
@@ -145,8 +175,14 @@ class Post(BaseModel):
         data["score"] = stats["score"]
         data |= stats
 
+        # Keep only the sample and preview fields shared by both, where posts without a sample have none.
+        sample = data.pop("sample", None) or {}
+        data["sample"] = {key: sample[key] for key in ("width", "height", "url")} if sample.get("has") else None
+        if preview := data.pop("preview", None):
+            data["preview"] = {key: preview[key] for key in ("width", "height", "url")}
+
         # Explicitly drop some API data which is not parsed to a post model.
-        for key in ("preview", "sample", "locked_tags", "has_notes"):
+        for key in ("locked_tags", "has_notes"):
             data.pop(key, None)
 
         return cls(**data)
@@ -202,6 +238,30 @@ class Post(BaseModel):
             tags=cls.Tags(database=all_tags),
         )
 
+    def select_file(self, quality: Quality) -> SelectedFile:
+        """ Get the file to download for the post at a quality tier.
+
+        Falls back to the next higher quality tier if the post has no file at the requested tier, such as for
+        posts too small to have a sample, or posts from a database dump which only describes original files.
+        Animated and video posts always use their original file, as their samples and previews are still images.
+
+        Args:
+            quality (Post.Quality): Quality tier to download the post at.
+
+        Returns:
+            Post.SelectedFile: File to download, and the quality tier it was selected at.
+        """
+        if self.file_info.ext in ANIMATED_EXTENSIONS:
+            quality = self.Quality.ORIGINAL
+
+        tiers = list(self.Quality)
+        for tier in tiers[tiers.index(quality):0:-1]:
+            scaled_file = self.sample if tier == self.Quality.SAMPLE else self.preview
+            if scaled_file and scaled_file.url:
+                return self.SelectedFile(tier, scaled_file.url, scaled_file.url.rpartition(".")[2], None)
+
+        return self.SelectedFile(self.Quality.ORIGINAL, self.file_info.url, self.file_info.ext, self.file_info.size)
+
 
 class Pool(BaseModel):
     """ Dataclass representation of an e621 pool. """
@@ -0,0 +1,51 @@
+""" Model definitions for local mirrors of e621 search queries. """
+from pathlib import Path
+from typing import ClassVar, Self
+
+from fluffless.models.base_model import BaseModel
+
+
+class SearchMirror(BaseModel):
+    """ Posts of an e621 search query which are mirrored locally, kept within the download directory. """
+
+    FILE_NAME: ClassVar[str] = ".furbox-mirror.json"
+
+    # Search query mirrored to the directory.
+    query:          str
+    # Highest post ID of the query known to be mirrored, such that later runs only search for newer posts.
+    max_post_id:    int = 0
+    # Posts of the query which are stored locally, in ascending order.
+    post_ids:       list[int] = []
+    # Highest post ID checked for removal from the query by the last run, where the next check continues from.
+    removal_cursor: int = 0
+
+    @classmethod
+    def load(cls, directory: Path) -> Self | None:
+        """ Load the mirror stored in a download directory, or None if it does not exist. """
+        mirror_path = directory / cls.FILE_NAME
+        if not mirror_path.exists():
+            return None
+
+        return cls.model_validate_json(mirror_path.read_text(encoding="utf-8"))
+
+    def save(self, directory: Path) -> None:
+        """ Save the mirror to a download directory. """
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_mirror_path = directory / f"_{self.FILE_NAME}"
+        tmp_mirror_path.write_text(self.model_dump_json(indent=4), encoding="utf-8")
+        tmp_mirror_path.replace(directory / self.FILE_NAME)
+
+    def next_removal_check(self, count: int) -> list[int]:
+        """ Get the next posts to check for removal from the query, continuing from the last check and wrapping.
+
+        Args:
+            count (int): Maximum number of posts to check.
+
+        Returns:
+            list[int]: Post IDs to check, in the order they are checked. The last is where the next check continues.
+        """
+        post_ids = [post_id for post_id in self.post_ids if post_id > self.removal_cursor][:count]
+        if len(post_ids) < count:
+            post_ids += [post_id for post_id in self.post_ids if post_id <= self.removal_cursor][:count - len(post_ids)]
+
+        return post_ids
@@ -0,0 +1,125 @@
+""" Registry of runners, declaring the command and help string of each runner without importing it.
+
+Only the runner selected on the command line is imported, along with its dependencies. Every other runner is
+registered with a placeholder parser built from the registry, such that help output still lists all runners.
+
+Example usage of the runner registry: ::
+
+    # Within a runner module, create the parser for a command declared in `RUNNERS`.
+    PARSER = add_parser("e621 fav-sync")
+
+    # Before parsing arguments, import only the runner they select.
+    import_runners(sys.argv[1:])
+    args = cli.parse_args(sys.argv[1:])
+"""
+import argparse
+import importlib
+from typing import NamedTuple
+
+from fluffless.utils import cli
+
+
+class Runner(NamedTuple):
+    """ Named tuple of the command used to invoke a runner, the module defining it, and its help string. """
+
+    command:  str
+    module:   str
+    help:     str
+    # Runner groups have no entrypoint of their own, only subcommands.
+    is_leaf:  bool = True
+    # Commands of other runners which the runner imports, and so must never be registered as placeholders.
+    requires: tuple[str, ...] = ()
+
+    @property
+    def parent(self) -> str:
+        """ Command of the runner group containing the runner, or an empty string for the root. """
+        return self.command.rpartition(" ")[0]
+
+    @property
+    def name(self) -> str:
+        """ Name of the runner within its runner group. """
+        return self.command.rpartition(" ")[2]
+
+
+# All runners, keyed on command and in the order they are listed in help output.
+RUNNERS: dict[str, Runner] = {runner.command: runner for runner in [
+    Runner("comics-update", "furbox.runners.comics", "Update local comic files."),
+    Runner("daemon", "furbox.runners.daemon", "Run fav-sync and comics-update on a schedule, with warm connectors.",
+           requires=("comics-update", "e621 fav-sync")),
+    Runner("e621", "furbox.runners.e621", "Collection of e621 related runners.", is_leaf=False),
+    Runner("e621 download", "furbox.runners.e621.download", "Download posts from an e621 query or pool."),
+    Runner("e621 fav-sync", "furbox.runners.e621.fav_sync", "Synchronise upstream e621 favourites with local files."),
+    Runner("watch", "furbox.runners.watch", "Watch library directories, allowing scans to only revisit changes."),
+]}
+
+_group_subparsers: dict[str, argparse._SubParsersAction] = {}
+
+
+def group_subparsers(command: str) -> argparse._SubParsersAction | None:
+    """ Get the subparsers of a runner group, creating the group parser the first time it is requested.
+
+    Args:
+        command (str): Command of the runner group, or an empty string for the root parser.
+
+    Returns:
+        argparse._SubParsersAction | None: Subparsers of the runner group, or None for the root subparsers.
+    """
+    if not command:
+        return None
+
+    if command not in _group_subparsers:
+        group = RUNNERS[command]
+        parser = cli.add_parser(group.name, subparsers=group_subparsers(group.parent), is_leaf=False, help=group.help)
+        _group_subparsers[command] = parser.add_subparsers(required=True)
+
+    return _group_subparsers[command]
+
+
+def add_parser(command: str) -> argparse.ArgumentParser:
+    """ Create the parser for a runner declared in `RUNNERS`, within its runner group. """
+    runner = RUNNERS[command]
+    return cli.add_parser(runner.name, subparsers=group_subparsers(runner.parent), help=runner.help)
+
+
+def select_runner(argv: list[str]) -> Runner | None:
+    """ Find the runner selected by command line arguments, without parsing them.
+
+    Args:
+        argv (list[str]): Command line arguments, excluding the program name.
+
+    Returns:
+        Runner | None: The selected runner, or None if no runner was selected, such as for help output.
+    """
+    command = ""
+    for arg in argv:
+        if arg.startswith("-"):
+            continue
+
+        if (candidate := f"{command} {arg}".strip()) not in RUNNERS:
+            return None
+
+        command = candidate
+        if RUNNERS[command].is_leaf:
+            return RUNNERS[command]
+
+    return None
+
+
+def import_runners(argv: list[str]) -> None:
+    """ Import the runner selected by command line arguments, and register placeholders for every other runner.
+
+    Placeholder parsers are never invoked, as any runner selected on the command line is imported instead.
+    Runners are registered in the order they are declared, such that help output is consistent.
+
+    Args:
+        argv (list[str]): Command line arguments, excluding the program name.
+    """
+    selected = {selected.command, *selected.requires} if (selected := select_runner(argv)) else set()
+    for runner in RUNNERS.values():
+        if not runner.is_leaf:
+            continue
+
+        if runner.command in selected:
+            importlib.import_module(runner.module)
+        else:
+            add_parser(runner.command)
@@ -5,9 +5,14 @@ from enum import auto, StrEnum
 
 from fluffless.utils import cli
 
+from furbox.connectors.e621 import E621Connector, E621DbConnector
+from furbox.helpers.comic.custom import custom_comic_update
 from furbox.helpers.comic.e621 import update_e621_comics
 from furbox.models.comic import Comics
 from furbox.models.config import Config
+from furbox.models.e621 import Post
+from furbox.runners import add_parser
+from furbox.utils.profiling import profiler
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +21,7 @@ class ComicTypes(StrEnum):
     """ String enum of all supported comic types for the synchronisation runner. """
 
     E621 = auto()
+    CUSTOM = auto()
 
     @classmethod
     def all_types(cls) -> list[str]:
@@ -23,23 +29,61 @@ class ComicTypes(StrEnum):
         return [str(comic.value) for comic in cls]
 
 
-PARSER = cli.add_parser(name="comics-update", help="Update local comic files.")
+PARSER = add_parser("comics-update")
 PARSER.add_argument("comic_type", nargs="*", type=ComicTypes, choices=ComicTypes.all_types(),
                     help=(f"Types of comic to update. All types will be downloaded if not specified. "
                           f"Allowed comic types are '{'\', \''.join(ComicTypes.all_types())}'."))
 PARSER.add_argument("--use-db", action="store_true", help="Fetch e621 pool data from a database dump.")
 PARSER.add_argument("--dry-run", action="store_true", help="Preview updates without modifying files.")
+PARSER.add_argument("--full", action="store_true", help="Check every comic, even if its pool is unchanged.")
+PARSER.add_argument("--quality", type=Post.Quality, choices=list(Post.Quality),
+                    help="Quality tier to download new e621 pages at, unless overridden in config for a comic, "
+                         "comic path or rating. Defaults to the `e621.quality` config setting.")
 
 
 @cli.entrypoint(parser=PARSER)
 def comics_update(args: argparse.Namespace, config: Config) -> int | None:
     """ Update comics on disk based on config definitions. """
+    return update_comics(
+        config=config,
+        comic_types=args.comic_type,
+        use_db=args.use_db,
+        dry_run=args.dry_run,
+        full=args.full,
+        quality=args.quality,
+    )
+
+
+def update_comics(
+    config: Config, comic_types: list[ComicTypes] | None = None, use_db: bool = False, dry_run: bool = False,
+    *, full: bool = False, e621_connector: E621Connector | None = None, db_connector: E621DbConnector | None = None,
+    quality: Post.Quality | None = None,
+) -> int | None:
+    """ Update comics on disk based on config definitions.
+
+    Args:
+        config (Config): Application config.
+        comic_types (list[ComicTypes] | None, optional): Types of comic to update. \
+                                                         Defaults to None, where all types are updated.
+        use_db (bool, optional): Fetch e621 pool data from a database dump. Defaults to False.
+        dry_run (bool, optional): Preview updates without modifying files. Defaults to False.
+        full (bool, optional): Check every comic, even if its pool is unchanged. Defaults to False.
+        e621_connector (E621Connector | None, optional): Connector to reuse for e621 requests. \
+                                                         Defaults to None, where a new connector is created.
+        db_connector (E621DbConnector | None, optional): Connector to reuse for database dumps. \
+                                                         Defaults to None, where a new connector is created.
+        quality (Post.Quality | None, optional): Quality tier to download new e621 pages at, where not overridden \
+                                                 in config. Defaults to None, where the config setting is used.
+
+    Returns:
+        int | None: Exit code, or None if the update ran.
+    """
     if config.comics is None:
         logger.error("Config requires `comics` to be defined to use comic update utility")
         return 1
 
     # If no argument was provided for comic types, enable all of them.
-    enabled_categories = args.comic_type or ComicTypes.all_types()
+    enabled_categories = comic_types or ComicTypes.all_types()
 
     comic_base_path = config.comics.base_path
     comic_db_yaml_path = comic_base_path / config.comics.database_file
@@ -50,11 +94,24 @@ def comics_update(args: argparse.Namespace, config: Config) -> int | None:
     comics = Comics.load_from_yaml(comic_db_yaml_path)
 
     if comics.e621 and ComicTypes.E621 in enabled_categories:
-        update_e621_comics(
-            config=config,
-            e621_comics=comics.e621,
-            use_db=args.use_db,
-            dry_run=args.dry_run,
-        )
+        with profiler.span("e621 comics"):
+            update_e621_comics(
+                config=config,
+                e621_comics=comics.e621,
+                use_db=use_db,
+                dry_run=dry_run,
+                full=full,
+                e621_connector=e621_connector,
+                db_connector=db_connector,
+                quality=quality,
+            )
+
+    if comics.custom and ComicTypes.CUSTOM in enabled_categories:
+        for custom_comic in sorted(comics.custom, key=lambda comic: comic.name):
+            try:
+                with profiler.span("custom comics"):
+                    custom_comic_update(custom_comic=custom_comic, comic_path=comic_base_path, dry_run=dry_run)
+            except Exception:
+                logger.exception(f"Could not update {custom_comic.name}")
 
     return None
@@ -0,0 +1,303 @@
+""" Runner to keep connectors warm in a long running process, running other runners on a schedule.
+
+Runners scheduled in config are run one at a time in the main thread, sharing e621 connectors such that HTTP
+connections and parsed database dumps are reused between runs. A local control socket accepts one command per
+line, and replies to each with a line of JSON:
+
+    status         Show each job, and when it last ran and will next run.
+    run <job>      Queue a job to run as soon as the current job finishes.
+    stop           Stop the daemon once the current job finishes.
+
+Any runner which may be scheduled may also be triggered by its runner name, even if it has no schedule.
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+from types import FrameType
+from typing import Any, cast
+
+from fluffless.utils import cli, logging
+
+from furbox.connectors.cache import Cache
+from furbox.connectors.e621 import E621Connector, E621DbConnector
+from furbox.models.config import Config
+from furbox.runners import add_parser, comics
+from furbox.runners.e621 import fav_sync
+
+logger = logging.getLogger(__name__)
+
+PARSER = add_parser("daemon")
+_COMMANDS = PARSER.add_mutually_exclusive_group()
+_COMMANDS.add_argument("--run", metavar="JOB", help="Trigger a job in the running daemon, instead of starting one.")
+_COMMANDS.add_argument("--status", action="store_true", help="Show the status of the running daemon.")
+_COMMANDS.add_argument("--stop", action="store_true", help="Stop the running daemon once its current job finishes.")
+
+ScheduledRunner = Config.Daemon.Schedule.Runner
+
+
+@cli.entrypoint(PARSER)
+def daemon(args: argparse.Namespace, config: Config) -> int | None:
+    """ Run scheduled runners until stopped, or send a command to a running daemon. """
+    socket_path = get_socket_path(config)
+
+    if command := ("status" if args.status else "stop" if args.stop else f"run {args.run}" if args.run else None):
+        try:
+            response = send_command(socket_path, command)
+        except OSError as e:
+            logger.error(f"Could not connect to the daemon at '{socket_path}': {e}")  # noqa: TRY400
+            return 1
+
+        logger.print(json.dumps(response, indent=4))
+        return 1 if "error" in response else None
+
+    try:
+        controller = DaemonController(config)
+    except SystemExit:
+        logger.error("Config `daemon.schedules` contains invalid runner arguments")  # noqa: TRY400
+        return 1
+
+    return controller.serve(socket_path)
+
+
+def get_socket_path(config: Config) -> Path:
+    """ Get the path of the control socket, from config or otherwise in the cache directory. """
+    if config.daemon.socket_path:
+        return Path(config.daemon.socket_path).expanduser()
+
+    return Cache(config.misc.cache_dir or None).resolve_path("daemon.sock")
+
+
+def send_command(socket_path: Path, command: str) -> dict[str, Any]:
+    """ Send a command to a running daemon, and return its response. """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socket_path))
+        client.sendall(f"{command}\n".encode())
+        with client.makefile("r", encoding="utf-8") as response:
+            return json.loads(response.readline())
+
+
+class Job:
+    """ Runner to run within the daemon, either periodically or only when triggered.
+
+    Args:
+        name (str): Name to trigger the job by.
+        runner (ScheduledRunner): Runner to run.
+        args (argparse.Namespace): Parsed command line arguments for the runner.
+        interval (int | None): Seconds between the start of each run, or None if only run when triggered.
+    """
+
+    def __init__(self, name: str, runner: ScheduledRunner, args: argparse.Namespace, interval: int | None) -> None:
+        self.name = name
+        self.runner = runner
+        self.args = args
+        self.interval = interval
+
+        # Scheduled jobs first run as soon as the daemon starts.
+        self.next_run: float | None = time.time() if interval else None
+        self.last_started: float | None = None
+        self.last_finished: float | None = None
+        self.last_result: str | None = None
+
+    def status(self) -> dict[str, Any]:
+        """ Summarise the state of the job. """
+        return {
+            "name": self.name,
+            "runner": self.runner,
+            "interval": self.interval,
+            "next_run": self.next_run,
+            "last_started": self.last_started,
+            "last_finished": self.last_finished,
+            "last_result": self.last_result,
+        }
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    """ Unix socket server, handing each line received to the daemon controller. """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, controller: "DaemonController") -> None:
+        self.controller = controller
+        super().__init__(str(socket_path), ControlHandler)
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """ Handler for a control socket connection, replying to each command with a line of JSON. """
+
+    def handle(self) -> None:
+        """ Handle every command sent over the connection. """
+        controller = cast(ControlServer, self.server).controller
+        for line in self.rfile:
+            response = controller.handle_command(line.decode("utf-8", errors="replace").strip())
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class DaemonController:
+    """ Owner of the warm connectors and jobs of the daemon, running jobs one at a time as they fall due.
+
+    Args:
+        config (Config): Application config, loaded once for the lifetime of the daemon.
+
+    Raises:
+        SystemExit: Arguments of a scheduled runner were invalid.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.e621_connector = E621Connector(
+            username=config.e621.username,
+            api_key=config.e621.api_key,
+        ) if config.e621 else None
+        self.db_connector = E621DbConnector(config.misc.cache_dir or None, keep_parsed=True)
+
+        # Scheduled jobs, followed by a job to trigger each runner by name if not already taken by a schedule.
+        self.jobs: dict[str, Job] = {}
+        for schedule in config.daemon.schedules:
+            name = schedule.name or schedule.runner
+            self.jobs[name] = Job(name, schedule.runner, self.parse_args(schedule.runner, schedule.args),
+                                  interval=schedule.interval * 60)
+        for runner in ScheduledRunner:
+            self.jobs.setdefault(runner, Job(runner, runner, self.parse_args(runner, []), interval=None))
+
+        # Names of jobs triggered through the control socket, or None to stop the daemon.
+        self.triggered: queue.Queue[str | None] = queue.Queue()
+        self.running: str | None = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse_args(runner: ScheduledRunner, args: list[str]) -> argparse.Namespace:
+        """ Parse command line arguments for a runner, exiting if they are invalid. """
+        parser = fav_sync.PARSER if runner == ScheduledRunner.FAV_SYNC else comics.PARSER
+        return parser.parse_args(args)
+
+    def handle_command(self, command: str) -> dict[str, Any]:
+        """ Handle a command received through the control socket, returning the response to send. """
+        match command.split():
+            case ["status"]:
+                with self.lock:
+                    return {"running": self.running, "jobs": [job.status() for job in self.jobs.values()]}
+            case ["run", name] if name in self.jobs:
+                self.triggered.put(name)
+                return {"queued": name}
+            case ["run", name]:
+                return {"error": f"Unknown job '{name}', expected one of: {', '.join(self.jobs)}"}
+            case ["stop"]:
+                self.triggered.put(None)
+                return {"stopping": True}
+            case _:
+                return {"error": f"Unknown command '{command}', expected 'status', 'run <job>' or 'stop'"}
+
+    def run_job(self, job: Job) -> None:
+        """ Run a job, logging rather than raising any exception such that the daemon keeps running. """
+        with self.lock:
+            self.running = job.name
+            job.last_started = time.time()
+            if job.interval:
+                job.next_run = job.last_started + job.interval
+
+        logger.print(f"Running job '{job.name}'")
+        try:
+            if job.runner == ScheduledRunner.FAV_SYNC:
+                exit_code = fav_sync.sync_favourites(
+                    config=self.config,
+                    dry_run=job.args.dry_run,
+                    e621_connector=self.e621_connector,
+                    quality=job.args.quality,
+                )
+            else:
+                exit_code = comics.update_comics(
+                    config=self.config,
+                    comic_types=job.args.comic_type,
+                    use_db=job.args.use_db,
+                    dry_run=job.args.dry_run,
+                    full=job.args.full,
+                    e621_connector=self.e621_connector,
+                    db_connector=self.db_connector,
+                    quality=job.args.quality,
+                )
+            result = "succeeded" if not exit_code else f"exited with code {exit_code}"
+        except Exception as e:
+            logger.exception(f"Job '{job.name}' failed")
+            result = f"failed: {e}"
+
+        with self.lock:
+            self.running = None
+            job.last_finished = time.time()
+            job.last_result = result
+
+        logger.print(f"Job '{job.name}' {result}")
+
+    def next_due(self) -> Job | None:
+        """ Get the scheduled job which is due to run soonest, if any jobs are scheduled. """
+        scheduled = {job: job.next_run for job in self.jobs.values() if job.next_run is not None}
+        return min(scheduled, key=scheduled.__getitem__, default=None)
+
+    def serve(self, socket_path: Path) -> int | None:
+        """ Run jobs as they fall due or are triggered, until stopped through the control socket or a signal.
+
+        Args:
+            socket_path (Path): Path to listen for control commands on.
+
+        Returns:
+            int | None: Exit code, or None if the daemon stopped cleanly.
+        """
+        # Remove a socket left behind by a daemon which did not stop cleanly, unless it is still running.
+        if socket_path.exists():
+            try:
+                send_command(socket_path, "status")
+            except OSError:
+                socket_path.unlink()
+            else:
+                logger.error(f"A daemon is already listening on '{socket_path}'")
+                return 1
+
+        # Stop on SIGTERM as if interrupted, such that the socket is always cleaned up.
+        def terminate(signum: int, frame: FrameType | None) -> None:  # noqa: ARG001
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, terminate)
+
+        # Create the socket with permissions for the current user only, as it accepts commands without checks.
+        socket_path.parent.mkdir(parents=True, exist_ok=True)
+        umask = os.umask(0o077)
+        try:
+            server = ControlServer(socket_path, self)
+        finally:
+            os.umask(umask)
+
+        with server:
+            threading.Thread(target=server.serve_forever, name="daemon-control", daemon=True).start()
+            logger.print(f"Daemon listening on '{socket_path}', with {len(self.config.daemon.schedules)} schedules")
+
+            try:
+                while True:
+                    # Wait for a trigger until the next scheduled job is due, then run whichever came first.
+                    job = self.next_due()
+                    next_run = job.next_run if job else None
+                    timeout = max(next_run - time.time(), 0) if next_run is not None else None
+                    try:
+                        name = self.triggered.get(timeout=timeout)
+                    except queue.Empty:
+                        name = job.name if job else None
+
+                    if name is None:
+                        break
+
+                    self.run_job(self.jobs[name])
+
+            except KeyboardInterrupt:
+                pass
+
+            finally:
+                server.shutdown()
+                socket_path.unlink(missing_ok=True)
+
+        logger.print("Daemon stopped")
+        return None
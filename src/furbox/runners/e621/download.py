@@ -1,24 +1,36 @@
 """ Download a search query or pool from e621. """
 import argparse
 import itertools
-import logging
+import queue
+import threading
 from collections import Counter
+from collections.abc import Callable, Iterator
 from pathlib import Path
-from typing import cast
+from typing import cast, NamedTuple
 
-from fluffless.utils import cli
+from fluffless.utils import cli, logging
 from rich.prompt import Confirm, Prompt
 
-from furbox.connectors.downloader import download_files, get_numbered_file_names, UrlFileTarget
-from furbox.connectors.e621 import E621Connector
+from furbox.connectors.downloader import (
+    download_file_batches,
+    download_files,
+    DownloadResult,
+    get_numbered_file_names,
+    UrlFileTarget,
+)
+from furbox.connectors.e621 import E621Connector, E621DbConnector
+from furbox.connectors.search_index import parse_query, SearchIndex
+from furbox.helpers.utils import ExecutionReport
 from furbox.models.config import Config
 from furbox.models.e621 import Pool, Post
-from furbox.runners.e621 import _SUBPARSERS
+from furbox.models.mirror import SearchMirror
+from furbox.runners import add_parser
+from furbox.utils.profiling import profiler
 
 logger = logging.getLogger(__name__)
 
 
-PARSER = cli.add_parser("download", subparsers=_SUBPARSERS, help="Download posts from an e621 query or pool.")
+PARSER = add_parser("e621 download")
 PARSER.add_argument("search_query", help="Search query to download posts from.")
 PARSER.add_argument(
     "--pool",
@@ -35,6 +47,33 @@ PARSER.add_argument(
     type=int,
     help="Skip the first N posts returned by the query. Only applies to non-pool downloads.",
 )
+PARSER.add_argument(
+    "--mirror",
+    action="store_true",
+    help="Keep the download directory in sync with the query, only fetching posts newer than the last run. "
+         "Posts removed from the query are moved aside.",
+)
+PARSER.add_argument(
+    "--check-removed",
+    action="store_true",
+    help="Check every mirrored post for removal from the query, rather than only the next batch of posts.",
+)
+PARSER.add_argument(
+    "--offline",
+    action="store_true",
+    help="Resolve the query against a local index of the posts database dump, only fetching the files themselves. "
+         "Does not apply to pool downloads, and always downloads original files.",
+)
+PARSER.add_argument(
+    "--quality",
+    type=Post.Quality,
+    choices=list(Post.Quality),
+    help="Quality tier to download posts at, unless overridden in config for the download directory or rating. "
+         "Defaults to the `e621.quality` config setting.",
+)
+
+# Number of mirrored posts to check for removal from the query per request.
+REMOVAL_CHECK_SIZE = 100
 
 
 @cli.entrypoint(PARSER)
@@ -44,24 +83,42 @@ def download(args: argparse.Namespace, config: Config) -> int | None:
     pool_mode = cast(bool, args.pool)
     post_limit = cast(int | None, args.limit)
     post_offset = cast(int | None, args.offset)
+    mirror_mode = cast(bool, args.mirror)
+    quality = cast(Post.Quality | None, args.quality)
 
-    if config.e621 is None:
-        logger.error("Config requires `e621` to be defined to use comic update utility")
+    if error := argument_error(args):
+        logger.error(error)
         return 1
 
-    e621_connector = E621Connector(
-        username=config.e621.username,
-        api_key=config.e621.api_key,
-    )
+    # Offline searches are resolved against the search index, which requires no credentials.
+    source: E621Connector | SearchIndex
+    if args.offline:
+        try:
+            parse_query(search_query)
+        except ValueError as e:
+            logger.error(f"Search query cannot be resolved offline: {e}")  # noqa: TRY400
+            return 1
+
+        with profiler.span("load search index"):
+            source = SearchIndex.load_or_build(E621DbConnector(config.misc.cache_dir or None))
+    elif config.e621 is None:
+        logger.error("Config requires `e621` to be defined to use comic update utility")
+        return 1
+    else:
+        source = E621Connector(
+            username=config.e621.username,
+            api_key=config.e621.api_key,
+        )
 
     # For a purely numeric search term, confirm if the user did not supply the pool flag.
-    if search_query.isnumeric() and not pool_mode:
+    if search_query.isnumeric() and not pool_mode and not mirror_mode and not args.offline:
         pool_mode = Confirm("Search term is numeric but pool flag not provided, download as a pool?")
 
-    if pool_mode:
+    if pool_mode and isinstance(source, E621Connector):
         # Fetch pool information from the pools endpoint, and posts information using the general search.
-        pool = Pool.from_api(e621_connector.get_pool(search_query))
-        posts = [Post.from_api(post) for post in e621_connector.get_posts(f"pool:{search_query}")]
+        with profiler.span("fetch posts"):
+            pool = Pool.from_api(source.get_pool(search_query))
+            posts = [Post.from_api(post) for post in source.get_posts(f"pool:{search_query}")]
         posts = sorted(posts, key=lambda x: pool.post_ids.index(x.post_id))
 
         # Prompt the user for the title of the pool, defaulting to the name defined by the pool.
@@ -73,10 +130,14 @@ def download(args: argparse.Namespace, config: Config) -> int | None:
         artist = Prompt.ask("Artist", default=artist)
 
         # Generate download URLs and associated file name pairs.
+        download_directory = Path.cwd() / f"{artist} - {title}"
+        post_quality = quality_resolver(config, download_directory, quality)
+        selected_files = [post.select_file(post_quality(post)) for post in posts]
         file_targets = get_numbered_file_names(
-            download_urls=[post.file_info.url for post in posts],
-            download_directory=Path.cwd() / f"{artist} - {title}",
+            download_urls=[selected_file.url for selected_file in selected_files],
+            download_directory=download_directory,
             name=title,
+            sizes=[selected_file.size for selected_file in selected_files],
         )
 
         download_files(file_targets=file_targets, description=f"Downloading {title}")
@@ -86,24 +147,309 @@ def download(args: argparse.Namespace, config: Config) -> int | None:
             default="".join([c if c.isalpha() else "_" for c in search_query]),
         )
 
-        # Fetch pool information from the pools endpoint, and posts information using the general search.
-        posts = [
-            Post.from_api(post) for post in
-            e621_connector.get_posts(
-                search=search_query,
-                offset=post_offset,
-                limit=post_limit,
+        download_directory = Path.cwd() / download_dir
+        if mirror_mode:
+            return mirror_search(
+                source=source,
+                search_query=search_query,
+                download_directory=download_directory,
+                check_all_removed=args.check_removed,
+                quality=quality_resolver(config, download_directory, quality),
             )
-        ]
 
-        # Generate download URLs and associated file name pairs.
-        file_targets = [UrlFileTarget(
-            url=post.file_info.url,
-            file_name=str(post.post_id),
-            download_directory=Path.cwd() / download_dir,
-            extension=post.file_info.ext,
-        ) for post in posts]
+        return download_search(
+            source=source,
+            search_query=search_query,
+            download_directory=download_directory,
+            offset=post_offset,
+            limit=post_limit,
+            quality=quality_resolver(config, download_directory, quality),
+        )
+
+    return None
+
+
+def argument_error(args: argparse.Namespace) -> str | None:
+    """ Check for arguments which cannot be used together, returning a description of the first conflict found. """
+    if args.mirror and (args.pool or args.limit or args.offset):
+        return "Mirror mode cannot be used with `--pool`, `--limit` or `--offset`, as it mirrors a whole query"
+
+    if args.check_removed and not args.mirror:
+        return "Checking for removed posts requires `--mirror`"
+
+    if args.offline and args.pool:
+        return "Offline mode cannot be used with `--pool`, as pools are not held in the search index"
 
-        download_files(file_targets=file_targets, description=f"Downloading '{search_query[:60]}'")
+    if args.offline and args.quality not in {None, Post.Quality.ORIGINAL}:
+        return "Offline mode only downloads original files, as the search index holds no samples or previews"
 
     return None
+
+
+def quality_resolver(
+    config: Config, download_directory: Path, default: Post.Quality | None,
+) -> Callable[[Post], Post.Quality]:
+    """ Get a function resolving the quality tier to download each post to a directory at.
+
+    Args:
+        config (Config): Application config, which may override quality tiers by directory and rating.
+        download_directory (Path): Directory posts are downloaded to.
+        default (Post.Quality | None): Quality tier from the command line, used where not overridden in config.
+
+    Returns:
+        Callable[[Post], Post.Quality]: Function resolving the quality tier of a post.
+    """
+    if (e621_config := config.e621) is None:
+        return lambda post: default or Post.Quality.ORIGINAL  # noqa: ARG005
+
+    return lambda post: e621_config.quality_for(download_directory, post.rating, default=default)
+
+
+class SearchDownload(NamedTuple):
+    """ Named tuple of the outcome of downloading a search query. """
+
+    report:           ExecutionReport[UrlFileTarget, DownloadResult]
+    # Every post returned by the search, including posts which were skipped.
+    listed_post_ids:  list[int]
+    # Posts which were not downloaded, as they were already present locally.
+    skipped_post_ids: list[int]
+    # False if listing stopped early due to an error, such that not every post of the search was listed.
+    listing_complete: bool
+
+
+def download_search(
+    source: E621Connector | SearchIndex, search_query: str, download_directory: Path,
+    offset: int | None = None, limit: int | None = None, *, quality: Callable[[Post], Post.Quality] | None = None,
+) -> int | None:
+    """ Download every post matching a search query, downloading each page of results while later pages are fetched.
+
+    Args:
+        source (E621Connector | SearchIndex): E621 connector to search with, or search index to search offline.
+        search_query (str): Search query to download posts from.
+        download_directory (Path): Directory to download posts to.
+        offset (int | None, optional): Number of posts to skip. Defaults to None, where no posts are skipped.
+        limit (int | None, optional): Maximum number of posts to download. Defaults to None, where all posts \
+                                      are downloaded.
+        quality (Callable[[Post], Post.Quality] | None, optional): Get the quality tier to download each post at. \
+                                                                   Defaults to None, where original files are \
+                                                                   downloaded.
+
+    Returns:
+        int | None: Exit code, or None if every page of results was listed.
+    """
+    result = stream_search(source, search_query, download_directory, offset=offset, limit=limit, quality=quality)
+    return None if result.listing_complete else 1
+
+
+def stream_search(
+    source: E621Connector | SearchIndex, search_query: str, download_directory: Path,
+    offset: int | None = None, limit: int | None = None, *, skip_post_ids: set[int] | None = None,
+    quality: Callable[[Post], Post.Quality] | None = None,
+) -> SearchDownload:
+    """ Download the posts of a search, handing each page of results to the download workers as it arrives.
+
+    Posts are listed in a background thread subject to the API rate limit, such that the total time approaches
+    the larger of the listing time and the download time rather than their sum.
+
+    Args:
+        source (E621Connector | SearchIndex): E621 connector to search with, or search index to search offline.
+        search_query (str): Search query to download posts from.
+        download_directory (Path): Directory to download posts to.
+        offset (int | None, optional): Number of posts to skip. Defaults to None, where no posts are skipped.
+        limit (int | None, optional): Maximum number of posts to download. Defaults to None, where all posts \
+                                      are downloaded.
+        skip_post_ids (set[int] | None, optional): Posts not to download, as they are already present. \
+                                                   Defaults to None, where only posts with an existing file \
+                                                   of the same name are skipped.
+        quality (Callable[[Post], Post.Quality] | None, optional): Get the quality tier to download each post at. \
+                                                                   Defaults to None, where original files are \
+                                                                   downloaded.
+
+    Returns:
+        SearchDownload: Outcome of the downloads, and the posts listed.
+    """
+    target_batches: queue.Queue[list[UrlFileTarget] | None] = queue.Queue()
+    listed_post_ids: list[int] = []
+    skipped_post_ids: list[int] = []
+    listing_failed = threading.Event()
+
+    def list_posts() -> None:
+        """ Convert each page of search results into file targets, terminated by None once listing ends. """
+        try:
+            with profiler.span("fetch posts"):
+                for page in iter_search_targets(
+                    source, search_query, download_directory, offset, limit, quality=quality,
+                ):
+                    file_targets = []
+                    for target in page:
+                        post_id = int(target.file_name)
+                        listed_post_ids.append(post_id)
+                        if post_id in (skip_post_ids or ()) or target.output_path.exists():
+                            skipped_post_ids.append(post_id)
+                        else:
+                            file_targets.append(target)
+
+                    target_batches.put(file_targets)
+        except Exception:
+            logger.exception(f"Could not fetch all posts for '{search_query}'")
+            listing_failed.set()
+        finally:
+            target_batches.put(None)
+
+    threading.Thread(target=list_posts, name="post-lister", daemon=True).start()
+    report = download_file_batches(iter(target_batches.get, None), description=f"Downloading '{search_query[:60]}'")
+
+    return SearchDownload(
+        report=report,
+        listed_post_ids=listed_post_ids,
+        skipped_post_ids=skipped_post_ids,
+        listing_complete=not listing_failed.is_set(),
+    )
+
+
+def mirror_search(
+    source: E621Connector | SearchIndex, search_query: str, download_directory: Path, check_all_removed: bool = False,
+    *, quality: Callable[[Post], Post.Quality] | None = None,
+) -> int | None:
+    """ Bring a local mirror of a search query up to date, only searching for posts newer than the last run.
+
+    The highest post ID and the posts stored locally are recorded in the download directory. Each run checks
+    the next batch of stored posts for removal from the query, moving the files of removed posts aside, then
+    downloads posts newer than the highest post ID recorded. Keeping a mirror current then costs a request
+    or two, plus any pages of new posts.
+
+    Args:
+        source (E621Connector | SearchIndex): E621 connector to search with, or search index to search offline.
+        search_query (str): Search query to mirror.
+        download_directory (Path): Directory to mirror the query to.
+        check_all_removed (bool, optional): Check every stored post for removal, rather than the next batch. \
+                                            Defaults to False.
+        quality (Callable[[Post], Post.Quality] | None, optional): Get the quality tier to download each post at. \
+                                                                   Defaults to None, where original files are \
+                                                                   downloaded.
+
+    Returns:
+        int | None: Exit code, or None if the mirror was updated.
+    """
+    mirror = SearchMirror.load(download_directory) or SearchMirror(query=search_query)
+    if mirror.query != search_query:
+        logger.error(f"Directory '{download_directory}' mirrors a different query '{mirror.query}'")
+        return 1
+
+    with profiler.span("check removed posts"):
+        removed_post_ids = check_removed_posts(source, mirror, download_directory, check_all=check_all_removed)
+
+    # Only search for posts newer than the last run, as older posts are already stored.
+    search = f"{search_query} id:>{mirror.max_post_id}" if mirror.max_post_id else search_query
+    result = stream_search(source, search, download_directory, skip_post_ids=set(mirror.post_ids), quality=quality)
+
+    downloaded_post_ids = [int(target.file_name) for target, _ in result.report.results]
+    missing_post_ids = [int(failure.item.file_name) for failure in result.report.failures]
+    missing_post_ids += [int(target.file_name) for target in result.report.cancelled]
+    mirror.post_ids = sorted({*mirror.post_ids, *downloaded_post_ids, *result.skipped_post_ids})
+
+    # Only move the highest post ID forward once every newer post is stored, such that missing posts are retried.
+    if result.listing_complete:
+        mirror.max_post_id = (
+            min(missing_post_ids) - 1 if missing_post_ids else max([mirror.max_post_id, *result.listed_post_ids])
+        )
+
+    mirror.save(download_directory)
+    logger.print(f"Mirror of '{search_query}' has {len(mirror.post_ids)} posts, with {len(downloaded_post_ids)} "
+                 f"new and {len(removed_post_ids)} removed")
+
+    return None if result.listing_complete else 1
+
+
+def check_removed_posts(
+    source: E621Connector | SearchIndex, mirror: SearchMirror, download_directory: Path, *, check_all: bool,
+) -> list[int]:
+    """ Check stored posts for removal from a mirrored query, moving the files of removed posts aside.
+
+    Args:
+        source (E621Connector | SearchIndex): E621 connector to search with, or search index to search offline.
+        mirror (SearchMirror): Mirror to check, which is updated to no longer contain removed posts.
+        download_directory (Path): Directory the query is mirrored to.
+        check_all (bool): Check every stored post, rather than only the next batch of posts.
+
+    Returns:
+        list[int]: Post IDs removed from the query.
+    """
+    count = len(mirror.post_ids) if check_all else REMOVAL_CHECK_SIZE
+    if not (post_ids := mirror.next_removal_check(count)):
+        return []
+
+    # Search for batches of stored posts by ID within the query, where any post not returned has been removed.
+    removed_post_ids = []
+    for batch in itertools.batched(post_ids, REMOVAL_CHECK_SIZE):
+        batch_query = f"{mirror.query} id:{','.join(map(str, batch))}"
+        present_post_ids = {
+            post.post_id for post in source.search(batch_query)
+        } if isinstance(source, SearchIndex) else {
+            post["id"] for post in source.get_posts(batch_query, desc="removal check")
+        }
+        removed_post_ids += [post_id for post_id in batch if post_id not in present_post_ids]
+
+    for post_id in removed_post_ids:
+        for file_path in download_directory.glob(f"{post_id}.*"):
+            logger.info(f"Moving '{file_path.name}' aside, as post {post_id} no longer matches the query")
+            file_path.rename(file_path.with_name(f"_removed-{file_path.name}"))
+
+    removed = set(removed_post_ids)
+    mirror.post_ids = [post_id for post_id in mirror.post_ids if post_id not in removed]
+    mirror.removal_cursor = post_ids[-1]
+    return removed_post_ids
+
+
+def iter_search_targets(
+    source: E621Connector | SearchIndex, search_query: str, download_directory: Path,
+    offset: int | None = None, limit: int | None = None, *, quality: Callable[[Post], Post.Quality] | None = None,
+) -> Iterator[list[UrlFileTarget]]:
+    """ Get the file target of each post matching a search query, a page of results at a time.
+
+    Args:
+        source (E621Connector | SearchIndex): E621 connector to search with, or search index to search offline.
+        search_query (str): Search query to list posts from.
+        download_directory (Path): Directory to download posts to.
+        offset (int | None, optional): Number of posts to skip. Defaults to None, where no posts are skipped.
+        limit (int | None, optional): Maximum number of posts to list. Defaults to None, where all posts \
+                                      are listed.
+        quality (Callable[[Post], Post.Quality] | None, optional): Get the quality tier to download each post at, \
+                                                                   only for searches through the API. Defaults to \
+                                                                   None, where original files are downloaded.
+
+    Yields:
+        list[UrlFileTarget]: File targets of each page of posts, named by post ID.
+    """
+    if isinstance(source, SearchIndex):
+        # The search index resolves a whole query at once, which is then paged as the API would return it.
+        with profiler.span("search index"):
+            posts = source.search(search_query, offset=offset, limit=limit)
+        for page in itertools.batched(posts, E621Connector.PAGE_LIMIT):
+            yield [
+                UrlFileTarget(
+                    url=post.url,
+                    file_name=str(post.post_id),
+                    download_directory=download_directory,
+                    extension=post.ext,
+                    size=post.size,
+                )
+                for post in page
+            ]
+        return
+
+    for page in source.iter_posts(search=search_query, offset=offset, limit=limit):
+        selected_files = [
+            (post.post_id, post.select_file(quality(post) if quality else Post.Quality.ORIGINAL))
+            for post in map(Post.from_api, page)
+        ]
+        yield [
+            UrlFileTarget(
+                url=selected_file.url,
+                file_name=str(post_id),
+                download_directory=download_directory,
+                extension=selected_file.ext,
+                size=selected_file.size,
+            )
+            for post_id, selected_file in selected_files
+        ]
@@ -1,30 +1,55 @@
 """ Synchronise upstream e621 favourites with local files. """
 import argparse
 import shutil
-from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from typing import cast, NamedTuple
 
 from fluffless.utils import cli, logging
 
+from furbox.connectors.cache import FileStat, HashCache
 from furbox.connectors.downloader import download_files, UrlFileTarget
 from furbox.connectors.e621 import E621Connector
-from furbox.helpers.utils import execute_futures, hash_file
+from furbox.connectors.journal import LibraryScanner
+from furbox.helpers.utils import CompletionExecutor, hash_file
 from furbox.models.config import Config
 from furbox.models.e621 import Post, Tag
-from furbox.runners.e621 import _SUBPARSERS
+from furbox.runners import add_parser
+from furbox.utils.profiling import profiler
 from furbox.utils.progress_bar import ProgressBar
 
 logger = logging.getLogger(__name__)
 
-PARSER = cli.add_parser("fav-sync", subparsers=_SUBPARSERS,
-                        help=" Synchronise upstream e621 favourites with local files.")
+PARSER = add_parser("e621 fav-sync")
 PARSER.add_argument("--dry-run", action="store_true", help="Preview updates without modifying files.")
+PARSER.add_argument("--quality", type=Post.Quality, choices=list(Post.Quality),
+                    help="Quality tier to download favourites at, unless overridden in config for a directory or "
+                         "rating. Defaults to the `e621.quality` config setting.")
 
 
 @cli.entrypoint(PARSER)
 def fav_sync(args: argparse.Namespace, config: Config) -> int | None:
     """ Sync e621 favourites with local files. """
+    return sync_favourites(config=config, dry_run=args.dry_run, quality=args.quality)
+
+
+def sync_favourites(
+    config: Config, dry_run: bool = False, e621_connector: E621Connector | None = None,
+    quality: Post.Quality | None = None,
+) -> int | None:
+    """ Sync e621 favourites with local files.
+
+    Args:
+        config (Config): Application config.
+        dry_run (bool, optional): Preview updates without modifying files. Defaults to False.
+        e621_connector (E621Connector | None, optional): Connector to reuse for e621 requests. \
+                                                         Defaults to None, where a new connector is created.
+        quality (Post.Quality | None, optional): Quality tier to download favourites at, where not overridden \
+                                                 in config. Defaults to None, where the config setting is used.
+
+    Returns:
+        int | None: Exit code, or None if the sync ran.
+    """
     if config.e621 is None:
         logger.error("Config requires `e621` to be defined to use fav sync utility")
         return 1
@@ -33,27 +58,32 @@ def fav_sync(args: argparse.Namespace, config: Config) -> int | None:
         logger.error("Config requires `e621.fav_paths` to be defined to use fav sync utility")
         return 1
 
-    dry_run = args.dry_run
-
-    e621_connector = E621Connector(
+    e621_connector = e621_connector or E621Connector(
         username=config.e621.username,
         api_key=config.e621.api_key,
     )
 
     # Fetch all favourites for the user defined in config.
-    favourites = [Post.from_api(post) for post in e621_connector.get_posts(f"fav:{config.e621.username}")]
+    with profiler.span("fetch favourites"):
+        favourites = [Post.from_api(post) for post in e621_connector.get_posts(f"fav:{config.e621.username}")]
 
-    # Process each directory and aggregate rename and download tasks.
+    # Process each directory and aggregate rename and download tasks, reusing hashes of unchanged files.
     tasks: list[RenameFileTarget | UrlFileTarget] = []
-    for rating in Post.Rating:
-        logger.print(f"Processing directory for posts rated '{rating.name.lower()}'")
-        directory = cast(Path, getattr(config.e621.fav_paths, rating.name.lower()))
-        tasks += process_directory(
-            e621_connector=e621_connector,
-            directory=directory,
-            rating=rating,
-            favourites=favourites,
-        )
+    scanner = LibraryScanner(config.misc.cache_dir or None)
+    with HashCache(config.misc.cache_dir or None) as hash_cache:
+        for rating in Post.Rating:
+            logger.print(f"Processing directory for posts rated '{rating.name.lower()}'")
+            directory = cast(Path, getattr(config.e621.fav_paths, rating.name.lower()))
+            with profiler.span(f"process {rating.name.lower()} directory"):
+                tasks += process_directory(
+                    e621_connector=e621_connector,
+                    directory=directory,
+                    rating=rating,
+                    favourites=favourites,
+                    hash_cache=hash_cache,
+                    scanner=scanner,
+                    quality=config.e621.quality_for(directory, rating, default=quality),
+                )
 
     # Split rename and download tasks into their own lists, to be actioned separately.
     rename_tasks = [x for x in tasks if isinstance(x, RenameFileTarget)]
@@ -69,7 +99,10 @@ def fav_sync(args: argparse.Namespace, config: Config) -> int | None:
 
         return None
 
-    with ProgressBar("Renaming files", length=len(rename_tasks), persist=True) as progress:
+    with (
+        profiler.span("rename files"),
+        ProgressBar("Renaming files", length=len(rename_tasks), persist=True) as progress,
+    ):
         for task in rename_tasks:
             parent = task.original_file.parent.name
             logger.info(f"Renaming '{parent}/{task.original_file.name}' -> '{parent}/{task.updated_name}'")
@@ -99,18 +132,28 @@ def determine_artist(e621_connector: E621Connector, post: Post) -> str:
 
     if len(artists) == 1:
         return next(iter(artists))
-    if counts := {
-        artist: Tag.from_api(tag_info).post_count
-        for artist in artists
-        if (tag_info := e621_connector.get_tag(artist, Tag.Category.ARTIST))
-    }:
-        return max(counts, key=lambda x: counts[x], default="unknown_artist")
+
+    with profiler.span("resolve artist"):
+        if counts := {
+            artist: Tag.from_api(tag_info).post_count
+            for artist in artists
+            if (tag_info := e621_connector.get_tag(artist, Tag.Category.ARTIST))
+        }:
+            return max(counts, key=lambda x: counts[x], default="unknown_artist")
 
     return "unknown_artist"
 
 
+def parse_post_id(file_path: Path) -> int | None:
+    """ Parse the post ID from a local file name of the form `{post_id}_{artist}.ext`, or None if invalid. """
+    post_id = file_path.stem.split("_")[0]
+    return int(post_id) if post_id.isnumeric() else None
+
+
 def process_directory(
     e621_connector: E621Connector, directory: Path, rating: Post.Rating, favourites: list[Post],
+    hash_cache: HashCache | None = None, *, scanner: LibraryScanner | None = None,
+    quality: Post.Quality = Post.Quality.ORIGINAL,
 ) -> list[UrlFileTarget | RenameFileTarget]:
     """ Generate jobs to perform to synchronise a given directory with E621 favourites.
 
@@ -119,48 +162,75 @@ def process_directory(
         directory (Path): Local directory to consider for synchronisation.
         rating (Post.Rating): Rating to consider for the given directory.
         favourites (list[Post]): Full list of E621 favourites to sync.
+        hash_cache (HashCache | None, optional): Cache of hashes to reuse for unchanged local files. \
+                                                 Defaults to None, where all candidate files are hashed.
+        scanner (LibraryScanner | None, optional): Scanner to list local files incrementally with. \
+                                                   Defaults to None, where the directory is fully listed.
+        quality (Post.Quality, optional): Quality tier to download posts at. Where a post is selected below the \
+                                          original quality, any local file of it is kept as is, as only original \
+                                          files can be verified against their MD5 hash. Defaults to original \
+                                          quality.
 
     Returns:
         list[UrlFileTarget | RenameFileTarget]: List of rename and download tasks to perform for the directory.
     """
-    files = [f for f in directory.iterdir() if f.is_file()]
-
-    # Get the MD5 hash of all local files to compare to the upstream.
-    with (
-        ProgressBar(f"Hashing local '{rating.name.lower()}' files", length=len(files), persist=False) as progress,
-        ThreadPoolExecutor(max_workers=8) as executor,
-    ):
-        futures = [
-            executor.submit(
-                hash_file,
-                file_path=target,
-                hash_algorithm="md5",
-            ) for target in files
-        ]
-
-        file_hashes = dict(zip(files, execute_futures(futures, progress), strict=True))
+    with profiler.span("list files"):
+        if scanner:
+            file_stats = scanner.scan(directory)
+        else:
+            file_stats = {f: FileStat.from_path(f) for f in directory.iterdir() if f.is_file()}
+    files = sorted(file_stats)
 
     # Consider only favourites matching the rating category associated with the current folder.
     filtered_favourites = {fav.post_id: fav for fav in favourites if fav.rating == rating}
     outputs: list[UrlFileTarget | RenameFileTarget] = []
 
+    # Posts which are downloaded as original files, such as animated posts at any quality, can be verified.
+    verifiable_ids = {
+        post_id for post_id, fav in filtered_favourites.items()
+        if fav.select_file(quality).quality == Post.Quality.ORIGINAL
+    }
+
+    # A local file can only match upstream if its size matches, so only these files need to be hashed.
+    hash_candidates = [
+        local_file for local_file in files
+        if not local_file.stem.startswith("_") and (post_id := parse_post_id(local_file)) in verifiable_ids
+        and (upstream := filtered_favourites[post_id])
+        and file_stats[local_file].size == upstream.file_info.size
+    ]
+
+    # Get the MD5 hash of all candidate local files to compare to the upstream.
+    with profiler.span("hash files"), ProgressBar(
+        f"Hashing local '{rating.name.lower()}' files", length=len(hash_candidates), persist=False,
+    ) as progress:
+        report = CompletionExecutor(
+            partial(hash_file, hash_algorithm="md5", hash_cache=hash_cache), threads=8, progress_bar=progress,
+        ).run(hash_candidates)
+
+    file_hashes = dict(report.results)
+    hash_failures = {failure.item for failure in report.failures}
+    for failure in report.failures:
+        logger.warning(f"Could not hash '{directory.stem}/{failure.item.name}': {failure.exception}")
+
     for local_file in files:
         if local_file.stem.startswith("_"):
             continue
 
-        post_id = local_file.stem.split("_")[0]
-        if not post_id.isnumeric():
+        if (post_id := parse_post_id(local_file)) is None:
             logger.info(f"Could not determine post ID for '{directory.stem}/{local_file.stem}'")
             continue
 
-        post_id = int(post_id)
         has_artist = len(local_file.stem.split("_")) > 1
 
         if not (upstream := filtered_favourites.pop(post_id, None)):
             logger.info(f"Post {post_id} either no longer favourited, or deleted from e621")
             continue
 
-        if file_hashes[local_file] == upstream.file_info.md5:
+        if local_file in hash_failures:
+            logger.info(f"Skipping post {post_id}, as the local file could not be hashed")
+            continue
+
+        if post_id not in verifiable_ids or file_hashes.get(local_file) == upstream.file_info.md5:
             if not has_artist:
                 logger.print(f"Post {post_id} matches upstream, but has no artist name locally")
                 artist = determine_artist(e621_connector, upstream)
@@ -170,7 +240,7 @@ def process_directory(
                 ))
                 continue
         else:
-            if local_file.stat().st_size > upstream.file_info.size:
+            if file_stats[local_file].size > upstream.file_info.size:
                 logger.info(f"Post {post_id} mismatch with upstream, but better quality locally")
                 continue
 
@@ -184,15 +254,19 @@ def process_directory(
                 url=upstream.file_info.url,
                 file_name=f"{upstream.post_id}_{artist}",
                 download_directory=directory,
+                size=upstream.file_info.size,
             ))
 
     for favourite in filtered_favourites.values():
         logger.info(f"Post {favourite.post_id} not found locally")
         artist = determine_artist(e621_connector, favourite)
+        selected_file = favourite.select_file(quality)
         outputs.append(UrlFileTarget.create(
-            url=favourite.file_info.url,
+            url=selected_file.url,
             file_name=f"{favourite.post_id}_{artist}",
             download_directory=directory,
+            extension=selected_file.ext,
+            size=selected_file.size,
         ))
 
     return outputs
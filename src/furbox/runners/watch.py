@@ -0,0 +1,107 @@
+""" Runner to watch library directories, journalling changes such that later scans can be incremental. """
+import argparse
+from pathlib import Path
+from typing import cast
+
+from fluffless.utils import cli, logging
+
+from furbox.connectors.journal import ChangeJournal
+from furbox.models.config import Config
+from furbox.models.e621 import Post
+from furbox.runners import add_parser
+from furbox.utils.inotify import EventMask, Inotify
+
+logger = logging.getLogger(__name__)
+
+# Start a new journal epoch once the journal grows beyond this size, forcing a single full scan of each directory.
+MAX_JOURNAL_SIZE = 1024 * 1024 * 64
+
+PARSER = add_parser("watch")
+
+
+@cli.entrypoint(parser=PARSER)
+def watch(args: argparse.Namespace, config: Config) -> int | None:  # noqa: ARG001
+    """ Watch all library directories defined in config until interrupted. """
+    # Favourite directories are flat, while each comic is stored in a subdirectory of the comics base path.
+    directories: list[Path] = []
+    if config.e621 and config.e621.fav_paths:
+        directories = [
+            cast(Path, getattr(config.e621.fav_paths, rating.name.lower())).resolve() for rating in Post.Rating
+        ]
+    parent_directories = [config.comics.base_path.resolve()] if config.comics else []
+
+    if not directories and not parent_directories:
+        logger.error("Config requires `e621.fav_paths` or `comics` to be defined to use the watch utility")
+        return 1
+
+    try:
+        inotify = Inotify()
+    except OSError as e:
+        logger.error(f"Could not start watching directories: {e}")  # noqa: TRY400
+        return 1
+
+    journal = ChangeJournal(config.misc.cache_dir or None)
+    watches: dict[int, Path] = {}
+
+    def add_watch(directory: Path) -> None:
+        """ Watch a directory for changes, logging a warning if it cannot be watched. """
+        try:
+            watches[inotify.add_watch(directory, EventMask.CHANGES | EventMask.ONLYDIR)] = directory
+        except OSError as e:
+            logger.warning(f"Not watching '{directory}': {e}")
+
+    with inotify:
+        for directory in directories:
+            add_watch(directory)
+
+        for parent_directory in parent_directories:
+            add_watch(parent_directory)
+            for directory in parent_directory.iterdir():
+                if directory.is_dir():
+                    add_watch(directory)
+
+        # Start the journal only once watches exist, such that no change after the start can be missed.
+        journal.start()
+        logger.print(f"Watching {len(watches)} directories for changes, press Ctrl+C to stop")
+
+        try:
+            while True:
+                changed_paths = []
+                for event in inotify.read_events():
+                    # If the event queue overflowed, events were lost and all scans must start again from scratch.
+                    if event.mask & EventMask.Q_OVERFLOW:
+                        logger.warning("Change events were dropped, starting a new journal epoch")
+                        journal.start()
+                        changed_paths = []
+                        continue
+
+                    if (directory := watches.get(event.watch_descriptor)) is None:
+                        continue
+
+                    if event.mask & EventMask.IGNORED:
+                        watches.pop(event.watch_descriptor)
+                        continue
+
+                    changed_path = directory / event.name if event.name else directory
+                    changed_paths.append(changed_path)
+
+                    # Watch newly created comic directories within each parent directory.
+                    if (
+                        event.mask & EventMask.ISDIR and event.mask & (EventMask.CREATE | EventMask.MOVED_TO)
+                        and directory in parent_directories
+                    ):
+                        add_watch(changed_path)
+
+                if changed_paths:
+                    journal.record(changed_paths)
+
+                if journal.file_path.stat().st_size > MAX_JOURNAL_SIZE:
+                    journal.start()
+
+        except KeyboardInterrupt:
+            logger.print("Stopped watching directories")
+
+        finally:
+            journal.stop()
+
+    return None
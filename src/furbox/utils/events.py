@@ -0,0 +1,70 @@
+""" Machine readable event stream, emitted as JSON lines for headless runs such as under cron or systemd.
+
+When enabled, progress bars emit rate limited events instead of rendering a live display, and runners emit
+events summarising their work. Every event is a single JSON object on its own line, with the time it was
+emitted and the event name, alongside any fields specific to the event.
+
+Example usage of the event stream: ::
+
+    events.configure(sys.stdout)
+    events.emit("downloads", description="Downloading favourites", succeeded=10, failed=0, bytes=1048576)
+
+    # Output: {"time": 1760000000.0, "event": "downloads", "description": "Downloading favourites", ...}
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+from typing import Any, TextIO
+
+from rich.errors import MarkupError
+from rich.text import Text
+
+
+class EventStream:
+    """ Thread safe writer of JSON lines events to a text stream, which does nothing until configured. """
+
+    def __init__(self) -> None:
+        self.output: TextIO | None = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """ True if events are being emitted. """
+        return self.output is not None
+
+    def configure(self, output: TextIO | None) -> None:
+        """ Emit events to a text stream, or stop emitting events if None. """
+        self.output = output
+
+    def emit(self, event: str, **fields: Any) -> None:
+        """ Emit an event, if the event stream is enabled.
+
+        Args:
+            event (str): Name of the event.
+            **fields (Any): Fields of the event, which must be JSON serialisable or convertible to strings.
+        """
+        if self.output is None:
+            return
+
+        line = json.dumps({"time": round(time.time(), 3), "event": event, **fields}, default=str)
+        with self.lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+
+class EventLogHandler(logging.Handler):
+    """ Logging handler emitting each log record as a "log" event, with any Rich markup removed. """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """ Emit a log record as an event. """
+        message = record.getMessage()
+        with contextlib.suppress(MarkupError):
+            message = Text.from_markup(message).plain
+
+        events.emit("log", level=record.levelname, logger=record.name, message=message)
+
+
+# Shared event stream, enabled on startup for headless runs.
+events = EventStream()
@@ -0,0 +1,127 @@
+""" Minimal Linux-only inotify backend, implemented with ctypes against the C standard library.
+
+Example usage of Inotify: ::
+
+    with Inotify() as inotify:
+        inotify.add_watch(Path("path/to/directory"), EventMask.CHANGES)
+        for event in inotify.read_events():
+            print(event.watch_descriptor, event.name)
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+from enum import IntFlag
+from pathlib import Path
+from types import TracebackType
+from typing import NamedTuple, Self
+
+
+class EventMask(IntFlag):
+    """ Int flag of inotify event bits, as defined in `sys/inotify.h`. """
+
+    MODIFY = 0x00000002
+    ATTRIB = 0x00000004
+    CLOSE_WRITE = 0x00000008
+    MOVED_FROM = 0x00000040
+    MOVED_TO = 0x00000080
+    CREATE = 0x00000100
+    DELETE = 0x00000200
+    DELETE_SELF = 0x00000400
+    MOVE_SELF = 0x00000800
+    Q_OVERFLOW = 0x00004000
+    IGNORED = 0x00008000
+    ONLYDIR = 0x01000000
+    ISDIR = 0x40000000
+
+    # Events which indicate an entry in a watched directory was added, removed, or modified.
+    CHANGES = CLOSE_WRITE | ATTRIB | MOVED_FROM | MOVED_TO | CREATE | DELETE | DELETE_SELF | MOVE_SELF
+
+
+class InotifyEvent(NamedTuple):
+    """ Named tuple of a single event read from an inotify file descriptor. """
+
+    watch_descriptor: int
+    mask:             EventMask
+    cookie:           int
+    name:             str
+
+
+class Inotify:
+    """ Wrapper around an inotify instance, allowing directories to be watched for changes.
+
+    Raises:
+        OSError: Not running on Linux, or the inotify instance could not be created.
+    """
+
+    EVENT_HEADER = struct.Struct("iIII")
+    READ_SIZE: int = 1024 * 64
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError(f"inotify is only available on Linux, not '{sys.platform}'")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"Could not create inotify instance: {os.strerror(errno)}")
+
+    def __enter__(self) -> Self:
+        """ Allow the inotify instance to be used in a context manager. """
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None,
+                 exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        """ Close the inotify instance when exiting a context manager. """
+        self.close()
+
+    def add_watch(self, path: Path, mask: EventMask) -> int:
+        """ Watch a path for the given events, returning the associated watch descriptor.
+
+        Raises:
+            OSError: The watch could not be added, such as if the path does not exist.
+        """
+        watch_descriptor = self._libc.inotify_add_watch(self.fd, os.fsencode(path), int(mask))
+        if watch_descriptor < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"Could not watch '{path}': {os.strerror(errno)}")
+
+        return watch_descriptor
+
+    def read_events(self, timeout: float | None = None) -> list[InotifyEvent]:
+        """ Read all pending events, blocking until at least one is available or the timeout expires.
+
+        Args:
+            timeout (float | None, optional): Maximum time in seconds to wait for events. \
+                                              Defaults to None, where this will wait indefinitely.
+
+        Returns:
+            list[InotifyEvent]: Events read, which will be empty if the timeout expired.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        buffer = os.read(self.fd, self.READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            watch_descriptor, mask, cookie, name_length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+
+            # Names are null padded to an alignment boundary, so strip any trailing null bytes.
+            name = os.fsdecode(buffer[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+
+            events.append(InotifyEvent(watch_descriptor, EventMask(mask), cookie, name))
+
+        return events
+
+    def close(self) -> None:
+        """ Close the inotify file descriptor, removing all watches. """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
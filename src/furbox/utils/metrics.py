@@ -0,0 +1,237 @@
+""" Lightweight registry of counters and histograms, written out as a summary at the end of each run.
+
+Metrics are registered by name on first use, and may be split into series by keyword labels. A summary is
+written either as a Prometheus textfile, suitable for the node exporter textfile collector, or as JSON.
+
+Example usage of metrics: ::
+
+    metrics.counter("furbox_download_bytes_total", "Bytes downloaded").inc(len(chunk))
+
+    with metrics.histogram("furbox_e621_request_seconds", "e621 API request latency").time(endpoint="posts"):
+        response = session.get(...)
+
+    metrics.write(Path("furbox.prom"))
+"""
+import bisect
+import json
+import math
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+# Label values of a single series, as sorted pairs of label names and values.
+type Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    """ Convert keyword labels into a hashable series key. """
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    """ Format a series key as Prometheus labels, such as `{endpoint="posts"}`. """
+    if not labels:
+        return ""
+
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    """ Format a sample value, keeping whole numbers free of a decimal point. """
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """ Monotonically increasing total, such as a number of requests or bytes.
+
+    Args:
+        name (str): Name of the metric.
+        description (str): Description of what the metric counts.
+    """
+
+    kind: str = "counter"
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.lock = threading.Lock()
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """ Increase the counter for a series by an amount. """
+        key = _labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        """ Yield every sample of the metric, as its name, labels and value. """
+        with self.lock:
+            values = sorted(self.values.items())
+
+        for labels, value in values:
+            yield self.name, labels, value
+
+    def summary(self) -> list[dict[str, Any]]:
+        """ Get the value of every series, for the JSON summary. """
+        return [{"labels": dict(labels), "value": value} for _, labels, value in self.samples()]
+
+
+class Histogram:
+    """ Distribution of observed values, such as request latencies, counted into cumulative buckets.
+
+    Args:
+        name (str): Name of the metric.
+        description (str): Description of what the metric observes.
+        buckets (tuple[float, ...], optional): Upper bounds of each bucket. Defaults to `DEFAULT_BUCKETS`, \
+                                               which suit latencies in seconds.
+    """
+
+    kind: str = "histogram"
+
+    DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    class Series:
+        """ Bucket counts, sum and count of the values observed for a single series. """
+
+        def __init__(self, bucket_count: int) -> None:
+            self.bucket_counts = [0] * bucket_count
+            self.total = 0.0
+            self.count = 0
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = (*sorted(buckets), math.inf)
+        self.lock = threading.Lock()
+        self.series: dict[Labels, Histogram.Series] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """ Record an observed value for a series. """
+        key = _labels(labels)
+        with self.lock:
+            if (series := self.series.get(key)) is None:
+                series = self.series[key] = self.Series(len(self.buckets))
+
+            series.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            series.total += value
+            series.count += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """ Observe the time taken to run a block in seconds, including when it raises an exception. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        """ Yield every sample of the metric, as its name, labels and value. """
+        with self.lock:
+            series = sorted(
+                (labels, list(s.bucket_counts), s.total, s.count) for labels, s in self.series.items()
+            )
+
+        for labels, bucket_counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts, strict=True):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", (*labels, ("le", _format_value(bound))), cumulative
+
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+    def summary(self) -> list[dict[str, Any]]:
+        """ Get the count, sum and mean of every series, for the JSON summary. """
+        with self.lock:
+            series = sorted((labels, s.total, s.count) for labels, s in self.series.items())
+
+        return [
+            {"labels": dict(labels), "count": count, "sum": total, "mean": total / count if count else None}
+            for labels, total, count in series
+        ]
+
+
+class MetricsRegistry:
+    """ Registry of named metrics, which are created the first time they are requested. """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.metrics: dict[str, Counter | Histogram] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        """ Get a counter by name, creating it if it does not exist. """
+        return self._get(Counter, name, description)
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] | None = None) -> Histogram:
+        """ Get a histogram by name, creating it if it does not exist. """
+        return self._get(Histogram, name, description, *((buckets,) if buckets else ()))
+
+    def _get[M: (Counter, Histogram)](self, metric_type: type[M], name: str, *args: Any) -> M:
+        """ Get a metric by name and type, creating it if it does not exist.
+
+        Raises:
+            TypeError: Metric was already registered with a different type.
+        """
+        with self.lock:
+            if (metric := self.metrics.get(name)) is None:
+                metric = self.metrics[name] = metric_type(name, *args)
+
+        if not isinstance(metric, metric_type):
+            raise TypeError(f"Metric '{name}' is already registered as a {metric.kind}")
+
+        return metric
+
+    def to_prometheus(self) -> str:
+        """ Format every metric in the Prometheus text exposition format. """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+
+        lines = []
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(
+                f"{sample_name}{_format_labels(labels)} {_format_value(value)}"
+                for sample_name, labels, value in metric.samples()
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict[str, Any]:
+        """ Summarise every metric as JSON data. """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+
+        return {
+            name: {"type": metric.kind, "description": metric.description, "series": metric.summary()}
+            for name, metric in metrics
+        }
+
+    def write(self, file_path: Path) -> None:
+        """ Atomically write a summary of every metric, such that collectors never read a partial file.
+
+        Args:
+            file_path (Path): File to write to. Written as a Prometheus textfile if it has a `.prom` \
+                              extension, otherwise written as JSON.
+        """
+        content = self.to_prometheus() if file_path.suffix == ".prom" else json.dumps(self.to_json(), indent=4) + "\n"
+
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # The temporary file must not have a `.prom` extension, otherwise it may be collected while partial.
+        tmp_file_path = file_path.with_name(f"_{file_path.name}.tmp")
+        tmp_file_path.write_text(content, encoding="utf-8")
+        tmp_file_path.replace(file_path)
+
+
+# Shared metrics registry, written out at the end of each run if a metrics file is configured.
+metrics = MetricsRegistry()
@@ -0,0 +1,194 @@
+""" Opt-in profiling of runner stages, with named timing spans and an optional whole program profiler.
+
+Spans are nested per thread, such that a span opened within another is reported as a child stage of it. When
+profiling is not enabled, spans do nothing beyond entering and exiting a context manager.
+
+Spans may be paired with either cProfile, which traces every function call on the main thread, or a sampling
+profiler, which periodically records the stack of every thread alongside the spans it was in. At exit, a per
+stage breakdown is written as JSON next to the profile file.
+
+Example usage of the profiler: ::
+
+    profiler.start(Profiler.Mode.SAMPLE)
+
+    with profiler.span("hash files"):
+        hash_files(...)
+
+    profiler.stop()
+    profiler.write(Path("furbox-profile"))
+"""
+import cProfile
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from enum import StrEnum
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+
+class Profiler:
+    """ Collector of timing spans, optionally paired with cProfile or a sampling profiler. """
+
+    class Mode(StrEnum):
+        """ Profilers which may be run alongside the timing spans. """
+
+        SPANS = "spans"
+        CPROFILE = "cprofile"
+        SAMPLE = "sample"
+
+    class SpanTotal:
+        """ Number of times a span was entered, and the total seconds spent within it. """
+
+        def __init__(self) -> None:
+            self.count = 0
+            self.seconds = 0.0
+
+    # Interval in seconds between samples of every thread's stack, when using the sampling profiler.
+    SAMPLE_INTERVAL: float = 0.01
+
+    def __init__(self) -> None:
+        self.mode: Profiler.Mode | None = None
+        self.lock = threading.Lock()
+        self.spans: dict[tuple[str, ...], Profiler.SpanTotal] = {}
+        self.samples: Counter[str] = Counter()
+        self.start_time = 0.0
+        self.elapsed = 0.0
+
+        # Open spans of each thread by thread ID, readable by the sampling thread.
+        self._stacks: dict[int, list[str]] = {}
+        self._cprofile: cProfile.Profile | None = None
+        self._sampler: threading.Thread | None = None
+        self._stop_sampling = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        """ True if profiling was started. """
+        return self.mode is not None
+
+    def start(self, mode: "Profiler.Mode") -> None:
+        """ Start recording spans, and start a profiler if requested. """
+        self.mode = mode
+        self.start_time = time.perf_counter()
+
+        if mode == Profiler.Mode.CPROFILE:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif mode == Profiler.Mode.SAMPLE:
+            self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        """ Stop any running profiler. Recorded spans and samples are kept until written. """
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+
+        self.elapsed = time.perf_counter() - self.start_time
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """ Time a named stage, nested within any span already open on the current thread. """
+        if self.mode is None:
+            yield
+            return
+
+        stack = self._stacks.setdefault(threading.get_ident(), [])
+        stack.append(name)
+        path = tuple(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                total = self.spans.setdefault(path, Profiler.SpanTotal())
+                total.count += 1
+                total.seconds += elapsed
+
+    def _sample(self) -> None:
+        """ Record the stack of every other thread at a fixed interval, prefixed by the spans it is within. """
+        own_id = threading.get_ident()
+        while not self._stop_sampling.wait(self.SAMPLE_INTERVAL):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                frames = [f"[{name}]" for name in self._stacks.get(thread_id, ())]
+                frames.extend(reversed(list(self._walk_frames(frame))))
+                self.samples[";".join(frames)] += 1
+
+    @staticmethod
+    def _walk_frames(frame: FrameType | None) -> Iterator[str]:
+        """ Yield a label for each frame of a stack, from the innermost frame outwards. """
+        while frame is not None:
+            code = frame.f_code
+            yield f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+            frame = frame.f_back
+
+    def breakdown(self) -> list[dict[str, Any]]:
+        """ Get the total time spent in each span, with each span followed by the spans nested within it.
+
+        Spans entered concurrently from multiple threads sum the time spent on every thread, and so may
+        exceed the wall clock time of the run.
+        """
+        with self.lock:
+            spans = sorted(self.spans.items())
+
+        return [
+            {
+                "stage": " > ".join(path),
+                "depth": len(path) - 1,
+                "count": total.count,
+                "seconds": round(total.seconds, 6),
+                "percent": round(100 * total.seconds / self.elapsed, 2) if self.elapsed else None,
+            }
+            for path, total in spans
+        ]
+
+    def write(self, output: Path) -> list[Path]:
+        """ Write the per stage breakdown, and the profile of any profiler that was run.
+
+        Args:
+            output (Path): Path to write to, without an extension. The breakdown is written to `.json`, \
+                           a cProfile profile to `.prof`, and sampled stacks in the collapsed stack format \
+                           used by flame graph tools to `.folded`.
+
+        Returns:
+            list[Path]: Paths of every file written.
+        """
+        output.parent.mkdir(parents=True, exist_ok=True)
+
+        breakdown_path = output.with_name(f"{output.name}.json")
+        breakdown_path.write_text(json.dumps({
+            "mode": self.mode,
+            "elapsed": round(self.elapsed, 6),
+            "stages": self.breakdown(),
+        }, indent=4) + "\n", encoding="utf-8")
+        written = [breakdown_path]
+
+        if self._cprofile is not None:
+            profile_path = output.with_name(f"{output.name}.prof")
+            self._cprofile.dump_stats(profile_path)
+            written.append(profile_path)
+
+        if self._sampler is not None:
+            folded_path = output.with_name(f"{output.name}.folded")
+            folded_path.write_text(
+                "".join(f"{stack} {count}\n" for stack, count in sorted(self.samples.items())), encoding="utf-8",
+            )
+            written.append(folded_path)
+
+        return written
+
+
+# Shared profiler, started on startup if profiling was requested.
+profiler = Profiler()
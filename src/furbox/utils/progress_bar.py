@@ -1,11 +1,21 @@
 """ Custom implementation of Rich progress bars.
 
 Allows for multiple progress bars with different formats, in addition to custom formatted progress bars.
+
+Advancing a progress bar only increments a counter under a lock, such that it is cheap enough to call for
+every chunk of a download, from any number of threads. Counters are copied into the Rich progress bars by the
+live display's own refresh thread, which renders at a fixed rate regardless of how often bars are advanced.
+
+If the event stream is enabled, such as for headless runs, the live display is never started. Progress bars
+instead emit "start" and "finish" events, with "progress" events emitted for changed bars at a fixed interval.
 """
 import atexit
+import itertools
+import threading
+import time
 from enum import auto, StrEnum
 from types import TracebackType
-from typing import Self
+from typing import Any, Self
 
 import rich.progress
 import rich.table
@@ -16,6 +26,8 @@ from rich.live import Live
 from rich.progress import filesize, Progress
 from rich.text import Text
 
+from furbox.utils.events import events
+
 logger = logging.getLogger(__name__)
 
 
@@ -63,45 +75,124 @@ class MofNWithUnits(rich.progress.MofNCompleteColumn):
 
 
 class ProgressManager:
-    """ Initialise with a Rich live display instance and an empty set of progress bars. """
+    """ Initialise with a Rich live display instance and an empty set of progress bars.
+
+    The live display is refreshed by a single background thread at a fixed rate, which synchronises the counters
+    of every active progress bar into its Rich progress bar as part of rendering.
+    """
+
+    REFRESH_PER_SECOND: int = 10
+    # Interval in seconds between progress events, when emitting events instead of rendering.
+    EVENT_INTERVAL: float = 5.0
 
     def __init__(self) -> None:
-        self.live = Live(console=console, refresh_per_second=10)
-        self.progress_bars: dict[int, Progress] = {}
+        self.progress_bars: dict[int, ProgressBar] = {}
+        self.lock = threading.Lock()
+
+        # Progress bar displayed alone while it is persisted to the console, if any.
+        self._persisting: Progress | None = None
+        self._bar_ids = itertools.count()
+        self._event_thread: threading.Thread | None = None
+
+        self.live = Live(console=console, refresh_per_second=self.REFRESH_PER_SECOND, get_renderable=self.render)
         atexit.register(self.close)
 
+    def add_bar(self, progress_bar: "ProgressBar") -> int:
+        """ Add a progress bar to the live display, returning its unique ID. """
+        bar_id = next(self._bar_ids)
+        with self.lock:
+            self.progress_bars[bar_id] = progress_bar
+
+        if events.enabled:
+            events.emit("start", **progress_bar.event_fields(bar_id))
+            self._start_event_thread()
+            return bar_id
+
+        self.update_display()
+        return bar_id
+
+    def _start_event_thread(self) -> None:
+        """ Start the thread emitting progress events, if it is not already running. """
+        with self.lock:
+            if self._event_thread is not None:
+                return
+
+            self._event_thread = threading.Thread(
+                target=self._emit_progress_events, name="progress-events", daemon=True,
+            )
+            self._event_thread.start()
+
+    def _emit_progress_events(self) -> None:
+        """ Emit a progress event for every active progress bar which has advanced, at a fixed interval. """
+        last_completed: dict[int, int] = {}
+        while True:
+            time.sleep(self.EVENT_INTERVAL)
+            with self.lock:
+                progress_bars = sorted(self.progress_bars.items())
+
+            for bar_id, progress_bar in progress_bars:
+                fields = progress_bar.event_fields(bar_id)
+                if last_completed.get(bar_id) != fields["completed"]:
+                    last_completed[bar_id] = fields["completed"]
+                    events.emit("progress", **fields)
+
+    def render(self) -> Group:
+        """ Synchronise every active progress bar, and render them in the order they were created. """
+        with self.lock:
+            if self._persisting is not None:
+                return Group(self._persisting)
+
+            progress_bars = [self.progress_bars[bar_id] for bar_id in sorted(self.progress_bars)]
+
+        for progress_bar in progress_bars:
+            progress_bar.sync()
+
+        return Group(*(progress_bar.progress for progress_bar in progress_bars))
+
     def update_display(self) -> None:
-        """ Update the live display with an ordered list of active progress bars. """
-        renderables = [self.progress_bars[task_id] for task_id in sorted(self.progress_bars.keys())]
-        self.live.update(Group(*renderables))
+        """ Start the live display if there are active progress bars, otherwise stop it. """
+        with self.lock:
+            active = bool(self.progress_bars)
 
         # If not already running, start the live display.
-        if not renderables:
+        if not active:
             self.live.stop()
         elif not self.live.is_started:
             self.live.start()
 
-    def remove_bar(self, task_id: int, persist: bool) -> None:
+    def remove_bar(self, bar_id: int, persist: bool) -> None:
         """ Remove a progress bar from the live display.
 
         Args:
-            task_id (int): Task ID associated with the progress bar to remove.
+            bar_id (int): ID associated with the progress bar to remove.
             persist (bool): If True, keep the progress bar displayed after removing it. \
                             Otherwise clear the progress bar from the display.
         """
-        # Remove the progress bar associated with the task ID.
-        progress = self.progress_bars.pop(task_id)
+        # Remove the progress bar associated with the ID.
+        with self.lock:
+            progress_bar = self.progress_bars.pop(bar_id)
+            if persist and not events.enabled:
+                self._persisting = progress_bar.progress
+
+        if events.enabled:
+            events.emit("finish", **progress_bar.event_fields(bar_id))
+            return
+
+        progress_bar.sync()
 
         if persist:
-            # Set the live group to display only the specified progress bar, and stop the live display.
-            self.live.update(Group(progress))
+            # Render only the specified progress bar as the live display stops, leaving it on the console.
             self.live.stop()
+            with self.lock:
+                self._persisting = None
 
         self.update_display()
 
     def clear(self) -> None:
         """ Reset all internal state and empty the live display. """
-        self.progress_bars = {}
+        with self.lock:
+            self.progress_bars = {}
+
         self.update_display()
 
     def close(self) -> None:
@@ -122,12 +213,14 @@ class ProgressBar:
     By default Rich does not allow progress bars of different formats to run concurrently. As such, this
     is implemented with a custom ProgressBar class and ProgressManager instance with a live Rich display.
 
+    Progress bars are thread safe, and advancing them is cheap as the display is only updated periodically.
+
     Args:
         description (str, optional): Description to display on the progress bar. Defaults to no description.
         length (int | None, optional): Length of the progress bar. Defaults to None, acting as an indeterminate length.
         chunk_size (int | None, optional):
-            Only refresh the progress bar each time the progress increases by at least this many units.
-            Defaults to None, which will allow updates of smallest increment of size 1.
+            Only display progress in whole multiples of this many units, until the progress bar is complete.
+            Defaults to None, which will display updates of smallest increment of size 1.
         style (ProgressBarStyle, optional): Display style to use. Defaults to "generic".
         persist (bool, optional): Leave the progress bar on screen after completion if True. Defaults to True.
     """
@@ -138,14 +231,18 @@ class ProgressBar:
     ) -> None:
         self.progress = self._create_progress_bar(style)
         self.task_id = self.progress.add_task(description=description, total=length)
+        self.description = description
+        self.style = style
         self.persist = persist
-        self.advance_buffer = 0
         self.chunk_size = chunk_size
+        self.start_time = time.monotonic()
 
-        self.bar_id = len(_progress_manager.progress_bars)
+        # Counters are only ever modified under the lock, and copied to the Rich progress bar when rendered.
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.length = length
 
-        _progress_manager.progress_bars[self.bar_id] = self.progress
-        _progress_manager.update_display()
+        self.bar_id = _progress_manager.add_bar(self)
 
     def __enter__(self) -> Self:
         """ Allow the progress bar to be initialised in a context manager. """
@@ -162,40 +259,49 @@ class ProgressBar:
         Args:
             length (int, optional): Amount to advance the progress bar by. Defaults to 1.
         """
-        # Get the task object associated with the progress bar's task ID.
-        task = self.progress._tasks[self.task_id]
-
-        advance = length
+        with self.lock:
+            self.completed += length
 
-        # If a total is set for the bar, limit advances such that they cannot overshoot the length of the bar.
-        if task.total and task.completed + advance >= task.total:
-            advance = task.total - task.completed
-            self.advance_buffer = 0
-
-        elif self.chunk_size:
-            self.advance_buffer += advance
-
-            # Increment the progress bar in whole numbers of chunks, leaving any remainders in the advance buffer.
-            advance = (self.advance_buffer // self.chunk_size) * self.chunk_size
-            self.advance_buffer %= self.chunk_size
-
-        # If the progress bar is to be advanced by any amount, update it and refresh.
-        if advance:
-            self.progress.update(self.task_id, advance=advance, refresh=True)
-            _progress_manager.live.refresh()
+            # If a total is set for the bar, limit advances such that they cannot overshoot the length of the bar.
+            if self.length and self.completed > self.length:
+                self.completed = self.length
 
     def set_length(self, length: int) -> None:
         """ Set the length of the progress bar. """
-        self.progress.update(self.task_id, total=length)
+        with self.lock:
+            self.length = length
+
+    def sync(self) -> None:
+        """ Copy the counters of the progress bar to the Rich progress bar, ready to be rendered. """
+        with self.lock:
+            completed, length = self.completed, self.length
+
+        # Display progress in whole chunks, unless the progress bar is complete.
+        if self.chunk_size and completed != length:
+            completed -= completed % self.chunk_size
+
+        self.progress.update(self.task_id, completed=completed, total=length)
+
+    def event_fields(self, bar_id: int) -> dict[str, Any]:
+        """ Get the fields describing the progress bar in emitted events. """
+        with self.lock:
+            completed, length = self.completed, self.length
+
+        return {
+            "bar": bar_id,
+            "description": self.description,
+            "unit": "bytes" if self.style == ProgressBarStyle.FILE else "items",
+            "completed": completed,
+            "total": length,
+            "elapsed": round(time.monotonic() - self.start_time, 3),
+        }
 
     def close(self) -> None:
         """ Finish and close the progress bar. """
-        task = self.progress._tasks[self.task_id]
-
         # If the progress bar did not have a total, set the total to the completed value before finishing it.
-        if not task.total:
-            self.progress.update(self.task_id, total=task.completed, completed=task.completed)
-            _progress_manager.live.refresh()
+        with self.lock:
+            if not self.length:
+                self.length = self.completed
 
         _progress_manager.remove_bar(self.bar_id, persist=self.persist)
 
@@ -0,0 +1,119 @@
+""" Shared fixtures for benchmarks, recording results such that runs can be compared to catch regressions. """
+import json
+import platform
+from collections.abc import Iterator
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import pytest
+
+# Key of the pytest cache to keep the results of the last run in, when no results file is given.
+CACHE_KEY = "furbox/benchmarks"
+
+
+class BenchmarkResult(NamedTuple):
+    """ Named tuple of the rows processed by a benchmark, the time taken, and the peak memory allocated. """
+
+    name:        str
+    rows:        int
+    seconds:     float
+    peak_memory: int
+
+    @property
+    def rows_per_second(self) -> float:
+        """ Rows processed per second. """
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class BenchmarkResults:
+    """ Results of every benchmark in a run, compared against the same benchmark at the same scale in earlier runs.
+
+    Results are compared against a results file if one is given, which keeps the history of every run recorded
+    in it. Otherwise results are only compared against the last run, kept in the pytest cache.
+
+    Args:
+        cache (pytest.Cache): Pytest cache to keep the last run in.
+        results_file (Path | None): JSON file of earlier runs, or None to only use the pytest cache.
+        max_regression (float): Fraction that throughput may drop by against a results file.
+    """
+
+    def __init__(self, cache: pytest.Cache, results_file: Path | None, max_regression: float) -> None:
+        self.cache = cache
+        self.results_file = results_file
+        self.max_regression = max_regression
+        self.results: dict[str, dict[str, Any]] = {}
+
+        self.runs: list[dict[str, Any]] = []
+        if results_file is not None and results_file.exists():
+            self.runs = json.loads(results_file.read_text(encoding="utf-8"))["runs"]
+        elif results_file is None and (last_run := cache.get(CACHE_KEY, None)):
+            self.runs = [last_run]
+
+    def previous(self, result: BenchmarkResult) -> dict[str, Any] | None:
+        """ Get the most recent earlier result of the same benchmark at the same scale, if any. """
+        for run in reversed(self.runs):
+            if (previous := run["results"].get(result.name)) and previous["rows"] == result.rows:
+                return previous
+
+        return None
+
+    def record(self, result: BenchmarkResult) -> str | None:
+        """ Record and report a result, comparing it with the previous result of the same benchmark.
+
+        Returns:
+            str | None: Description of the regression if throughput dropped by more than allowed against \
+                        a results file, otherwise None.
+        """
+        self.results[result.name] = {
+            "rows": result.rows,
+            "seconds": round(result.seconds, 6),
+            "rows_per_second": round(result.rows_per_second, 1),
+            "peak_memory": result.peak_memory,
+        }
+
+        report = (f"\n{result.name}: {result.rows_per_second:,.0f} rows/s, peak memory "
+                  f"{result.peak_memory / 2**20:,.1f} MiB for {result.rows:,} rows")
+        if (previous := self.previous(result)) is None:
+            print(report)
+            return None
+
+        change = result.rows_per_second / previous["rows_per_second"] - 1
+        print(f"{report} ({change:+.1%} throughput against the previous run)")
+
+        if self.results_file is not None and change < -self.max_regression:
+            return (f"{result.name} throughput dropped by {-change:.1%}, "
+                    f"more than the {self.max_regression:.0%} allowed")
+        return None
+
+    def save(self) -> None:
+        """ Save the results of this run to the results file if given, and otherwise to the pytest cache. """
+        if not self.results:
+            return
+
+        run = {
+            "date": datetime.now(UTC).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": self.results,
+        }
+
+        if self.results_file is None:
+            self.cache.set(CACHE_KEY, run)
+            return
+
+        self.results_file.parent.mkdir(parents=True, exist_ok=True)
+        self.results_file.write_text(json.dumps({"runs": [*self.runs, run]}, indent=4) + "\n", encoding="utf-8")
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(pytestconfig: pytest.Config) -> Iterator[BenchmarkResults]:
+    """ Results of the benchmarks in this run, saved once every benchmark has finished. """
+    assert pytestconfig.cache is not None
+    results = BenchmarkResults(
+        cache=pytestconfig.cache,
+        results_file=pytestconfig.getoption("benchmark_results"),
+        max_regression=pytestconfig.getoption("benchmark_max_regression"),
+    )
+    yield results
+    results.save()
@@ -0,0 +1,226 @@
+""" Benchmarks of parsing models from API responses and database dumps, at a scale set by `--benchmark-rows`.
+
+Synthetic inputs are generated once for each scale and kept in the pytest cache, such that large scales
+(Ex. `--benchmark-rows 5000000`) only pay the cost of generating their inputs on the first run.
+"""
+import csv
+import gzip
+import itertools
+import json
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import pytest
+
+from furbox.connectors.e621 import E621DbConnector
+from furbox.connectors.search_index import SearchIndex
+from furbox.models.e621 import Pool, Post, Tag
+from tests.benchmarks.conftest import BenchmarkResult, BenchmarkResults
+from tests.e621_server import MAX_LIMIT, SyntheticData
+
+# Rows of each database dump read and parsed at a time, standing in for the pages of an API response.
+CHUNK_SIZE = MAX_LIMIT
+
+# Number of posts in each synthetic pool.
+POOL_SIZE = 20
+
+# Queries resolved by the search index benchmark, from a single rare tag up to metatags scanning every post.
+SEARCH_QUERIES = (
+    "artist_40",
+    "species_0 general_0 -general_1",
+    "~character_10 ~character_20 rating:s order:score",
+    "score:>10 favcount:<50 order:favcount",
+)
+
+
+class SyntheticInputs(NamedTuple):
+    """ Named tuple of the paths of synthetic API responses and database dumps, and the rows in each. """
+
+    rows:      int
+    api_posts: Path
+    api_tags:  Path
+    db_posts:  Path
+    db_pools:  Path
+
+
+def write_api_pages(path: Path, responses: Iterator[dict[str, Any]]) -> None:
+    """ Write responses as gzipped JSON lines, with each line holding a full page of responses. """
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for page in itertools.batched(responses, MAX_LIMIT):
+            f.write(json.dumps(page) + "\n")
+
+
+def generate_inputs(directory: Path, rows: int) -> SyntheticInputs:
+    """ Generate synthetic API responses and database dumps, reusing any generated by an earlier run. """
+    inputs = SyntheticInputs(
+        rows=rows,
+        api_posts=directory / f"api-posts-{rows}.jsonl.gz",
+        api_tags=directory / f"api-tags-{rows}.jsonl.gz",
+        db_posts=directory / f"posts-{rows}.csv.gz",
+        db_pools=directory / f"pools-{rows}.csv.gz",
+    )
+    data = SyntheticData(post_count=0, pool_count=0)
+
+    def generate(path: Path, write: Callable[[Path], None]) -> None:
+        """ Generate a file if it does not yet exist, moving it into place only once complete. """
+        if not path.exists():
+            tmp_path = path.with_name(f"_{path.name}")
+            write(tmp_path)
+            tmp_path.replace(path)
+
+    def write_posts(api_path: Path, db_path: Path) -> None:
+        """ Write API responses and database rows for the same posts, generating each post only once. """
+        posts = map(data.generate_post, range(1, rows + 1))
+        with gzip.open(api_path, "wt", encoding="utf-8") as api, db_path.open("wb") as db:
+            api_posts, db_posts = itertools.tee(posts)
+            rows_written = map(data.post_row, db_posts)
+            for page in itertools.batched(api_posts, MAX_LIMIT):
+                api.write(json.dumps([data.post_response(post, "https://e621.net") for post in page]) + "\n")
+            data.write_database_dump(db, rows_written)
+
+    if not (inputs.api_posts.exists() and inputs.db_posts.exists()):
+        tmp_api, tmp_db = (path.with_name(f"_{path.name}") for path in (inputs.api_posts, inputs.db_posts))
+        write_posts(tmp_api, tmp_db)
+        tmp_api.replace(inputs.api_posts)
+        tmp_db.replace(inputs.db_posts)
+
+    generate(inputs.api_tags, lambda path: write_api_pages(
+        path, (data.tag_response(data.generate_tag(tag_id)) for tag_id in range(1, rows + 1)),
+    ))
+
+    def write_pools(path: Path) -> None:
+        pools = (
+            data.generate_pool(pool_id, [(pool_id + offset) % rows + 1 for offset in range(POOL_SIZE)])
+            for pool_id in range(1, rows + 1)
+        )
+        with path.open("wb") as f:
+            data.write_database_dump(f, map(data.pool_row, pools))
+
+    generate(inputs.db_pools, write_pools)
+    return inputs
+
+
+@pytest.fixture(scope="module")
+def synthetic_inputs(pytestconfig: pytest.Config) -> SyntheticInputs:
+    """ Synthetic API responses and database dumps, at the scale given by `--benchmark-rows`. """
+    assert pytestconfig.cache is not None
+    return generate_inputs(pytestconfig.cache.mkdir("furbox-synthetic"), pytestconfig.getoption("benchmark_rows"))
+
+
+def iter_api_pages(path: Path) -> Iterator[list[dict[str, Any]]]:
+    """ Read each page of API responses. """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_database_chunks(path: Path) -> Iterator[list[dict[str, Any]]]:
+    """ Read the rows of a database dump, a chunk at a time. """
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        for chunk in itertools.batched(csv.DictReader(f), CHUNK_SIZE):
+            yield list(chunk)
+
+
+def measure(name: str, run: Callable[[], tuple[int, float]]) -> BenchmarkResult:
+    """ Time a run, then run it again to measure the peak memory it allocates, as tracing slows it down.
+
+    Args:
+        name (str): Name of the benchmark.
+        run (Callable[[], tuple[int, float]]): Run of the benchmark, returning the number of rows processed and \
+                                               the seconds spent processing them, such that a run may exclude \
+                                               the time spent preparing its inputs.
+
+    Returns:
+        BenchmarkResult: Result of the benchmark.
+    """
+    rows, seconds = run()
+
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return BenchmarkResult(name=name, rows=rows, seconds=seconds, peak_memory=peak_memory)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize(("name", "input_name", "parse"), [
+    ("Post.from_api", "api_posts", Post.from_api),
+    ("Post.from_database", "db_posts", Post.from_database),
+    ("Pool.from_database", "db_pools", Pool.from_database),
+    ("Tag.from_api", "api_tags", Tag.from_api),
+])
+def test_model_parsing(
+    name: str, input_name: str, parse: Callable[[dict[str, Any]], Any], synthetic_inputs: SyntheticInputs,
+    benchmark_results: BenchmarkResults,
+) -> None:
+    """ Parse every row into a model, keeping each parsed model as callers do, excluding the time to read rows. """
+    path: Path = getattr(synthetic_inputs, input_name)
+    chunks = iter_api_pages if input_name.startswith("api") else iter_database_chunks
+
+    def run() -> tuple[int, float]:
+        """ Parse chunk by chunk, such that reading and decoding the input is excluded from the time taken. """
+        parsed = []
+        seconds = 0.0
+        for chunk in chunks(path):
+            start = time.perf_counter()
+            parsed.extend([parse(row) for row in chunk])
+            seconds += time.perf_counter() - start
+        return len(parsed), seconds
+
+    result = measure(name, run)
+
+    assert result.rows == synthetic_inputs.rows
+    assert (regression := benchmark_results.record(result)) is None, regression
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize(("name", "input_name", "model"), [
+    ("E621DbConnector._parse_database[posts]", "db_posts", Post),
+    ("E621DbConnector._parse_database[pools]", "db_pools", Pool),
+])
+def test_parse_database(
+    name: str, input_name: str, model: type[Pool], synthetic_inputs: SyntheticInputs,
+    *, benchmark_results: BenchmarkResults, tmp_path: Path,
+) -> None:
+    """ Parse a full database dump from disk, including decompressing and reading the dump. """
+    path: Path = getattr(synthetic_inputs, input_name)
+    db_connector = E621DbConnector(tmp_path)
+
+    def run() -> tuple[int, float]:
+        start = time.perf_counter()
+        rows = len(db_connector._parse_database(path, model))
+        return rows, time.perf_counter() - start
+
+    result = measure(name, run)
+
+    assert result.rows == synthetic_inputs.rows
+    assert (regression := benchmark_results.record(result)) is None, regression
+
+
+@pytest.mark.benchmark
+def test_search_index(synthetic_inputs: SyntheticInputs, benchmark_results: BenchmarkResults) -> None:
+    """ Build a search index from the posts dump, then resolve queries against it, each counting every post. """
+    def build() -> tuple[int, float]:
+        start = time.perf_counter()
+        rows = len(SearchIndex.build(synthetic_inputs.db_posts))
+        return rows, time.perf_counter() - start
+
+    result = measure("SearchIndex.build", build)
+    assert result.rows == synthetic_inputs.rows
+    assert (regression := benchmark_results.record(result)) is None, regression
+
+    search_index = SearchIndex.build(synthetic_inputs.db_posts)
+    for query in SEARCH_QUERIES:
+        def search(query: str = query) -> tuple[int, float]:
+            start = time.perf_counter()
+            search_index.search(query)
+            return len(search_index), time.perf_counter() - start
+
+        result = measure(f"SearchIndex.search[{query}]", search)
+        assert (regression := benchmark_results.record(result)) is None, regression
@@ -0,0 +1,162 @@
+""" Benchmarks of end-to-end throughput of the e621 connectors, downloader and runners, against a local server. """
+import json
+import math
+import time
+from pathlib import Path
+
+import pytest
+
+from furbox.connectors.downloader import download_files, UrlFileTarget
+from furbox.connectors.e621 import E621Connector, E621DbConnector
+from furbox.models.config import Config
+from furbox.runners.comics import update_comics
+from furbox.runners.e621.download import download_search
+from furbox.runners.e621.fav_sync import sync_favourites
+from tests.e621_server import E621Server
+
+# Seconds the stand-in server waits before answering each request, standing in for the round trip to e621.
+LATENCY = 0.02
+
+# Time spent by the connector per post, beyond waiting for the server, must stay below this many seconds.
+MAX_POST_OVERHEAD = 0.001
+
+
+def make_config(e621_server: E621Server, tmp_path: Path) -> Config:
+    """ Create config with every library directory and cache within a temporary directory. """
+    fav_paths = {rating: tmp_path / "favourites" / rating for rating in ("safe", "questionable", "explicit")}
+    for path in fav_paths.values():
+        path.mkdir(parents=True)
+
+    comics_path = tmp_path / "comics"
+    comics_path.mkdir()
+    (comics_path / "comics.yaml").write_text(json.dumps({
+        "e621": [{"pool_id": pool_id} for pool_id in e621_server.data.pools],
+    }), encoding="utf-8")
+
+    return Config(
+        comics=Config.Comics(base_path=comics_path, database_file="comics.yaml"),
+        e621=Config.E621(username="furbox", api_key="api_key", fav_paths=Config.E621.FavPaths(**fav_paths)),
+        misc=Config.Misc(cache_dir=str(tmp_path / "cache")),
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("e621_server", [{"post_count": 10_000}], indirect=True)
+def test_get_posts_throughput(e621_server: E621Server, e621_connector: E621Connector) -> None:
+    """ Fetching posts should be bound by the latency of each page, not by handling the posts received. """
+    e621_server.latency = LATENCY
+
+    start = time.perf_counter()
+    posts = e621_connector.get_posts("")
+    elapsed = time.perf_counter() - start
+
+    pages = e621_server.count("/posts.json")
+    overhead = (elapsed - pages * LATENCY) / len(posts)
+    print(f"\nget_posts: {len(posts) / elapsed:.0f} posts/s over {pages} pages, "
+          f"{overhead * 1e6:.0f} µs per post beyond server latency")
+
+    assert len(posts) == 10_000
+    assert pages == math.ceil(len(posts) / E621Connector.PAGE_LIMIT)
+    assert overhead < MAX_POST_OVERHEAD
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("e621_server", [{"post_count": 200}], indirect=True)
+def test_download_files_throughput(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ Downloads should overlap, such that most of the latency of each file is hidden by other downloads. """
+    e621_server.latency = LATENCY
+    threads = 8
+
+    posts = e621_connector.get_posts("")
+    file_targets = [
+        UrlFileTarget.create(url=post["files"]["original"]["url"], file_name=str(post["id"]),
+                             download_directory=tmp_path, size=post["files"]["meta"]["size"])
+        for post in posts
+    ]
+
+    start = time.perf_counter()
+    report = download_files(file_targets, description="Benchmarking downloads", threads=threads)
+    elapsed = time.perf_counter() - start
+
+    total_bytes = sum(path.stat().st_size for path in tmp_path.iterdir())
+    print(f"\ndownload_files: {len(report.results) / elapsed:.0f} files/s, {total_bytes / elapsed / 2**20:.1f} MiB/s "
+          f"with {threads} threads")
+
+    assert len(report.results) == len(file_targets)
+    assert total_bytes == sum(target.size or 0 for target in file_targets)
+    # Downloading on a quarter of the threads at once leaves headroom for connection setup and file handling.
+    assert elapsed < len(file_targets) * LATENCY / (threads / 4)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("e621_server", [{"post_count": 3 * E621Connector.PAGE_LIMIT}], indirect=True)
+def test_download_search_overlap(
+    e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """ Downloading a search should overlap listing and downloading, rather than take the sum of both. """
+    e621_server.latency = LATENCY / 2
+    monkeypatch.setattr(E621Connector, "API_DELAY", 1.0)
+
+    start = time.perf_counter()
+    posts = e621_connector.get_posts("")
+    listing_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    download_files([
+        UrlFileTarget.create(url=post["files"]["original"]["url"], file_name=str(post["id"]),
+                             download_directory=tmp_path / "sequential", size=post["files"]["meta"]["size"])
+        for post in posts
+    ], description="Benchmarking downloads")
+    download_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exit_code = download_search(e621_connector, "", download_directory=tmp_path / "streamed")
+    streamed_time = time.perf_counter() - start
+
+    print(f"\ndownload_search: {streamed_time:.2f} s streamed, against {listing_time:.2f} s listing and "
+          f"{download_time:.2f} s downloading one after the other")
+
+    assert exit_code is None
+    assert len(list((tmp_path / "streamed").iterdir())) == len(posts)
+    assert streamed_time < (listing_time + download_time) * 0.85
+
+
+@pytest.mark.benchmark
+def test_fav_sync_throughput(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ A first sync should download every favourite, after which a sync should only fetch favourites. """
+    e621_server.latency = LATENCY
+    config = make_config(e621_server, tmp_path)
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        sync_favourites(config, e621_connector=e621_connector)
+        timings.append(time.perf_counter() - start)
+
+    files = [path for path in (tmp_path / "favourites").rglob("*") if path.is_file()]
+    print(f"\nfav-sync: first sync of {len(files)} favourites {timings[0]:.2f} s, "
+          f"unchanged sync {timings[1]:.2f} s")
+
+    assert len(files) == len(e621_server.data.favourites)
+    assert e621_server.count("/data/") == len(files)
+
+
+@pytest.mark.benchmark
+def test_comics_update_throughput(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ A first update should download every comic, after which unchanged pools should need no post searches. """
+    e621_server.latency = LATENCY
+    config = make_config(e621_server, tmp_path)
+    db_connector = E621DbConnector(config.misc.cache_dir, base_url=e621_server.url)
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        update_comics(config, use_db=True, e621_connector=e621_connector, db_connector=db_connector)
+        timings.append(time.perf_counter() - start)
+
+    pages = [path for path in (tmp_path / "comics").rglob("*") if path.is_file() and not path.name.startswith(".")]
+    print(f"\ncomics-update: first update of {len(pages)} pages {timings[0]:.2f} s, "
+          f"unchanged update {timings[1]:.2f} s")
+
+    assert len(pages) == sum(len(pool["post_ids"]) for pool in e621_server.data.pools.values()) + 1
+    assert e621_server.count("/posts.json") == len(e621_server.data.pools)
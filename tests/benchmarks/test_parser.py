@@ -0,0 +1,60 @@
+""" Benchmarks comparing the HTML parser backends for custom comic instructions, over saved pages. """
+import time
+from pathlib import Path
+
+import pytest
+
+from furbox.helpers.comic.parser import get_parser, HtmlParser
+from furbox.models.comic import CustomComic
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+ITERATIONS = 20
+
+Instruction = CustomComic.Instruction
+
+# Instructions to run against each fixture, mirroring a typical comic definition.
+FIXTURE_INSTRUCTIONS: dict[str, list[list[Instruction]]] = {
+    "comic_page.html": [
+        [Instruction(html_type="div", attrs={"id": "comic"}), Instruction(html_type="img", index=None)],
+        [Instruction(html_type="a", attrs={"rel": "prev"})],
+        [Instruction(html_type="a", attrs={"class": "latest"})],
+        [Instruction(html_type="div", attrs={"class": "comic-nav"}, index=-1), Instruction(html_type="a", text="Next")],
+    ],
+    "archive_page.html": [
+        [Instruction(html_type="ul", attrs={"id": "archive-list"}), Instruction(html_type="a", index=None)],
+    ],
+}
+
+
+def extract(parser: HtmlParser, text: str, instructions: list[list[Instruction]]) -> tuple[float, list[list[str]]]:
+    """ Parse a page and run each list of instructions against it, returning the mean time and the results. """
+    selectors = [parser.compile(instruction_list) for instruction_list in instructions]
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        document = parser.parse(text)
+        results = [
+            [element.get("href") or element.get("src") for element in selector.select(document)]
+            for selector in selectors
+        ]
+
+    return (time.perf_counter() - start) / ITERATIONS, results
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("fixture_name", FIXTURE_INSTRUCTIONS)
+def test_parser_backends(fixture_name: str) -> None:
+    """ Both backends should extract the same elements, with the time taken by each reported. """
+    pytest.importorskip("lxml")
+
+    text = (FIXTURES_DIR / fixture_name).read_text(encoding="utf-8")
+    instructions = FIXTURE_INSTRUCTIONS[fixture_name]
+
+    soup_time, soup_results = extract(get_parser("beautifulsoup"), text, instructions)
+    lxml_time, lxml_results = extract(get_parser("lxml"), text, instructions)
+
+    assert lxml_results == soup_results
+    assert all(soup_results)
+
+    print(f"\n{fixture_name}: beautifulsoup {soup_time * 1000:.2f} ms, lxml {lxml_time * 1000:.2f} ms "
+          f"({soup_time / lxml_time:.1f}x)")
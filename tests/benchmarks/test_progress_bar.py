@@ -0,0 +1,49 @@
+""" Microbenchmark of progress bar accounting, relative to the download loop it is used in. """
+import hashlib
+import threading
+import time
+
+import pytest
+
+from furbox.utils.progress_bar import ProgressBar
+
+ADVANCES = 1_000_000
+THREADS = 4
+CHUNK = bytes(1024 * 128)
+
+# Progress accounting must cost less than this fraction of the time taken to process a single chunk.
+MAX_OVERHEAD_FRACTION = 0.01
+
+
+@pytest.mark.benchmark
+def test_progress_bar_advance_overhead() -> None:
+    """ Advancing from several threads should be exact, and cost a negligible fraction of a hot loop. """
+    per_thread = ADVANCES // THREADS
+
+    with ProgressBar("Benchmarking progress", length=ADVANCES, persist=False) as progress:
+        def advance_many() -> None:
+            for _ in range(per_thread):
+                progress.advance()
+
+        workers = [threading.Thread(target=advance_many) for _ in range(THREADS)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        advance_time = (time.perf_counter() - start) / ADVANCES
+
+        assert progress.completed == ADVANCES
+
+    # Hashing a download sized chunk stands in for the work done per advance in the download loop.
+    md5 = hashlib.md5()  # noqa: S324
+    iterations = 200
+    start = time.perf_counter()
+    for _ in range(iterations):
+        md5.update(CHUNK)
+    chunk_time = (time.perf_counter() - start) / iterations
+
+    print(f"\nProgressBar.advance: {advance_time * 1e9:.0f} ns, "
+          f"{advance_time / chunk_time:.3%} of processing a {len(CHUNK) // 1024} KiB chunk")
+
+    assert advance_time / chunk_time < MAX_OVERHEAD_FRACTION
@@ -0,0 +1,43 @@
+""" Benchmark of command line startup, relative to the command line framework it is built on.
+
+Only importing the selected runner is checked deterministically in `tests/test_main.py`. This benchmark is timing
+sensitive, so is deselected unless run with `-m benchmark`.
+"""
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Show help as the entrypoint does.
+SHOW_HELP = """
+from furbox import main
+
+try:
+    main.parse_args(["--help"])
+except SystemExit:
+    pass
+"""
+
+# Showing help may take at most this many seconds longer than importing the command line framework alone.
+MAX_STARTUP_OVERHEAD = 0.25
+REPEATS = 5
+
+
+def time_python(*args: str) -> float:
+    """ Run a Python subprocess, returning the time it took. """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], capture_output=True, check=True)  # noqa: S603
+    return time.perf_counter() - start
+
+
+@pytest.mark.benchmark
+def test_help_startup_time() -> None:
+    """ Showing help should cost little more than importing the command line framework it is built on. """
+    framework_time = min(time_python("-c", "import fluffless.utils.cli") for _ in range(REPEATS))
+    help_time = min(time_python("-c", SHOW_HELP) for _ in range(REPEATS))
+
+    print(f"\nfurbox --help: {help_time * 1e3:.0f} ms, {(help_time - framework_time) * 1e3:.0f} ms over "
+          f"importing the command line framework")
+
+    assert help_time - framework_time < MAX_STARTUP_OVERHEAD
@@ -0,0 +1,46 @@
+""" Shared fixtures, providing a local stand-in for e621 such that connectors can be exercised offline. """
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from furbox.connectors.e621 import E621Connector
+from tests.e621_server import E621Server, SyntheticData
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    """ Add options to scale benchmarks, and to compare their results with earlier runs. """
+    group = parser.getgroup("furbox benchmarks")
+    group.addoption(
+        "--benchmark-rows", type=int, default=10_000,
+        help="Number of rows to generate for model parsing and database dump benchmarks. Defaults to 10000.",
+    )
+    group.addoption(
+        "--benchmark-results", type=Path,
+        help="JSON file of results from earlier runs, to compare this run against and then record it in.",
+    )
+    group.addoption(
+        "--benchmark-max-regression", type=float, default=0.2,
+        help="Fraction that throughput may drop by against the results file before a benchmark fails. "
+             "Defaults to 0.2.",
+    )
+
+
+@pytest.fixture
+def e621_server(request: pytest.FixtureRequest) -> Iterator[E621Server]:
+    """ Stand-in e621 server, serving synthetic data generated from any arguments given by indirect parametrisation.
+
+    Example usage with a larger data set: ::
+
+        @pytest.mark.parametrize("e621_server", [{"post_count": 10_000}], indirect=True)
+        def test_many_posts(e621_server: E621Server) -> None: ...
+    """
+    with E621Server(SyntheticData(**getattr(request, "param", {}))) as server:
+        yield server
+
+
+@pytest.fixture
+def e621_connector(e621_server: E621Server, monkeypatch: pytest.MonkeyPatch) -> E621Connector:
+    """ Connector to the stand-in e621 server, without any delay between requests. """
+    monkeypatch.setattr(E621Connector, "API_DELAY", 0)
+    return E621Connector(username="furbox", api_key="api_key", backend_url=e621_server.url)
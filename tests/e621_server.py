@@ -0,0 +1,602 @@
+""" Local stand-in for the e621 API, serving synthetic data with configurable latency and injected errors.
+
+The server emulates the endpoints used by the e621 connectors, closely enough for the connectors and the
+runners built on them to be exercised offline:
+
+    /posts.json          Post search, paged by page number or `b{id}`, with a subset of the query syntax.
+    /pools/{id}.json     A single pool.
+    /pools.json          Pools by `search[id]`.
+    /tags.json           Tags by `search[name_matches]`, optionally limited to a `search[category]`.
+    /db_export/          Index of database dumps, and gzipped CSV dumps of posts and pools.
+    /data/...            Post files, with deterministic content matching the MD5 hash of each post.
+    /data/sample/...     Scaled down samples of posts wider than the sample width, and previews of every post.
+    /data/preview/...
+
+Example usage of the stand-in server: ::
+
+    with E621Server(SyntheticData(post_count=1000)) as server:
+        server.latency = 0.05
+        server.fail_next(2, status=429)
+        connector = E621Connector(username="furbox", api_key="api_key", backend_url=server.url)
+"""
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterable
+from datetime import datetime, timedelta, UTC
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import TracebackType
+from typing import Any, BinaryIO, cast, Self
+from urllib.parse import parse_qs, urlsplit
+
+# Categories of tags assigned to synthetic posts, with the category ID e621 uses for each.
+TAG_CATEGORIES = {"general": 0, "artist": 1, "copyright": 3, "character": 4, "species": 5, "meta": 7}
+EXTENSIONS = ("jpg", "png", "gif", "webm")
+
+# Tags which synthetic posts are tagged with, and their weights such that usage follows a long tailed distribution.
+VOCABULARY = {
+    "general": [f"general_{i}" for i in range(500)],
+    "artist": [f"artist_{i}" for i in range(50)],
+    "copyright": [f"copyright_{i}" for i in range(20)],
+    "character": [f"character_{i}" for i in range(100)],
+    "species": [f"species_{i}" for i in range(40)],
+    "meta": ["digital_media_(artwork)", "hi_res", "comic", "animated"],
+}
+WEIGHTS = {category: list(itertools.accumulate(1 / (rank + 1) for rank in range(len(tags))))
+           for category, tags in VOCABULARY.items()}
+
+# Maximum values accepted by e621, beyond which requests are rejected.
+MAX_LIMIT = 320
+MAX_PAGE = 750
+
+EPOCH = datetime(2020, 1, 1, tzinfo=UTC)
+
+# Width samples are scaled down to, and the largest dimension of previews, as for e621.
+SAMPLE_WIDTH = 850
+PREVIEW_SIZE = 150
+
+
+class SyntheticData:
+    """ Deterministic synthetic posts, pools and tags, shaped like the responses and database dumps of e621.
+
+    Tag usage follows a long tailed distribution, such that a few tags are on most posts as on e621. Each post
+    is generated from its own ID, such that posts may also be generated one at a time at any scale, without
+    holding every post in memory.
+
+    Args:
+        post_count (int, optional): Number of posts, with IDs from 1. Defaults to 1000.
+        pool_count (int, optional): Number of pools, each of consecutive posts. Defaults to 10.
+        pool_size (int, optional): Number of posts in each pool. Defaults to 20.
+        favourite_fraction (float, optional): Fraction of posts favourited by every user. Defaults to 0.1.
+        file_size (tuple[int, int], optional): Range of file sizes in bytes. Defaults to 1 to 16 KiB.
+        seed (int, optional): Seed for all generated data. Defaults to 0.
+    """
+
+    def __init__(
+        self, *, post_count: int = 1000, pool_count: int = 10, pool_size: int = 20, favourite_fraction: float = 0.1,
+        file_size: tuple[int, int] = (1024, 16 * 1024), seed: int = 0,
+    ) -> None:
+        self.seed = seed
+        self.file_size = file_size
+        rng = random.Random(seed)  # noqa: S311
+
+        self.posts = {post_id: self.generate_post(post_id) for post_id in range(1, post_count + 1)}
+        self.posts_by_md5 = {post["md5"]: post_id for post_id, post in self.posts.items()}
+        self.favourites = {post_id for post_id in self.posts if rng.random() < favourite_fraction}
+
+        self.pools: dict[int, dict[str, Any]] = {}
+        for pool_id in range(1, pool_count + 1):
+            start = rng.randint(1, max(post_count - pool_size, 1))
+            post_ids = list(range(start, min(start + pool_size, post_count + 1)))
+            for post_id in post_ids:
+                self.posts[post_id]["pools"].append(pool_id)
+
+            self.pools[pool_id] = self.generate_pool(pool_id, post_ids)
+
+        tag_counts = Counter(
+            (tag, category) for post in self.posts.values() for category, tags in post["tags"].items() for tag in tags
+        )
+        self.tags = {
+            tag: {"id": tag_id, "name": tag, "post_count": count, "category": TAG_CATEGORIES[category]}
+            for tag_id, ((tag, category), count) in enumerate(sorted(tag_counts.items()), start=1)
+        }
+
+        # Post IDs in the order searches return them, newest first.
+        self.post_ids = sorted(self.posts, reverse=True)
+
+    def generate_post(self, post_id: int) -> dict[str, Any]:
+        """ Generate the fields e621 stores for a post, which are shaped into API responses or dump rows. """
+        rng = random.Random(f"{self.seed}:{post_id}")  # noqa: S311
+
+        def pick(category: str, count: int) -> list[str]:
+            return sorted(set(rng.choices(VOCABULARY[category], cum_weights=WEIGHTS[category], k=count)))
+
+        tags = {
+            "general": pick("general", rng.randint(5, 30)),
+            "artist": pick("artist", 1) + (["conditional_dnp"] if rng.random() < 0.05 else []),
+            "copyright": pick("copyright", rng.randint(0, 1)),
+            "character": pick("character", rng.randint(0, 2)),
+            "species": pick("species", rng.randint(1, 3)),
+            "meta": pick("meta", rng.randint(0, 2)),
+        }
+        size = rng.randint(*self.file_size)
+        return {
+            "id": post_id,
+            "created_at": EPOCH + timedelta(minutes=post_id),
+            "rating": rng.choices("sqe", (5, 2, 3))[0],
+            "tags": tags,
+            "tag_set": set().union(*tags.values()),
+            "width": rng.randint(500, 4000),
+            "height": rng.randint(500, 4000),
+            "size": size,
+            "ext": rng.choices(EXTENSIONS, (60, 30, 5, 5))[0],
+            "md5": hashlib.md5(self.file_content(post_id, size)).hexdigest(),  # noqa: S324
+            "score": (rng.randint(0, 500), rng.randint(0, 20)),
+            "fav_count": rng.randint(0, 1000),
+            "uploader_id": rng.randint(1, 1000),
+            "pools": [],
+        }
+
+    def generate_pool(self, pool_id: int, post_ids: list[int]) -> dict[str, Any]:
+        """ Generate the fields e621 stores for a pool of posts. """
+        return {
+            "id": pool_id,
+            "name": f"Synthetic_Comic_{pool_id}",
+            "created_at": EPOCH + timedelta(days=pool_id),
+            "updated_at": EPOCH + timedelta(days=pool_id, hours=1),
+            "creator_id": pool_id % 1000 + 1,
+            "description": f"Synthetic pool {pool_id}",
+            "is_active": True,
+            "category": "series",
+            "post_ids": post_ids,
+        }
+
+    def add_post(self, post_id: int) -> None:
+        """ Add a post to the data, such as to stand in for a newly uploaded post. """
+        self.posts[post_id] = post = self.generate_post(post_id)
+        self.posts_by_md5[post["md5"]] = post_id
+        self.post_ids = sorted(self.posts, reverse=True)
+
+    def remove_post(self, post_id: int) -> None:
+        """ Remove a post from the data, such as to stand in for a deleted post. """
+        post = self.posts.pop(post_id)
+        self.posts_by_md5.pop(post["md5"])
+        self.post_ids.remove(post_id)
+
+    def file_content(self, post_id: int, size: int) -> bytes:
+        """ Get the deterministic content of the file of a post. """
+        block = hashlib.blake2b(f"{self.seed}:{post_id}".encode(), digest_size=64).digest()
+        return (block * (size // len(block) + 1))[:size]
+
+    @staticmethod
+    def file_path(post: dict[str, Any], tier: str | None = None) -> str:
+        """ Get the path the file of a post is served from, or its sample or preview, in the layout used by e621. """
+        md5 = post["md5"]
+        if tier:
+            return f"/data/{tier}/{md5[:2]}/{md5[2:4]}/{md5}.jpg"
+
+        return f"/data/{md5[:2]}/{md5[2:4]}/{md5}.{post['ext']}"
+
+    @staticmethod
+    def scaled_size(post: dict[str, Any], tier: str) -> tuple[int, int, int]:
+        """ Get the width, height and size in bytes of the sample or preview of a post, scaled down from the post. """
+        scale = (SAMPLE_WIDTH if tier == "sample" else PREVIEW_SIZE) / max(post["width"], post["height"])
+        width, height = max(round(post["width"] * scale), 1), max(round(post["height"] * scale), 1)
+        return width, height, max(round(post["size"] * scale * scale), 1)
+
+    def search(self, query: str) -> list[int]:
+        """ Get the IDs of posts matching a search query, newest first.
+
+        Supports plain and negated tags, and the `pool:`, `fav:`, `rating:` and `id:` metatags. An `id:`
+        metatag may compare with `>`, `>=`, `<` or `<=`, or match a single ID or a comma separated list of IDs.
+        """
+        matchers = []
+        for term in query.split():
+            negated = term.startswith("-")
+            matchers.append((negated, self._matcher(term.removeprefix("-"))))
+
+        return [
+            post_id for post_id in self.post_ids
+            if all(matcher(self.posts[post_id]) != negated for negated, matcher in matchers)
+        ]
+
+    def _matcher(self, term: str) -> Any:
+        """ Get a function matching posts against a single search term. """
+        name, _, value = term.partition(":")
+        match name:
+            case "pool" if value.isnumeric():
+                return lambda post: int(value) in post["pools"]
+            case "fav":
+                return lambda post: post["id"] in self.favourites
+            case "rating":
+                return lambda post: post["rating"] == value[:1]
+            case "id" if "," in value:
+                post_ids = {int(post_id) for post_id in value.split(",")}
+                return lambda post: post["id"] in post_ids
+            case "id" if id_match := re.fullmatch(r"([<>]=?)?(\d+)", value):
+                operator, number = id_match.groups()
+                return {
+                    ">": lambda post: post["id"] > int(number),
+                    ">=": lambda post: post["id"] >= int(number),
+                    "<": lambda post: post["id"] < int(number),
+                    "<=": lambda post: post["id"] <= int(number),
+                    None: lambda post: post["id"] == int(number),
+                }[operator]
+            case _:
+                return lambda post: term in post["tag_set"]
+
+    def post_response(self, post: dict[str, Any], base_url: str) -> dict[str, Any]:
+        """ Shape a post as returned by the posts endpoint. """
+        up, down = post["score"]
+        preview_width, preview_height, _ = self.scaled_size(post, "preview")
+        sample_width, sample_height, _ = self.scaled_size(post, "sample")
+        has_sample = post["width"] > SAMPLE_WIDTH
+        return {
+            "id": post["id"],
+            "created_at": post["created_at"].isoformat(),
+            "updated_at": post["created_at"].isoformat(),
+            "files": {
+                "meta": {
+                    "width": post["width"],
+                    "height": post["height"],
+                    "size": post["size"],
+                    "ext": post["ext"],
+                    "md5": post["md5"],
+                },
+                "original": {"url": base_url + self.file_path(post)},
+            },
+            "preview": {
+                "width": preview_width, "height": preview_height, "url": base_url + self.file_path(post, "preview"),
+            },
+            "sample": {
+                "has": has_sample,
+                "width": sample_width if has_sample else post["width"],
+                "height": sample_height if has_sample else post["height"],
+                "url": base_url + self.file_path(post, "sample" if has_sample else None),
+                "alternates": {},
+            },
+            "stats": {
+                "score": {"up": up, "down": -down, "total": up - down},
+                "fav_count": post["fav_count"],
+                "comment_count": 0,
+            },
+            "tags": post["tags"] | {"invalid": [], "lore": [], "contributor": []},
+            "locked_tags": [],
+            "change_seq": post["id"],
+            "flags": {
+                "pending": False,
+                "flagged": False,
+                "note_locked": False,
+                "status_locked": False,
+                "rating_locked": False,
+                "deleted": False,
+            },
+            "rating": post["rating"],
+            "sources": [],
+            "pools": post["pools"],
+            "relationships": {"parent_id": None, "has_children": False, "has_active_children": False, "children": []},
+            "approver_id": None,
+            "uploader_id": post["uploader_id"],
+            "description": "",
+            "is_favorited": post["id"] in self.favourites,
+            "has_notes": False,
+            "duration": None,
+        }
+
+    @staticmethod
+    def pool_response(pool: dict[str, Any]) -> dict[str, Any]:
+        """ Shape a pool as returned by the pools endpoints. """
+        return pool | {
+            "created_at": pool["created_at"].isoformat(),
+            "updated_at": pool["updated_at"].isoformat(),
+            "creator_name": f"user_{pool['creator_id']}",
+            "post_count": len(pool["post_ids"]),
+        }
+
+    @staticmethod
+    def tag_response(tag: dict[str, Any]) -> dict[str, Any]:
+        """ Shape a tag as returned by the tags endpoint, with deterministic related tags. """
+        rng = random.Random(tag["name"])  # noqa: S311
+        related_tags = rng.sample(VOCABULARY["general"], k=20)
+        updated_at = EPOCH.isoformat()
+        return tag | {
+            "related_tags": " ".join(f"{name} {rng.randint(1, 300)}" for name in [tag["name"], *related_tags]),
+            "related_tags_updated_at": updated_at,
+            "is_locked": False,
+            "created_at": updated_at,
+            "updated_at": updated_at,
+        }
+
+    @staticmethod
+    def generate_tag(tag_id: int) -> dict[str, Any]:
+        """ Generate the fields e621 stores for a tag, independently of any posts. """
+        return {"id": tag_id, "name": f"tag_{tag_id}", "post_count": tag_id % 5000, "category": tag_id % 9}
+
+    @staticmethod
+    def pool_row(pool: dict[str, Any]) -> dict[str, Any]:
+        """ Shape a pool as a row of the pools database dump. """
+        return pool | {
+            "post_ids": "{" + ",".join(map(str, pool["post_ids"])) + "}",
+            "is_active": "t" if pool["is_active"] else "f",
+        }
+
+    @staticmethod
+    def post_row(post: dict[str, Any]) -> dict[str, Any]:
+        """ Shape a post as a row of the posts database dump. """
+        up, down = post["score"]
+        return {
+            "id": post["id"],
+            "uploader_id": post["uploader_id"],
+            "created_at": post["created_at"],
+            "md5": post["md5"],
+            "source": "",
+            "rating": post["rating"],
+            "image_width": post["width"],
+            "image_height": post["height"],
+            "tag_string": " ".join(sorted(post["tag_set"])),
+            "locked_tags": "",
+            "fav_count": post["fav_count"],
+            "file_ext": post["ext"],
+            "parent_id": "",
+            "change_seq": post["id"],
+            "approver_id": "",
+            "file_size": post["size"],
+            "comment_count": 0,
+            "description": "",
+            "duration": "",
+            "updated_at": post["created_at"],
+            "is_deleted": "f",
+            "is_pending": "f",
+            "is_flagged": "f",
+            "score": up - down,
+            "up_score": up,
+            "down_score": -down,
+            "is_rating_locked": "f",
+            "is_status_locked": "f",
+            "is_note_locked": "f",
+        }
+
+    @staticmethod
+    def write_database_dump(file: BinaryIO, rows: Iterable[dict[str, Any]]) -> None:
+        """ Write rows as a gzipped CSV database dump, one row at a time such that dumps of any size may be written.
+
+        Args:
+            file (BinaryIO): File to write the compressed dump to, which is left open.
+            rows (Iterable[dict[str, Any]]): Rows of the dump, with the columns of the first row used as the header.
+        """
+        with (
+            gzip.GzipFile(fileobj=file, mode="wb", mtime=0) as compressed,
+            io.TextIOWrapper(compressed, encoding="utf-8", newline="") as text,
+        ):
+            writer = None
+            for row in rows:
+                if writer is None:
+                    writer = csv.DictWriter(text, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+
+    def database_dump(self, name: str) -> bytes:
+        """ Build a gzipped CSV database dump of posts or pools, with the columns exported by e621. """
+        rows = (
+            map(self.pool_row, self.pools.values()) if name == "pools" else map(self.post_row, self.posts.values())
+        )
+        output = io.BytesIO()
+        self.write_database_dump(output, rows)
+        return output.getvalue()
+
+
+class E621Server(ThreadingHTTPServer):
+    """ Threaded HTTP server standing in for e621, listening on a free local port.
+
+    Args:
+        data (SyntheticData): Data to serve.
+    """
+
+    daemon_threads = True
+
+    # Date stamp used in the names of database dumps.
+    DUMP_DATE = "2026-01-01"
+
+    def __init__(self, data: SyntheticData) -> None:
+        super().__init__(("127.0.0.1", 0), E621RequestHandler)
+        self.data = data
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+
+        # Seconds to wait before answering each request, and the rate to send files at in bytes per second.
+        self.latency = 0.0
+        self.bandwidth: int | None = None
+        # Send files with chunked transfer encoding rather than a Content-Length, as some CDNs do.
+        self.chunked = False
+        # Fraction of requests answered with a random status from `error_statuses`, in addition to `fail_next`.
+        self.error_rate = 0.0
+        self.error_statuses: tuple[int, ...] = (HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE)
+
+        # Path and status of every request answered, in the order they were answered.
+        self.requests: list[tuple[str, int]] = []
+
+        self._lock = threading.Lock()
+        self._rng = random.Random(data.seed)  # noqa: S311
+        self._failures: list[tuple[int, str]] = []
+        self._dumps: dict[str, bytes] = {}
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.05}, name="e621-server", daemon=True,
+        )
+
+    def __enter__(self) -> Self:
+        """ Start serving in a background thread when used in a context manager. """
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None,
+                 exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        """ Stop serving and close the listening socket when exiting the context manager. """
+        self.shutdown()
+        self.server_close()
+
+    def fail_next(self, count: int, status: int = HTTPStatus.SERVICE_UNAVAILABLE, path: str = "/") -> None:
+        """ Answer the next requests to paths starting with `path` with an error status. """
+        with self._lock:
+            self._failures.extend([(status, path)] * count)
+
+    def injected_error(self, path: str) -> int | None:
+        """ Get the error status to answer a request with, if an error should be injected. """
+        with self._lock:
+            for index, (status, prefix) in enumerate(self._failures):
+                if path.startswith(prefix):
+                    del self._failures[index]
+                    return status
+
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return self._rng.choice(self.error_statuses)
+
+        return None
+
+    def record(self, path: str, status: int) -> None:
+        """ Record a request which was answered. """
+        with self._lock:
+            self.requests.append((path, status))
+
+    def count(self, path: str = "/", status: int | None = None) -> int:
+        """ Count the requests answered to paths starting with `path`, optionally only with a given status. """
+        with self._lock:
+            return sum(
+                1 for request_path, request_status in self.requests
+                if request_path.startswith(path) and status in (None, request_status)
+            )
+
+    def database_dump(self, name: str) -> bytes:
+        """ Get a database dump, building it the first time it is requested. """
+        with self._lock:
+            if name not in self._dumps:
+                self._dumps[name] = self.data.database_dump(name)
+            return self._dumps[name]
+
+
+class E621RequestHandler(BaseHTTPRequestHandler):
+    """ Handler answering each request from the synthetic data of the server. """
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def e621_server(self) -> E621Server:
+        """ Server the request was received by, holding the synthetic data to answer from. """
+        return cast(E621Server, self.server)
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        """ Do not log requests, as tests make many of them. """
+
+    def do_GET(self) -> None:
+        """ Answer a GET request, after any configured latency or injected error. """
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if self.e621_server.latency:
+            time.sleep(self.e621_server.latency)
+
+        if status := self.e621_server.injected_error(url.path):
+            self.send_json({"success": False, "reason": HTTPStatus(status).phrase}, status, {"Retry-After": "0"})
+            return
+
+        data = self.e621_server.data
+        match url.path.strip("/").split("/"):
+            case ["posts.json"]:
+                self.send_posts(params)
+            case ["pools", pool_json] if (pool_id := pool_json.removesuffix(".json")).isnumeric():
+                if int(pool_id) in data.pools:
+                    self.send_json(data.pool_response(data.pools[int(pool_id)]))
+                else:
+                    self.send_json({"success": False, "reason": "not found"}, HTTPStatus.NOT_FOUND)
+            case ["pools.json"]:
+                pool_ids = [int(pool_id) for pool_id in params.get("search[id]", "").split(",") if pool_id]
+                pools = [data.pools[pool_id] for pool_id in pool_ids if pool_id in data.pools]
+                self.send_json([data.pool_response(pool) for pool in pools])
+            case ["tags.json"]:
+                name = params.get("search[name_matches]", "")
+                category = params.get("search[category]")
+                tags = [data.tag_response(data.tags[name])] if name in data.tags else []
+                self.send_json([tag for tag in tags if category is None or tag["category"] == int(category)])
+            case ["db_export"]:
+                self.send_database_index()
+            case ["db_export", file_name] if (match := re.fullmatch(r"(posts|pools)-[\d-]+\.csv\.gz", file_name)):
+                self.send_bytes(self.e621_server.database_dump(match.group(1)), "application/gzip")
+            case ["data", "sample" | "preview" as tier, _, _, file_name]:
+                self.send_file(file_name.partition(".")[0], tier)
+            case ["data", _, _, file_name]:
+                self.send_file(file_name.partition(".")[0])
+            case _:
+                self.send_json({"success": False, "reason": "not found"}, HTTPStatus.NOT_FOUND)
+
+    def send_posts(self, params: dict[str, str]) -> None:
+        """ Answer a post search, paged by page number or by the ID to return posts before. """
+        limit = min(int(params.get("limit", 75)), MAX_LIMIT)
+        post_ids = self.e621_server.data.search(params.get("tags", ""))
+
+        page = params.get("page", "1")
+        if page.startswith("b"):
+            before = int(page[1:])
+            post_ids = [post_id for post_id in post_ids if post_id < before][:limit]
+        elif (page_number := int(page)) > MAX_PAGE:
+            self.send_json({"success": False, "reason": "page out of range"}, HTTPStatus.GONE)
+            return
+        else:
+            post_ids = post_ids[(page_number - 1) * limit:page_number * limit]
+
+        data = self.e621_server.data
+        self.send_json([data.post_response(data.posts[post_id], self.e621_server.url) for post_id in post_ids])
+
+    def send_database_index(self) -> None:
+        """ Answer with an index of database dumps, in the format of the directory listing served by e621. """
+        lines = [
+            f'<a href="{name}-{self.e621_server.DUMP_DATE}.csv.gz">{name}-{self.e621_server.DUMP_DATE}.csv.gz</a>'
+            for name in ("pools", "posts")
+        ]
+        self.send_bytes("\n".join(["<html><body><pre>", *lines, "</pre></body></html>"]).encode(), "text/html")
+
+    def send_file(self, md5: str, tier: str | None = None) -> None:
+        """ Answer with the file of the post with a given MD5 hash, or its sample or preview. """
+        data = self.e621_server.data
+        if (post_id := data.posts_by_md5.get(md5)) is None:
+            self.send_json({"success": False, "reason": "not found"}, HTTPStatus.NOT_FOUND)
+            return
+
+        post = data.posts[post_id]
+        size = data.scaled_size(post, tier)[2] if tier else post["size"]
+        self.send_bytes(data.file_content(post_id, size), "application/octet-stream", chunked=self.e621_server.chunked)
+
+    def send_json(self, body: Any, status: int = HTTPStatus.OK, headers: dict[str, str] | None = None) -> None:
+        """ Answer with a JSON body. """
+        self.send_bytes(json.dumps(body).encode(), "application/json", status, headers)
+
+    def send_bytes(
+        self, body: bytes, content_type: str, status: int = HTTPStatus.OK, headers: dict[str, str] | None = None,
+        *, chunked: bool = False,
+    ) -> None:
+        """ Answer with a body, sent no faster than the bandwidth of the server, optionally without its length. """
+        self.e621_server.record(urlsplit(self.path).path, status)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        chunk_size = 64 * 1024
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+            if self.e621_server.bandwidth:
+                time.sleep(chunk_size / self.e621_server.bandwidth)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
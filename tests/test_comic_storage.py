@@ -0,0 +1,141 @@
+""" Tests of storing comics, directly as CBZ archives and through comic updates against the stand-in e621 server. """
+import io
+import json
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from furbox.connectors.e621 import E621Connector, E621DbConnector
+from furbox.connectors.journal import LibraryScanner
+from furbox.helpers.comic.storage import CbzStorage, ComicStorage
+from furbox.models.comic import PoolManifest
+from furbox.models.config import Config
+from furbox.runners.comics import update_comics
+from furbox.utils.events import events
+from tests.e621_server import E621Server
+
+
+def add_pages(storage: CbzStorage, manifest: PoolManifest, pages: dict[str, bytes], first_post_id: int) -> None:
+    """ Download pages to the staging directory of an archive, then add each to the archive and its manifest. """
+    storage.download_directory.mkdir(parents=True, exist_ok=True)
+    for post_id, (file_name, content) in enumerate(pages.items(), start=first_post_id):
+        file_path = storage.download_directory / file_name
+        file_path.write_bytes(content)
+        entry = PoolManifest.Entry(post_id=post_id, md5=f"md5-{post_id}", file_name=file_name)
+        storage.add_page(file_path, entry)
+        manifest.entries.append(entry)
+
+
+def read_pages(archive_path: Path) -> dict[str, bytes]:
+    """ Read the content of every page in an archive, keyed on file name. """
+    with zipfile.ZipFile(archive_path) as archive:
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+
+def test_cbz_round_trip(tmp_path: Path) -> None:
+    """ Archives should be created, appended to, reordered and have pages removed, keeping the manifest in sync. """
+    archive_path = tmp_path / "Comic.cbz"
+    storage = CbzStorage(archive_path)
+    assert storage.load_manifest() is None
+    assert storage.page_names() == []
+    assert storage.hash_pages() == {}
+
+    # Create the archive from the first pages, which are only committed once the manifest is saved.
+    manifest = PoolManifest(pool_id=1)
+    add_pages(storage, manifest, {"Comic 01.png": b"page 1", "Comic 02.png": b"page 2"}, first_post_id=1)
+    storage.save_manifest(manifest)
+    assert not storage.journal_path.exists()
+    assert not storage.staging_directory.exists()
+    assert read_pages(archive_path) == {"Comic 01.png": b"page 1", "Comic 02.png": b"page 2"}
+
+    # Append to the existing archive from a new storage, as a later update would.
+    storage = CbzStorage(archive_path)
+    manifest = storage.load_manifest()
+    assert manifest is not None
+    add_pages(storage, manifest, {"Comic 03.png": b"page 3"}, first_post_id=3)
+    storage.save_manifest(manifest)
+    assert storage.page_names() == ["Comic 01.png", "Comic 02.png", "Comic 03.png"]
+
+    # Swap the first two pages and remove the last, which is moved aside next to the archive.
+    storage.apply_plan(renames=[("Comic 01.png", "Comic 02.png"), ("Comic 02.png", "Comic 01.png")],
+                       removals=["Comic 03.png"])
+    assert read_pages(archive_path) == {"Comic 02.png": b"page 1", "Comic 01.png": b"page 2"}
+    assert (tmp_path / "_removed-Comic" / "Comic 03.png").read_bytes() == b"page 3"
+
+    manifest = storage.load_manifest()
+    assert manifest is not None
+    assert [(entry.post_id, entry.file_name) for entry in manifest.entries] == \
+        [(2, "Comic 01.png"), (1, "Comic 02.png")]
+    assert storage.hash_pages().keys() == {"Comic 01.png", "Comic 02.png"}
+
+
+def comics_config(e621_server: E621Server, tmp_path: Path, storage: Config.Comics.Storage) -> Config:
+    """ Config to update a comic for every pool of the stand-in server, storing them in the given way. """
+    (tmp_path / "comics.yaml").write_text(json.dumps({
+        "e621": [{"pool_id": pool_id} for pool_id in e621_server.data.pools],
+    }), encoding="utf-8")
+    return Config(
+        comics=Config.Comics(base_path=tmp_path, database_file="comics.yaml", storage=storage),
+        e621=Config.E621(username="furbox", api_key="api_key"),
+        misc=Config.Misc(cache_dir=str(tmp_path / "cache")),
+    )
+
+
+def test_cbz_comics_update(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ Updating comics stored as archives should create an archive holding every page of each new comic. """
+    config = comics_config(e621_server, tmp_path, Config.Comics.Storage.CBZ)
+    db_connector = E621DbConnector(config.misc.cache_dir, base_url=e621_server.url)
+
+    assert update_comics(config, use_db=True, e621_connector=e621_connector, db_connector=db_connector) is None
+
+    for pool in e621_server.data.pools.values():
+        storage = CbzStorage(tmp_path / f"{pool['name']}.cbz")
+        manifest = storage.load_manifest()
+        assert manifest is not None
+        assert [entry.post_id for entry in manifest.entries] == pool["post_ids"]
+        assert len(storage.page_names()) == len(pool["post_ids"])
+
+
+def test_comics_update_storage_failure(
+    e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """ A comic whose storage cannot be opened should be reported, without stopping later comics from updating. """
+    config = comics_config(e621_server, tmp_path, Config.Comics.Storage.DIRECTORY)
+    db_connector = E621DbConnector(config.misc.cache_dir, base_url=e621_server.url)
+    pools = sorted(e621_server.data.pools.values(), key=lambda pool: pool["name"])
+    create = ComicStorage.create
+
+    def create_failing_first(storage_type: Config.Comics.Storage, base_path: Path, dir_name: str,
+                             scanner: LibraryScanner | None = None) -> ComicStorage:
+        if dir_name == pools[0]["name"]:
+            raise OSError(f"Could not open {dir_name}")
+        return create(storage_type, base_path, dir_name, scanner=scanner)
+
+    monkeypatch.setattr(ComicStorage, "create", staticmethod(create_failing_first))
+    assert update_comics(config, use_db=True, e621_connector=e621_connector, db_connector=db_connector) is None
+
+    assert not (tmp_path / pools[0]["name"]).exists()
+    for pool in pools[1:]:
+        assert len(list((tmp_path / pool["name"]).glob(f"{pool['name']} *"))) == len(pool["post_ids"])
+
+
+def test_comics_update_downloads_event(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ Updating comics should report the pages downloaded as a downloads event, as other downloads do. """
+    config = comics_config(e621_server, tmp_path, Config.Comics.Storage.DIRECTORY)
+    db_connector = E621DbConnector(config.misc.cache_dir, base_url=e621_server.url)
+
+    output = io.StringIO()
+    events.configure(output)
+    try:
+        assert update_comics(config, use_db=True, e621_connector=e621_connector, db_connector=db_connector) is None
+    finally:
+        events.configure(None)
+
+    post_ids = [post_id for pool in e621_server.data.pools.values() for post_id in pool["post_ids"]]
+    downloads = [
+        event for line in output.getvalue().splitlines() if (event := json.loads(line))["event"] == "downloads"
+    ]
+    assert len(downloads) == 1
+    assert (downloads[0]["succeeded"], downloads[0]["failed"]) == (len(post_ids), 0)
+    assert downloads[0]["bytes"] == sum(e621_server.data.posts[post_id]["size"] for post_id in post_ids)
@@ -0,0 +1,147 @@
+""" Tests of planning comic updates from pool manifests, and applying the plans to comic directories. """
+from pathlib import Path
+
+import pytest
+
+from furbox.helpers.comic.e621 import bootstrap_manifest, plan_pool_update, PoolUpdatePlan
+from furbox.helpers.comic.storage import DirectoryStorage
+from furbox.models.comic import PoolManifest
+from furbox.models.e621 import Pool, Post
+from tests.e621_server import SyntheticData
+
+BASE_URL = "http://127.0.0.1"
+COMIC_NAME = "Comic"
+
+
+@pytest.fixture
+def data() -> SyntheticData:
+    """ Synthetic posts, which pools are built from by each test. """
+    return SyntheticData(post_count=10, pool_count=0)
+
+
+def make_pool(data: SyntheticData, post_ids: list[int]) -> Pool:
+    """ Create a pool of the given posts, in order. """
+    return Pool.from_api(data.pool_response(data.generate_pool(1, post_ids)))
+
+
+def make_posts(data: SyntheticData, post_ids: list[int]) -> list[Post]:
+    """ Create the posts with the given IDs, as they would be listed from e621. """
+    return [Post.from_api(data.post_response(data.posts[post_id], BASE_URL)) for post_id in post_ids]
+
+
+def download(storage: DirectoryStorage, plan: PoolUpdatePlan) -> PoolManifest:
+    """ Stand in for downloading the posts of a plan, writing each post ID to its page and recording it. """
+    storage.directory.mkdir(parents=True, exist_ok=True)
+    entries = {entry.post_id: entry for entry in plan.manifest.entries}
+    for post, file_stem in plan.downloads:
+        file_name = f"{file_stem}.{post.file_info.ext}"
+        (storage.directory / file_name).write_text(str(post.post_id), encoding="utf-8")
+        entries[post.post_id] = PoolManifest.Entry(post_id=post.post_id, md5=post.file_info.md5, file_name=file_name)
+
+    manifest = plan.manifest.model_copy(update={"entries": sorted(entries.values(), key=lambda entry: entry.file_name)})
+    storage.save_manifest(manifest)
+    return manifest
+
+
+def read_pages(storage: DirectoryStorage) -> dict[str, int]:
+    """ Read the post ID written to every file in a comic directory, keyed on file name without its extension. """
+    return {
+        file_path.stem: int(file_path.read_text(encoding="utf-8"))
+        for file_path in storage.directory.iterdir() if file_path.name != PoolManifest.FILE_NAME
+    }
+
+
+def test_plan_renames_and_removals(data: SyntheticData, tmp_path: Path) -> None:
+    """ Inserted, reordered and removed posts should be downloaded, renamed and moved aside respectively. """
+    storage = DirectoryStorage(tmp_path / COMIC_NAME)
+    pool = make_pool(data, [1, 2, 3, 4, 5])
+    plan = plan_pool_update(PoolManifest(pool_id=1), pool, make_posts(data, pool.post_ids), COMIC_NAME)
+
+    assert (plan.renames, plan.removals) == ([], [])
+    assert [(post.post_id, file_stem) for post, file_stem in plan.downloads] == [
+        (1, "Comic 01"), (2, "Comic 02"), (3, "Comic 03"), (4, "Comic 04"), (5, "Comic 05"),
+    ]
+    manifest = download(storage, plan)
+
+    # Insert a post at the start, swap the next two, and remove post 4 from the pool.
+    pool = make_pool(data, [6, 2, 1, 3, 5])
+    plan = plan_pool_update(manifest, pool, make_posts(data, pool.post_ids), COMIC_NAME)
+
+    assert [(post.post_id, file_stem) for post, file_stem in plan.downloads] == [(6, "Comic 01")]
+    assert [(Path(old).stem, Path(new).stem) for old, new in plan.renames] == [
+        ("Comic 01", "Comic 03"), ("Comic 03", "Comic 04"),
+    ]
+    assert [Path(file_name).stem for file_name in plan.removals] == ["Comic 04"]
+
+    storage.apply_plan(renames=plan.renames, removals=plan.removals)
+    manifest = download(storage, plan)
+
+    assert read_pages(storage) == {
+        "Comic 01": 6, "Comic 02": 2, "Comic 03": 1, "Comic 04": 3, "Comic 05": 5, "_removed-Comic 04": 4,
+    }
+    assert [entry.post_id for entry in manifest.entries] == pool.post_ids
+    assert manifest.is_current(pool.post_ids)
+    assert storage.page_names() == [entry.file_name for entry in manifest.entries]
+
+
+def test_plan_replaced_posts(data: SyntheticData, tmp_path: Path) -> None:
+    """ Posts replaced upstream should be moved aside and downloaded again, in the same position. """
+    storage = DirectoryStorage(tmp_path / COMIC_NAME)
+    pool = make_pool(data, [1, 2, 3])
+    plan = plan_pool_update(PoolManifest(pool_id=1), pool, make_posts(data, pool.post_ids), COMIC_NAME)
+    manifest = download(storage, plan)
+
+    data.posts[2]["md5"] = "replaced"
+    plan = plan_pool_update(manifest, pool, make_posts(data, pool.post_ids), COMIC_NAME)
+
+    assert plan.renames == []
+    assert [Path(file_name).stem for file_name in plan.removals] == ["Comic 02"]
+    assert [(post.post_id, file_stem) for post, file_stem in plan.downloads] == [(2, "Comic 02")]
+    assert [entry.post_id for entry in plan.manifest.entries] == [1, 3]
+
+    storage.apply_plan(renames=plan.renames, removals=plan.removals)
+    manifest = download(storage, plan)
+
+    assert read_pages(storage) == {"Comic 01": 1, "Comic 02": 2, "Comic 03": 3, "_removed-Comic 02": 2}
+    assert [entry.md5 for entry in manifest.entries if entry.post_id == 2] == ["replaced"]
+
+
+def test_plan_excluded_and_unavailable_posts(data: SyntheticData) -> None:
+    """ Excluded posts should never be downloaded, and stored posts should be kept once they are unavailable. """
+    manifest = PoolManifest(
+        pool_id=1,
+        entries=[PoolManifest.Entry(post_id=3, md5=data.posts[3]["md5"], file_name="Comic 01.png")],
+        excluded_post_ids=[1, 9],
+    )
+    # Post 1 stays excluded, post 2 is unavailable and not stored, and post 3 is stored but no longer available.
+    pool = make_pool(data, [1, 2, 3, 4])
+    plan = plan_pool_update(manifest, pool, make_posts(data, [1, 4]), COMIC_NAME)
+
+    assert (plan.renames, plan.removals) == ([], [])
+    assert [(post.post_id, file_stem) for post, file_stem in plan.downloads] == [(4, "Comic 02")]
+    assert [entry.post_id for entry in plan.manifest.entries] == [3]
+    assert plan.manifest.excluded_post_ids == [1]
+    assert plan.manifest.unavailable_post_ids == [2, 3]
+
+
+def test_bootstrap_manifest(data: SyntheticData) -> None:
+    """ Local pages should be matched to posts by hash, keeping their padding and excluding skipped posts. """
+    pool = make_pool(data, [1, 2, 3, 4, 5])
+    page_hashes = {
+        "Comic 001.png": data.posts[2]["md5"],
+        "Comic 002.png": data.posts[4]["md5"],
+        "Cover.png": "unmatched",
+    }
+
+    manifest = bootstrap_manifest(pool, make_posts(data, pool.post_ids), page_hashes)
+
+    assert manifest.zero_pad == 3
+    assert [(entry.post_id, entry.file_name) for entry in manifest.entries] == [
+        (2, "Comic 001.png"), (4, "Comic 002.png"),
+    ]
+    assert manifest.excluded_post_ids == [1, 3]
+
+    # Matched pages are already in position, so only the posts after the last match are downloaded.
+    plan = plan_pool_update(manifest, pool, make_posts(data, pool.post_ids), COMIC_NAME)
+    assert (plan.renames, plan.removals) == ([], [])
+    assert [(post.post_id, file_stem) for post, file_stem in plan.downloads] == [(5, "Comic 003")]
@@ -0,0 +1,67 @@
+""" Tests of mirroring search queries with the e621 download runner, against the stand-in e621 server. """
+from pathlib import Path
+
+from furbox.connectors.e621 import E621Connector
+from furbox.models.mirror import SearchMirror
+from furbox.runners.e621.download import mirror_search
+from tests.e621_server import E621Server
+
+QUERY = "species_0"
+
+
+def test_mirror_only_fetches_changes(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ Later runs should only list new posts and check a batch of posts for removal, downloading only new posts. """
+    data = e621_server.data
+    expected_post_ids = sorted(data.search(QUERY))
+
+    assert mirror_search(e621_connector, QUERY, tmp_path) is None
+
+    mirror = SearchMirror.load(tmp_path)
+    assert mirror is not None
+    assert mirror.post_ids == expected_post_ids
+    assert mirror.max_post_id == expected_post_ids[-1]
+    assert sorted(int(path.stem) for path in tmp_path.iterdir() if path != tmp_path / mirror.FILE_NAME) == \
+        expected_post_ids
+
+    # Upload new posts and remove the oldest mirrored post, then update the mirror.
+    for post_id in range(1001, 1021):
+        data.add_post(post_id)
+    new_post_ids = sorted(post_id for post_id in data.search(QUERY) if post_id > 1000)
+    removed_post_id = expected_post_ids[0]
+    data.remove_post(removed_post_id)
+    e621_server.requests.clear()
+
+    assert mirror_search(e621_connector, QUERY, tmp_path) is None
+
+    mirror = SearchMirror.load(tmp_path)
+    assert mirror is not None
+    assert mirror.post_ids == [*expected_post_ids[1:], *new_post_ids]
+    assert mirror.max_post_id == new_post_ids[-1]
+    assert next(tmp_path.glob(f"_removed-{removed_post_id}.*"), None) is not None
+
+    # One request checks for removed posts, and one lists the new posts.
+    assert e621_server.count("/posts.json") == 2
+    assert e621_server.count("/data/") == len(new_post_ids)
+
+
+def test_mirror_skips_existing_files(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ Starting a mirror in a directory of earlier downloads should record existing files without downloading them. """
+    post_id = e621_server.data.search(QUERY)[0]
+    post = e621_server.data.posts[post_id]
+    existing_file = tmp_path / f"{post_id}.{post['ext']}"
+    existing_file.write_bytes(b"existing")
+
+    assert mirror_search(e621_connector, QUERY, tmp_path) is None
+
+    mirror = SearchMirror.load(tmp_path)
+    assert mirror is not None
+    assert post_id in mirror.post_ids
+    assert existing_file.read_bytes() == b"existing"
+    assert e621_server.count("/data/") == len(mirror.post_ids) - 1
+
+
+def test_mirror_rejects_different_query(e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ A directory mirroring one query should not be updated with another. """
+    SearchMirror(query="species_1").save(tmp_path)
+
+    assert mirror_search(e621_connector, QUERY, tmp_path) == 1
@@ -0,0 +1,51 @@
+""" Tests of downloading files, against the stand-in e621 server. """
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from furbox.connectors.downloader import download_files, schedule_file_targets, UrlFileTarget
+from furbox.utils.events import events
+from tests.e621_server import E621Server
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_downloads_event_bytes(chunked: bool, e621_server: E621Server, tmp_path: Path) -> None:
+    """ The downloads event should report the bytes written, even for responses without a Content-Length. """
+    e621_server.chunked = chunked
+    posts = list(e621_server.data.posts.values())[:10]
+    file_targets = [
+        UrlFileTarget.create(e621_server.url + e621_server.data.file_path(post), str(post_id), tmp_path)
+        for post_id, post in enumerate(posts)
+    ]
+
+    output = io.StringIO()
+    events.configure(output)
+    try:
+        report = download_files(file_targets, description="Downloading files")
+    finally:
+        events.configure(None)
+
+    assert all((result.headers.get("Content-Length") is None) == chunked for _, result in report.results)
+    event = next(event for line in output.getvalue().splitlines()
+                 if (event := json.loads(line))["event"] == "downloads")
+    assert event["succeeded"] == len(posts)
+    assert event["bytes"] == sum(post["size"] for post in posts) == sum(result.size for _, result in report.results)
+
+
+def test_schedule_file_targets(tmp_path: Path) -> None:
+    """ Large files should be spread at most once per round of threads, keeping the order within each size class. """
+    small = [UrlFileTarget.create(f"https://example.com/small_{i}.png", f"small_{i}", tmp_path, size=100)
+             for i in range(6)]
+    large = [UrlFileTarget.create(f"https://example.com/large_{i}.png", f"large_{i}", tmp_path, size=10_000)
+             for i in range(3)]
+    unknown = UrlFileTarget.create("https://example.com/unknown.png", "unknown", tmp_path)
+
+    scheduled = schedule_file_targets([*large, *small, unknown], threads=3)
+
+    assert [target.file_name for target in scheduled] == [
+        "large_0", "small_0", "small_1", "small_2", "large_1", "small_3", "small_4", "small_5", "large_2", "unknown",
+    ]
+    # Targets are left in their original order when none are much larger than the others.
+    assert schedule_file_targets([unknown, *small[:2]], threads=3) == [unknown, *small[:2]]
@@ -0,0 +1,84 @@
+""" Tests of the e621 connectors against the stand-in e621 server. """
+from http import HTTPStatus
+from pathlib import Path
+
+import pytest
+import requests
+
+from furbox.connectors.e621 import E621Connector, E621DbConnector
+from furbox.models.e621 import Pool, Post, Tag
+from tests.e621_server import E621Server
+
+
+@pytest.mark.parametrize("e621_server", [{"post_count": 700}], indirect=True)
+def test_get_posts_pages_before_last_post(e621_server: E621Server, e621_connector: E621Connector) -> None:
+    """ Every post should be fetched exactly once, paging by the ID of the last post received. """
+    posts = [Post.from_api(post) for post in e621_connector.get_posts("")]
+
+    assert [post.post_id for post in posts] == list(range(700, 0, -1))
+    assert e621_server.count("/posts.json") == 3
+
+
+def test_get_posts_offset_and_limit(e621_connector: E621Connector) -> None:
+    """ Offsets and limits should select a window of the search results. """
+    posts = e621_connector.get_posts("", offset=330, limit=5)
+
+    assert [post["id"] for post in posts] == [670, 669, 668, 667, 666]
+
+
+def test_get_posts_retries_unavailable(e621_server: E621Server, e621_connector: E621Connector) -> None:
+    """ Rate limited and unavailable responses should be retried, without losing or repeating posts. """
+    e621_server.fail_next(1, status=HTTPStatus.TOO_MANY_REQUESTS)
+    e621_server.fail_next(1, status=HTTPStatus.SERVICE_UNAVAILABLE)
+
+    posts = e621_connector.get_posts("")
+
+    assert len({post["id"] for post in posts}) == len(posts) == 1000
+    assert e621_server.count("/posts.json", status=HTTPStatus.OK) == 4
+
+
+def test_get_posts_raises_after_retries(e621_server: E621Server, e621_connector: E621Connector) -> None:
+    """ A server which stays unavailable should raise an error, rather than end the search early. """
+    e621_server.fail_next(E621Connector.MAX_RETRIES + 1)
+
+    with pytest.raises(requests.HTTPError):
+        e621_connector.get_posts("")
+
+
+def test_pools_and_tags(e621_server: E621Server, e621_connector: E621Connector) -> None:
+    """ Pools and tags should parse into their models. """
+    pool = Pool.from_api(e621_connector.get_pool(1))
+    pools = [Pool.from_api(pool) for pool in e621_connector.get_pools([1, 2, 999])]
+    tag = Tag.from_api(e621_connector.get_tag("artist_0", Tag.Category.ARTIST) or {})
+
+    assert pool.post_ids == e621_server.data.pools[1]["post_ids"]
+    assert [pool.pool_id for pool in pools] == [1, 2]
+    assert tag.post_count == sum("artist_0" in post["tag_set"] for post in e621_server.data.posts.values())
+    assert e621_connector.get_tag("artist_0", Tag.Category.SPECIES) is None
+
+
+def test_database_pools(e621_server: E621Server, tmp_path: Path) -> None:
+    """ Pools parsed from a database dump should match the pools served by the API. """
+    db_connector = E621DbConnector(tmp_path, base_url=e621_server.url)
+
+    pools = db_connector.get_pools(filter_condition=lambda pool: pool.pool_id <= 5)
+
+    assert {pool.pool_id: pool.post_ids for pool in pools} == {
+        pool_id: pool["post_ids"] for pool_id, pool in e621_server.data.pools.items() if pool_id <= 5
+    }
+
+
+@pytest.mark.parametrize(("pool_count", "delays"), [
+    (1, 0),
+    (E621Connector.PAGE_LIMIT, 0),
+    (E621Connector.PAGE_LIMIT + 1, 1),
+])
+def test_get_pools_delays_between_chunks(pool_count: int, delays: int, e621_connector: E621Connector,
+                                         monkeypatch: pytest.MonkeyPatch) -> None:
+    """ The API rate limit should only be waited on between chunks of pools, not after the last chunk. """
+    delay_calls = []
+    monkeypatch.setattr(e621_connector, "_delay", lambda: delay_calls.append(None))
+
+    e621_connector.get_pools(list(range(1, pool_count + 1)))
+
+    assert len(delay_calls) == delays
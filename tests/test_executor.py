@@ -0,0 +1,63 @@
+""" Tests of cancelling work submitted through the completion executor. """
+import threading
+import time
+from collections.abc import Iterator
+
+from furbox.helpers.utils import CompletionExecutor
+
+
+def test_cancel_stops_submitting() -> None:
+    """ Cancelling should stop further items being taken from the input, once outstanding tasks have finished. """
+    def cancel_after(item: int) -> int:
+        executor.cancel()
+        return item
+
+    items = iter(range(10))
+    executor = CompletionExecutor(cancel_after, threads=1, max_outstanding=1)
+    report = executor.run(items)
+
+    assert report.results == [(0, 0)]
+    assert (report.failures, report.cancelled) == ([], [])
+    assert list(items) == list(range(1, 10))
+
+
+def test_cancel_pending_tasks() -> None:
+    """ Cancelling while a task runs should cancel the submitted tasks which have not started, and report them. """
+    submitted = threading.Event()
+
+    def submit_all() -> Iterator[int]:
+        yield from range(10)
+        submitted.set()
+
+    def cancel_and_wait(item: int) -> int:
+        submitted.wait()
+        executor.cancel()
+        time.sleep(0.1)
+        return item
+
+    executor = CompletionExecutor(cancel_and_wait, threads=1)
+    executor.POLL_INTERVAL = 0.01
+    report = executor.run(submit_all())
+
+    assert report.results == [(0, 0)]
+    assert sorted(report.cancelled) == list(range(1, 10))
+
+
+def test_stopping_iteration_cancels_pending() -> None:
+    """ Stopping iteration early should cancel every task which has not started, and let running tasks finish. """
+    started = set()
+    lock = threading.Lock()
+
+    def record_start(item: int) -> int:
+        with lock:
+            started.add(item)
+        time.sleep(0.01)
+        return item
+
+    executor = CompletionExecutor(record_start, threads=2)
+    for _ in executor.imap(range(50)):
+        break
+
+    assert executor.report.cancelled
+    assert not started & set(executor.report.cancelled)
+    assert started | set(executor.report.cancelled) == set(range(50))
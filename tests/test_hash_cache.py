@@ -0,0 +1,54 @@
+""" Tests of reusing and invalidating cached file hashes. """
+import hashlib
+import os
+from pathlib import Path
+
+from furbox.connectors.cache import FileStat, HashCache
+from furbox.helpers.utils import hash_file
+
+
+def md5(content: bytes) -> str:
+    """ Calculate the MD5 digest of some content. """
+    return hashlib.md5(content).hexdigest()  # noqa: S324
+
+
+def test_hash_cache_persists(tmp_path: Path) -> None:
+    """ Hashes should be written when the cache is closed, and reused by later caches while files are unchanged. """
+    file_path = tmp_path / "page.png"
+    file_path.write_bytes(b"page")
+
+    with HashCache(tmp_path / "cache") as hash_cache:
+        assert hash_file(file_path, hash_cache=hash_cache) == md5(b"page")
+
+    with HashCache(tmp_path / "cache") as hash_cache:
+        assert hash_cache.get(file_path, "md5", FileStat.from_path(file_path)) == md5(b"page")
+        assert hash_cache.get(file_path, "sha256", FileStat.from_path(file_path)) is None
+
+
+def test_hash_cache_invalidated(tmp_path: Path) -> None:
+    """ Cached hashes should not be used once the size, modification time or inode of a file changes. """
+    file_path = tmp_path / "page.png"
+    file_path.write_bytes(b"page")
+
+    with HashCache(tmp_path / "cache") as hash_cache:
+        # Cached digests are trusted while the file is unchanged, without reading the file.
+        hash_cache.put(file_path, "md5", FileStat.from_path(file_path), "cached")
+        assert hash_file(file_path, hash_cache=hash_cache) == "cached"
+
+        # Content of a different size.
+        file_path.write_bytes(b"longer page")
+        assert hash_file(file_path, hash_cache=hash_cache) == md5(b"longer page")
+
+        # Content of the same size, with a later modification time.
+        stat = file_path.stat()
+        file_path.write_bytes(b"edited page")
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert hash_file(file_path, hash_cache=hash_cache) == md5(b"edited page")
+
+        # Content of the same size and modification time, replaced by a new file.
+        stat = file_path.stat()
+        replacement_path = tmp_path / "replacement.png"
+        replacement_path.write_bytes(b"second page")
+        os.utime(replacement_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        replacement_path.replace(file_path)
+        assert hash_file(file_path, hash_cache=hash_cache) == md5(b"second page")
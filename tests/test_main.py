@@ -0,0 +1,70 @@
+""" Tests of parsing the command line, which must only import the selected runner, and its global arguments. """
+import argparse
+import subprocess
+import sys
+
+import pytest
+
+from furbox.main import run_runner
+from furbox.models.config import Config
+
+# Parse arguments in a fresh interpreter, as runners may only be registered with the root parser once per process.
+PARSE_ARGS = """
+import sys
+from furbox import main
+
+global_args, args = main.parse_args(sys.argv[1:])
+print(global_args.profile, global_args.profile_mode, args._entry_func.__name__)
+"""
+
+# Parse arguments as the entrypoint does, then report which of the given modules were imported.
+PARSE_ARGS_IMPORTS = """
+import sys
+from furbox import main
+
+try:
+    main.parse_args(sys.argv[2:])
+except SystemExit:
+    pass
+
+print("imported:" + ",".join(sorted(module for module in sys.argv[1].split(",") if module in sys.modules)))
+"""
+
+# Dependencies of individual runners, which must not be imported unless their runner was selected.
+RUNNER_MODULES = ("bs4", "requests", "rich.prompt", "furbox.utils.progress_bar", "furbox.helpers.comic.custom")
+
+
+def run_python(*args: str) -> str:
+    """ Run a Python subprocess, returning the last line of its output. """
+    result = subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True)  # noqa: S603
+    return result.stdout.splitlines()[-1]
+
+
+@pytest.mark.parametrize(("argv", "expected"), [
+    (["--help"], ""),
+    (["e621", "--help"], ""),
+    (["watch", "--help"], ""),
+    (["e621", "fav-sync", "--help"], "furbox.utils.progress_bar,requests"),
+])
+def test_only_selected_runner_imported(argv: list[str], expected: str) -> None:
+    """ Only the dependencies of the selected runner should be imported while parsing arguments. """
+    assert run_python("-c", PARSE_ARGS_IMPORTS, ",".join(RUNNER_MODULES), *argv) == f"imported:{expected}"
+
+
+@pytest.mark.parametrize(("argv", "expected"), [
+    (["--profile", "e621", "fav-sync"], "True spans fav_sync"),
+    (["e621", "fav-sync", "--profile"], "True spans fav_sync"),
+    (["--profile-mode", "sample", "e621", "fav-sync"], "False sample fav_sync"),
+    (["--profile", "--profile-mode=cprofile", "e621", "fav-sync"], "True cprofile fav_sync"),
+    (["e621", "fav-sync"], "False spans fav_sync"),
+])
+def test_profile_arguments(argv: list[str], expected: str) -> None:
+    """ Profiling flags should be accepted before the runner name, without taking the runner name as their value. """
+    assert run_python("-c", PARSE_ARGS, *argv) == expected
+
+
+@pytest.mark.parametrize("exit_code", [None, 1])
+def test_run_runner_exit_code(exit_code: int | None) -> None:
+    """ The exit code returned by the selected runner should be returned, such that it reaches the shell. """
+    args = argparse.Namespace(_entry_func=lambda args, config: exit_code)  # noqa: ARG005
+    assert run_runner(args, Config()) == exit_code
@@ -0,0 +1,99 @@
+""" Tests of downloading posts at reduced quality tiers, against the stand-in e621 server. """
+from pathlib import Path
+from typing import Any
+
+from furbox.connectors.e621 import E621Connector
+from furbox.models.config import Config
+from furbox.models.e621 import ANIMATED_EXTENSIONS, Post
+from furbox.runners.e621.download import download_search
+from furbox.runners.e621.fav_sync import sync_favourites
+from tests.e621_server import E621Server, SAMPLE_WIDTH
+
+QUERY = "species_0"
+
+
+def has_sample(post: dict[str, Any]) -> bool:
+    """ Check if a post should be downloaded as its sample, as a still image larger than the sample size. """
+    return post["width"] > SAMPLE_WIDTH and post["ext"] not in ANIMATED_EXTENSIONS
+
+
+def test_select_file(e621_server: E621Server) -> None:
+    """ Posts should select their sample or preview, falling back to the original file where there is none. """
+    # Animated posts always fall back, as their samples and previews are only a single still frame.
+    data = e621_server.data
+    assert any(post["ext"] in ANIMATED_EXTENSIONS and post["width"] > SAMPLE_WIDTH for post in data.posts.values())
+    for post_data in data.posts.values():
+        post = Post.from_api(data.post_response(post_data, e621_server.url))
+        original_file = (Post.Quality.ORIGINAL, post.file_info.url, post.file_info.ext, post.file_info.size)
+
+        assert post.select_file(Post.Quality.ORIGINAL) == original_file
+        if post.file_info.ext in ANIMATED_EXTENSIONS:
+            assert post.select_file(Post.Quality.PREVIEW) == original_file
+        else:
+            assert post.select_file(Post.Quality.PREVIEW).url == e621_server.url + data.file_path(post_data, "preview")
+
+        sample_file = post.select_file(Post.Quality.SAMPLE)
+        assert sample_file.quality == (Post.Quality.SAMPLE if has_sample(post_data) else Post.Quality.ORIGINAL)
+        assert sample_file.ext == ("jpg" if has_sample(post_data) else post.file_info.ext)
+
+
+def test_quality_overrides(tmp_path: Path) -> None:
+    """ Directory overrides should take precedence over rating overrides, which take precedence over the default. """
+    e621_config = Config.E621(
+        username="furbox",
+        api_key="api_key",
+        quality=Post.Quality.SAMPLE,
+        rating_qualities=Config.E621.RatingQualities(explicit=Post.Quality.PREVIEW),
+        directory_qualities={tmp_path / "archive": Post.Quality.ORIGINAL},
+    )
+
+    assert e621_config.quality_for(tmp_path, Post.Rating.SAFE) == Post.Quality.SAMPLE
+    assert e621_config.quality_for(tmp_path, Post.Rating.SAFE, default=Post.Quality.PREVIEW) == Post.Quality.PREVIEW
+    assert e621_config.quality_for(tmp_path, Post.Rating.EXPLICIT, default=Post.Quality.SAMPLE) == \
+        Post.Quality.PREVIEW
+    assert e621_config.quality_for(tmp_path / "archive", Post.Rating.EXPLICIT) == Post.Quality.ORIGINAL
+
+
+def test_download_search_samples(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ Downloading at sample quality should fetch samples where they exist, using less bandwidth than originals. """
+    data = e621_server.data
+    post_ids = data.search(QUERY)
+    sampled_post_ids = [post_id for post_id in post_ids if has_sample(data.posts[post_id])]
+
+    assert download_search(e621_connector, QUERY, tmp_path, quality=lambda _: Post.Quality.SAMPLE) is None
+
+    assert e621_server.count("/data/sample/") == len(sampled_post_ids)
+    assert e621_server.count("/data/") == len(post_ids)
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) < \
+        sum(data.posts[post_id]["size"] for post_id in post_ids)
+    for post_id in sampled_post_ids:
+        assert (tmp_path / f"{post_id}.jpg").stat().st_size == data.scaled_size(data.posts[post_id], "sample")[2]
+
+
+def test_fav_sync_rating_quality(e621_server: E621Server, e621_connector: E621Connector, tmp_path: Path) -> None:
+    """ Favourites should be fetched at the quality tier of their rating, and reduced files kept on later syncs. """
+    fav_paths = {rating: tmp_path / rating for rating in ("safe", "questionable", "explicit")}
+    for path in fav_paths.values():
+        path.mkdir()
+    config = Config(e621=Config.E621(
+        username="furbox",
+        api_key="api_key",
+        fav_paths=Config.E621.FavPaths(**fav_paths),
+        rating_qualities=Config.E621.RatingQualities(explicit=Post.Quality.PREVIEW),
+    ))
+
+    assert sync_favourites(config, e621_connector=e621_connector) is None
+
+    favourites = [e621_server.data.posts[post_id] for post_id in e621_server.data.favourites]
+    explicit = [post for post in favourites if post["rating"] == Post.Rating.EXPLICIT]
+    previewed = [post for post in explicit if post["ext"] not in ANIMATED_EXTENSIONS]
+    assert e621_server.count("/data/preview/") == len(previewed)
+    assert e621_server.count("/data/") == len(favourites)
+    assert sorted(path.stat().st_size for path in fav_paths["explicit"].iterdir()) == sorted(
+        e621_server.data.scaled_size(post, "preview")[2] if post in previewed else post["size"] for post in explicit
+    )
+
+    # Previews cannot be verified against the hash of the original file, so must be kept rather than replaced.
+    assert sync_favourites(config, e621_connector=e621_connector) is None
+    assert e621_server.count("/data/") == len(favourites)
+    assert not list(fav_paths["explicit"].glob("_lq-*"))
@@ -0,0 +1,94 @@
+""" Tests of the offline search index, built from the posts database dump of the stand-in e621 server. """
+from pathlib import Path
+
+import pytest
+
+from furbox.connectors.e621 import E621DbConnector
+from furbox.connectors.search_index import decode_postings, encode_postings, SearchIndex
+from tests.e621_server import E621Server, SyntheticData
+
+
+@pytest.fixture(scope="module")
+def data() -> SyntheticData:
+    """ Synthetic posts to index. """
+    return SyntheticData(post_count=2000)
+
+
+@pytest.fixture(scope="module")
+def search_index(data: SyntheticData, tmp_path_factory: pytest.TempPathFactory) -> SearchIndex:
+    """ Search index of the synthetic posts dump. """
+    dump_path = tmp_path_factory.mktemp("dump") / "posts.csv.gz"
+    dump_path.write_bytes(data.database_dump("posts"))
+    return SearchIndex.build(dump_path)
+
+
+def test_postings_round_trip() -> None:
+    """ Decoding encoded postings should give back the same rows, including differences over a byte. """
+    rows = [0, 1, 2, 127, 128, 300, 16_384, 2**32 - 1]
+    assert decode_postings(encode_postings(rows)) == rows
+
+
+@pytest.mark.parametrize("query", [
+    "species_0",
+    "species_0 general_0",
+    "species_0 -general_0",
+    "rating:s general_1",
+    "-rating:e",
+    "id:>1500",
+    "id:<=20 species_0",
+    "id:5,50,500,5000",
+    "unknown_tag",
+    "",
+])
+def test_search_matches_server(query: str, data: SyntheticData, search_index: SearchIndex) -> None:
+    """ Searches should return the same posts in the same order as the stand-in server. """
+    assert [post.post_id for post in search_index.search(query)] == data.search(query)
+
+
+def test_search_metatags(data: SyntheticData, search_index: SearchIndex) -> None:
+    """ Numeric ranges, any of a group of tags, and orders other than by ID should match the posts fields. """
+    rows = {post_id: SyntheticData.post_row(post) for post_id, post in data.posts.items()}
+
+    posts = search_index.search("score:10..20 order:score")
+    assert [post.post_id for post in posts] == sorted(
+        (post_id for post_id in data.post_ids if 10 <= rows[post_id]["score"] <= 20),
+        key=lambda post_id: rows[post_id]["score"], reverse=True,
+    )
+
+    posts = search_index.search("~species_0 ~species_1 favcount:>=5 order:id_asc", offset=2, limit=10)
+    assert [post.post_id for post in posts] == [
+        post_id for post_id in sorted(data.posts)
+        if data.posts[post_id]["tag_set"] & {"species_0", "species_1"} and rows[post_id]["fav_count"] >= 5
+    ][2:12]
+
+    post = posts[0]
+    assert (post.md5, post.ext, post.size) == (rows[post.post_id]["md5"], rows[post.post_id]["file_ext"],
+                                               rows[post.post_id]["file_size"])
+
+
+@pytest.mark.parametrize("query", [
+    "rating:x", "score:>>1", "order:random", "fav:furbox", "id:1,a", "type:webm", "-md5:abc", "~width:>100",
+    "species_0 filesize:<1000",
+])
+def test_invalid_queries(query: str, search_index: SearchIndex) -> None:
+    """ Metatags which are invalid or cannot be resolved offline should be rejected, rather than matching nothing. """
+    with pytest.raises(ValueError, match=r"Invalid|offline"):
+        search_index.search(query)
+
+
+def test_load_or_build(e621_server: E621Server, tmp_path: Path) -> None:
+    """ The index should be built once for a posts dump, then loaded until the dump changes. """
+    db_connector = E621DbConnector(tmp_path, base_url=e621_server.url)
+    built = SearchIndex.load_or_build(db_connector)
+    index_path = db_connector.cache.resolve_path(SearchIndex.FILE_NAME)
+    built_time = index_path.stat().st_mtime_ns
+
+    loaded = SearchIndex.load_or_build(db_connector)
+    assert index_path.stat().st_mtime_ns == built_time
+    assert loaded is not built
+    assert loaded.search("species_0 order:score") == built.search("species_0 order:score")
+    assert len(loaded) == len(e621_server.data.posts)
+
+    # A replaced dump must be indexed again.
+    db_connector.get_posts_file().write_bytes(SyntheticData(post_count=10).database_dump("posts"))
+    assert len(SearchIndex.load_or_build(db_connector)) == 10